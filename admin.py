@@ -27,7 +27,7 @@ from contify.website_tracking.change_log import (
 )
 from contify.website_tracking.forms import WebSourceAdminForm
 from contify.website_tracking.models import (
-    WebSource, WebClientSource, WebUpdate
+    WebSource, WebClientSource, WebUpdate, DomainConsent, WorkItem
 )
 from contify.website_tracking.web_snapshot.models import (
     WebSnapshot, DiffContent, DiffHtml
@@ -436,7 +436,9 @@ class WebSnapshotAdmin(admin.ModelAdmin):
                 "fields": (
                     ("web_source_id", "hash_html"),
                     ("status", "state"),
-                    ("raw_html", ),
+                    ("_raw_html", ),
+                    ("raw_html_key", ),
+                    ("delta_base_id", "delta_keyframe_id", "delta_depth"),
                     ("created_on", "updated_on"),
                     ("last_error", ),
                     ("raw_snapshot", "_raw_snapshot", ),
@@ -447,7 +449,8 @@ class WebSnapshotAdmin(admin.ModelAdmin):
 
     readonly_fields = (
         "created_on", "updated_on", "_raw_snapshot", "_web_source",
-        "last_error"
+        "last_error", "raw_html_key", "delta_base_id", "delta_keyframe_id",
+        "delta_depth"
     )
 
     def has_view_or_change_permission(self, request, obj=None):
@@ -507,6 +510,49 @@ class DiffHtmlAdmin(admin.ModelAdmin):
         return has_website_tracking_access(request)
 
 
+class DomainConsentAdmin(admin.ModelAdmin):
+    """Deleting an entry makes the fetch job discover the dialog again."""
+
+    list_display = ("domain", "strategy", "selector", "updated_on")
+
+    list_filter = ("strategy", "updated_on")
+
+    search_fields = ("domain", )
+
+    readonly_fields = ("created_on", "updated_on")
+
+    formfield_overrides = {
+        JSONField: {'widget': Textarea(attrs={'rows': 30, 'cols': 90})},
+    }
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_view_or_change_permission(self, request, obj=None):
+        return has_website_tracking_access(request)
+
+
+class WorkItemAdmin(admin.ModelAdmin):
+    """Failed items are queued again by the next --enqueue run."""
+
+    list_display = (
+        "id", "queue", "object_id", "status", "attempts", "available_on",
+        "leased_by", "leased_until", "updated_on"
+    )
+
+    list_filter = ("queue", "status")
+
+    search_fields = ("object_id", "leased_by")
+
+    readonly_fields = ("created_on", "updated_on")
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_view_or_change_permission(self, request, obj=None):
+        return has_website_tracking_access(request)
+
+
 class ClientSourceTagInline(AutocompleteStackedInline):
     extra = 1
 
@@ -616,8 +662,11 @@ class WebSourceAdmin(AutocompleteModelAdmin):
                     ('comment', ),
                     ('junk_xpaths', 'accept_cookie_xpaths'),
                     ('pyppeteer_networkidle', 'screenshot_sleep_time'),
+                    ('domain_rate_limit', 'domain_rate_burst'),
+                    ('skip_preflight', ),
                     ('created_by', 'updated_by', 'created_on', 'updated_on'),
                     ("last_run", "last_error"),
+                    ("settle_time", ),
                     ("published_by_company", ),
                     ("content_source", ),
                 )
@@ -626,7 +675,8 @@ class WebSourceAdmin(AutocompleteModelAdmin):
     )
 
     readonly_fields = (
-        'created_on', 'updated_on', "created_by", "updated_by", "last_error"
+        'created_on', 'updated_on', "created_by", "updated_by", "last_error",
+        "settle_time"
     )
 
     related_search_fields = {
@@ -1036,3 +1086,5 @@ cfy_admin_site.register(DiffHtml, DiffHtmlAdmin)
 cfy_admin_site.register(DiffContent, DiffContentAdmin)
 cfy_admin_site.register(WebClientSource, WebClientSourceAdmin)
 cfy_admin_site.register(WebUpdate, WebUpdateAdmin)
+cfy_admin_site.register(DomainConsent, DomainConsentAdmin)
+cfy_admin_site.register(WorkItem, WorkItemAdmin)
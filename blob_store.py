@@ -0,0 +1,129 @@
+"""
+Compressed, content-addressed blob store of WebSnapshot.raw_html.
+
+A blob is stored under a key derived from the hash_html of its WebSnapshot
+(e.g. "web_track/raw_html/3f/3f2a...c1.html.zst"), so storing the same
+page twice writes it once. Blobs are compressed with zstd, or with zlib when
+the `zstandard` package is not installed; the first byte of a blob tells
+its codec so both can be read back.
+
+Backends (constants.RAW_HTML_BLOB_BACKEND):
+-   "filesystem": FileSystemStorage rooted at RAW_HTML_BLOB_DIR.
+-   "s3": the S3 storage of utils.get_storage (RAW_HTML_BLOB_BUCKET).
+-   "": raw_html stays in the DB (default).
+
+Usage:
+    blob_store = get_blob_store()
+    key = blob_store.put(wss.hash_html, wss.raw_html)
+    raw_html = blob_store.get(key)
+"""
+import logging
+import re
+import zlib
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+
+from contify.website_tracking.constants import (
+    RAW_HTML_BLOB_BACKEND, RAW_HTML_BLOB_BUCKET, RAW_HTML_BLOB_DIR,
+    RAW_HTML_BLOB_PREFIX
+)
+from contify.website_tracking.utils import get_storage
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+logger = logging.getLogger(__name__)
+
+CODEC_ZSTD = b"z"
+CODEC_ZLIB = b"d"
+ZSTD_LEVEL = 10
+ZLIB_LEVEL = 6
+
+
+def compress(data):
+    """Compresses the bytes, the codec byte is prepended."""
+    if zstandard is not None:
+        return CODEC_ZSTD + zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(
+            data
+        )
+    return CODEC_ZLIB + zlib.compress(data, ZLIB_LEVEL)
+
+
+def decompress(blob):
+    codec, data = blob[:1], blob[1:]
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError(
+                "The zstandard package is needed to read zstd blobs."
+            )
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(data)
+    raise ValueError(f"Unknown blob codec: {codec!r}")
+
+
+class BlobStore:
+    """Stores compressed text blobs in a Django Storage."""
+
+    def __init__(self, storage, prefix=RAW_HTML_BLOB_PREFIX):
+        self.storage = storage
+        self.prefix = prefix
+
+    def get_key(self, content_hash, kind="html"):
+        content_hash = re.sub(r"[^\w-]", "_", content_hash)
+        extension = "zst" if zstandard is not None else "zz"
+        return (
+            f"{self.prefix}{content_hash[-2:]}/{content_hash}.{kind}.{extension}"
+        )
+
+    def exists(self, key):
+        return self.storage.exists(key)
+
+    def put(self, content_hash, text, kind="html"):
+        """
+        Stores the text under the key of `content_hash` unless it already
+        exists, returns the key.
+        """
+        key = self.get_key(content_hash, kind)
+        if not self.storage.exists(key):
+            saved_key = self.storage.save(
+                key, ContentFile(compress(text.encode("utf-8")))
+            )
+            if saved_key != key:
+                # Written concurrently by another process, keep the first one
+                logger.info(f"BlobStore! {key} saved as {saved_key}")
+                self.storage.delete(saved_key)
+        return key
+
+    def get(self, key):
+        with self.storage.open(key, "rb") as f:
+            return decompress(f.read()).decode("utf-8")
+
+    def delete(self, key):
+        self.storage.delete(key)
+
+
+_blob_store = None
+
+
+def get_blob_store():
+    """
+    Returns the BlobStore of the configured backend, None when raw_html is
+    kept in the DB.
+    """
+    global _blob_store
+    if _blob_store is None and RAW_HTML_BLOB_BACKEND:
+        if RAW_HTML_BLOB_BACKEND == "s3":
+            storage = get_storage(RAW_HTML_BLOB_BUCKET or None)
+        elif RAW_HTML_BLOB_BACKEND == "filesystem":
+            storage = FileSystemStorage(location=RAW_HTML_BLOB_DIR)
+        else:
+            raise ValueError(
+                f"Unknown raw_html blob backend: {RAW_HTML_BLOB_BACKEND}"
+            )
+        _blob_store = BlobStore(storage)
+    return _blob_store
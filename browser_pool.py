@@ -0,0 +1,202 @@
+"""
+A pool of Playwright browsers and contexts used by the fetch job.
+
+The pool launches `browsers` Chromium instances and runs
+`browsers * pages_per_browser` workers on top of them. Every worker owns a
+browser context (rotated after `context_rotate_after` pages) and pulls
+items from a bounded asyncio queue, so the number of pages open at a time
+grows with the pool size instead of being fixed.
+
+Items that share a domain are limited by a per-domain semaphore
+(`domain_concurrency`) and paced by a DomainRateLimiter, which keeps the
+fetcher polite even when many workers are running.
+
+Usage:
+    async with async_playwright() as p:
+        async with BrowserPool(p, browsers=2, pages_per_browser=4) as pool:
+            await pool.run(ws_list, handler, key=lambda ws: ws.domain)
+"""
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from contify.website_tracking.constants import (
+    DEFAULT_VIEWPORT_WIDTH, DEFAULT_VIEWPORT_HEIGHT, CONTEXT_DICT
+)
+from contify.website_tracking.rate_limiter import DomainRateLimiter
+
+
+logger = logging.getLogger(__name__)
+
+BROWSER_LAUNCH_ARGS = [
+    "--no-sandbox",
+    "--disable-http2",
+    "--disable-setuid-sandbox",
+    f"--window-size={DEFAULT_VIEWPORT_WIDTH},{DEFAULT_VIEWPORT_HEIGHT}",
+]
+
+
+class BrowserPool:
+    """
+    N browsers x M pages fed by a bounded work queue, with a per-domain
+    concurrency limit.
+    """
+
+    def __init__(self, playwright, browsers=1, pages_per_browser=2,
+                 domain_concurrency=1, rate_limiter=None,
+                 context_rotate_after=10, context_open_delay=1,
+                 context_options=None):
+        self.playwright = playwright
+        self.browsers = max(browsers, 1)
+        self.pages_per_browser = max(pages_per_browser, 1)
+        self.domain_concurrency = max(domain_concurrency, 1)
+        self.rate_limiter = rate_limiter or DomainRateLimiter()
+        self.context_rotate_after = max(context_rotate_after, 1)
+        self.context_open_delay = context_open_delay
+        self.context_options = context_options or CONTEXT_DICT
+
+        self._browsers = []
+        self._domain_semaphores = {}
+
+    @property
+    def size(self):
+        """Number of pages that can be processed at the same time."""
+        return self.browsers * self.pages_per_browser
+
+    async def start(self):
+        for _ in range(self.browsers):
+            browser = await self.playwright.chromium.launch(
+                headless=True, args=BROWSER_LAUNCH_ARGS
+            )
+            self._browsers.append(browser)
+        logger.info(
+            f"BrowserPool started | Browsers: {self.browsers} | "
+            f"Pages per browser: {self.pages_per_browser} | "
+            f"Domain concurrency: {self.domain_concurrency}"
+        )
+        return self
+
+    async def close(self):
+        for browser in self._browsers:
+            try:
+                await browser.close()
+            except Exception as err:
+                logger.info(f"BrowserPool! Unable to close browser: {err}")
+        self._browsers = []
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    @staticmethod
+    def interleave_by_domain(items, key=None):
+        """
+        Orders the items round-robin by domain (keeping the original order
+        inside a domain) so that consecutive queue items rarely wait on the
+        same domain slot.
+        """
+        if key is None:
+            return list(items)
+
+        groups = OrderedDict()
+        for item in items:
+            groups.setdefault(key(item), deque()).append(item)
+
+        ordered = []
+        while groups:
+            for domain in list(groups):
+                ordered.append(groups[domain].popleft())
+                if not groups[domain]:
+                    del groups[domain]
+        return ordered
+
+    @asynccontextmanager
+    async def domain_slot(self, domain):
+        """
+        Holds one of the `domain_concurrency` slots of the given domain and
+        waits for a token of the domain from the rate limiter.
+        """
+        if not domain:
+            yield
+            return
+
+        semaphore = self._domain_semaphores.get(domain)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.domain_concurrency)
+            self._domain_semaphores[domain] = semaphore
+
+        async with semaphore:
+            await self.rate_limiter.acquire(domain)
+            yield
+
+    async def run(self, items, handler, key=None):
+        """
+        Calls `await handler(context, item)` for every item using all the
+        workers of the pool. `key(item)` returns the domain of the item.
+        The error of a worker (e.g. unable to open a context) is raised at
+        once, the producer would otherwise wait forever on the full queue.
+        """
+        if not self._browsers:
+            raise RuntimeError("BrowserPool is not started.")
+
+        queue = asyncio.Queue(maxsize=self.size * 2)
+        workers = [
+            asyncio.ensure_future(self._worker(worker_no, queue, handler, key))
+            for worker_no in range(self.size)
+        ]
+
+        async def produce():
+            for item in self.interleave_by_domain(items, key):
+                await queue.put(item)
+            for _ in workers:
+                await queue.put(None)
+
+        tasks = [asyncio.ensure_future(produce())] + workers
+        try:
+            done, _ = await asyncio.wait(
+                tasks, return_when=asyncio.FIRST_EXCEPTION
+            )
+            for task in done:
+                # Raises the exception of a failed worker or producer
+                task.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def _worker(self, worker_no, queue, handler, key):
+        browser = self._browsers[worker_no % len(self._browsers)]
+        context = None
+        processed = 0
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+
+                # Rotate the context every `context_rotate_after` pages
+                if context is None or processed >= self.context_rotate_after:
+                    if context:
+                        await context.close()
+                    context = await browser.new_context(**self.context_options)
+                    processed = 0
+                    await asyncio.sleep(self.context_open_delay)
+
+                async with self.domain_slot(key(item) if key else None):
+                    try:
+                        await handler(context, item)
+                    except Exception as err:
+                        logger.exception(
+                            f"BrowserPool! Worker: {worker_no} | Unexpected "
+                            f"error while processing {item}: {err}"
+                        )
+                processed += 1
+        finally:
+            if context:
+                try:
+                    await context.close()
+                except Exception:
+                    pass
@@ -44,3 +44,26 @@ class DiffStatus(IntEnum):
     PENDING = 0
     REJECT = 1
     PUBLISHED = 2
+
+
+@unique
+class ConsentStrategy(IntEnum):
+    NO_DIALOG = 0
+    XPATH = 1
+    TEXT = 2
+
+
+@unique
+class WorkQueue(IntEnum):
+    FETCH_WEB_SOURCE = 0
+    PROCESS_WEB_SNAPSHOT = 1
+    PROCESS_DIFF_HTML = 2
+    ARCHIVE_DATA = 3
+
+
+@unique
+class WorkItemStatus(IntEnum):
+    PENDING = 0
+    LEASED = 1
+    DONE = 2
+    FAILED = 3
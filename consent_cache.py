@@ -0,0 +1,181 @@
+"""
+Cookie-consent cache of the fetch job, keyed by WebSource.domain.
+
+The first fetch of a domain discovers the consent dialog as usual
+(accept_cookie_xpaths) and stores in DomainConsent the strategy that
+accepted it, or NO_DIALOG when none of the XPaths matches anything on the
+loaded page, with the consent cookies of the page. A discovery that did not
+accept the dialog (click failed, XPath matching a hidden element, ...) is
+not stored, the next fetch discovers again. Later fetches inject the
+cookies before the navigation and only check that the cached selector is
+not visible any more, the dialog discovery (3 secs wait per XPath) is
+skipped. The discovery runs again when the cached strategy fails, the
+dialog of a NO_DIALOG domain shows up, or the entry is older than
+CONSENT_CACHE_TTL days.
+
+Usage:
+    consent_cache = ConsentCache.load(domains)
+    consent = await consent_cache.inject(page, ws_obj)
+    await page.goto(...)
+    if not await consent_cache.replay(page, consent):
+        results = [await handle_cookie_dialog(page, xpath=x) for x in xpaths]
+        await consent_cache.record(page, ws_obj, results)
+"""
+import logging
+import time
+from datetime import datetime, timedelta
+
+from asgiref.sync import sync_to_async
+
+from contify.website_tracking.cfy_enum import ConsentStrategy
+from contify.website_tracking.constants import CONSENT_CACHE_TTL
+from contify.website_tracking.models import DomainConsent
+from contify.website_tracking.utils import pause
+
+
+logger = logging.getLogger(__name__)
+
+
+class ConsentCache:
+    """DomainConsent entries of the domains fetched in a run."""
+
+    def __init__(self, consents=None, ttl=CONSENT_CACHE_TTL):
+        self.ttl = ttl
+        self._consents = consents or {}
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, domains, ttl=CONSENT_CACHE_TTL):
+        """Loads the fresh DomainConsent entries of the given domains."""
+        consents = DomainConsent.objects.filter(
+            domain__in={domain for domain in domains if domain},
+            updated_on__gte=datetime.now() - timedelta(days=ttl)
+        )
+        return cls({consent.domain: consent for consent in consents}, ttl)
+
+    def get(self, domain):
+        return self._consents.get(domain) if domain else None
+
+    async def inject(self, page, ws_obj):
+        """
+        Adds the cached consent cookies of the WebSource domain to the
+        context of the page, returns the DomainConsent or None.
+        """
+        consent = self.get(ws_obj.domain)
+        if consent is None:
+            self.misses += 1
+            return None
+
+        now = time.time()
+        cookies = [
+            cookie for cookie in consent.cookies
+            if cookie.get("expires", -1) in (-1, None) or cookie["expires"] > now
+        ]
+        if consent.strategy != ConsentStrategy.NO_DIALOG.value and not cookies:
+            # Consent cookies expired, the dialog has to be accepted again
+            self.misses += 1
+            return None
+
+        if cookies:
+            try:
+                await page.context.add_cookies(cookies)
+            except Exception as err:
+                logger.info(
+                    f"ConsentCache! Unable to add cookies for domain: "
+                    f"{ws_obj.domain} | Error: {err}"
+                )
+                self.misses += 1
+                return None
+
+        self.hits += 1
+        return consent
+
+    async def replay(self, page, consent, settle=False):
+        """
+        Returns True when the cached strategy handled the consent: no dialog
+        is expected, or the dialog is not shown thanks to the cookies, or it
+        is shown and the cached selector accepted it. False means that the
+        discovery has to run.
+        """
+        if consent is None:
+            return False
+
+        if consent.strategy == ConsentStrategy.NO_DIALOG.value:
+            if not consent.selector:
+                return True
+            # The XPath checked by the discovery, a dialog added since
+            try:
+                return not await page.locator(
+                    f"xpath={consent.selector}"
+                ).first.is_visible()
+            except Exception:
+                return False
+
+        if consent.strategy == ConsentStrategy.XPATH.value:
+            locator = page.locator(f"xpath={consent.selector}").first
+        else:
+            locator = page.locator("button, a").filter(
+                has_text=consent.selector
+            ).first
+
+        try:
+            if not await locator.is_visible():
+                return True
+            await locator.click()
+            await pause(page, 1000, settle=settle)
+        except Exception as err:
+            logger.info(
+                f"ConsentCache! Cached strategy failed for domain: "
+                f"{consent.domain} | Error: {err}"
+            )
+            return False
+        return True
+
+    async def record(self, page, ws_obj, results):
+        """
+        Stores the outcome of the handle_cookie_dialog results of the
+        accept_cookie_xpaths, with the current cookies of the page for the
+        WebSource domain: the strategy that accepted the dialog, else
+        NO_DIALOG if every XPath matched nothing. Nothing is stored when
+        the dialog was not accepted.
+        """
+        if not ws_obj.domain:
+            return
+
+        accepted = next((
+            result for result in results
+            if result and result[0] != ConsentStrategy.NO_DIALOG
+        ), None)
+        if accepted:
+            strategy, selector = accepted
+        elif results and all(results):
+            strategy, selector = results[0]
+        else:
+            logger.info(
+                f"ConsentCache! Dialog not accepted, nothing cached for "
+                f"domain: {ws_obj.domain}"
+            )
+            return
+
+        try:
+            cookies = await page.context.cookies(page.url)
+        except Exception:
+            cookies = []
+
+        consent = await sync_to_async(save_domain_consent)(
+            ws_obj.domain, strategy.value, selector, cookies
+        )
+        self._consents[ws_obj.domain] = consent
+
+    def stats(self):
+        return f"Hits: {self.hits} | Misses: {self.misses}"
+
+
+def save_domain_consent(domain, strategy, selector, cookies):
+    consent, _ = DomainConsent.objects.update_or_create(
+        domain=domain, defaults={
+            "strategy": strategy, "selector": selector, "cookies": cookies
+        }
+    )
+    return consent
@@ -145,3 +145,65 @@ CONTEXT_DICT = {
         "Access-Control-Allow-Origin": "*",
     },
 }
+
+# Fetch job politeness (requests per minute and bucket size per domain)
+DEFAULT_DOMAIN_RATE_LIMIT = 20
+DEFAULT_DOMAIN_RATE_BURST = 1
+DOMAIN_RATE_LIMIT_DB = "/tmp/wst_domain_rate_limit.sqlite3"
+PREFLIGHT_TIMEOUT = 30  # Seconds, timeout of the pre-flight HTTP request
+
+# Resource types aborted in the first phase of the two-phase fetch
+BLOCKED_RESOURCE_TYPES = ("image", "media", "font")
+
+# Deferred screenshot stage (capture_web_snapshot)
+CACHEABLE_RESOURCE_TYPES = ("stylesheet", "image", "font", "script")
+RESOURCE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Runs after which a WebSnapshot whose capture keeps failing is not selected
+CAPTURE_MAX_ATTEMPTS = 3
+
+# Adaptive settle detection (fetch_web_source --settleMode adaptive)
+SETTLE_QUIET_MS = 300  # DOM quiet period after which the page is settled
+
+# Cookie-consent cache (fetch_web_source --consentCache)
+CONSENT_CACHE_TTL = 7  # Days after which the dialog is discovered again
+
+# On-disk HTTP cache of static assets (fetch_web_source --httpCache)
+HTTP_CACHE_DIR = "/tmp/wst_http_cache"
+HTTP_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+HTTP_CACHE_DEFAULT_TTL = 24 * 60 * 60  # Seconds, used without max-age
+
+# Buffered WebSource updates of the fetch job
+UPDATE_BUFFER_SIZE = 50  # WebSources per bulk UPDATE
+UPDATE_BUFFER_INTERVAL = 30  # Seconds, max delay of a buffered update
+
+# Blob store of WebSnapshot.raw_html ("", "filesystem" or "s3")
+RAW_HTML_BLOB_BACKEND = env("WST_RAW_HTML_BLOB_BACKEND", default="")
+RAW_HTML_BLOB_DIR = env("WST_RAW_HTML_BLOB_DIR", default="/data/wst_blobs")
+RAW_HTML_BLOB_BUCKET = env("WST_RAW_HTML_BLOB_BUCKET", default="")
+RAW_HTML_BLOB_PREFIX = "web_track/raw_html/"
+
+# Delta chains of the offloaded raw_html, a keyframe (full html) every N
+# WebSnapshots of a WebSource and deltas in between (0 or 1 disables them)
+RAW_HTML_KEYFRAME_INTERVAL = int(
+    env("WST_RAW_HTML_KEYFRAME_INTERVAL", default=0)
+)
+RAW_HTML_MAX_DELTA_RATIO = 0.5  # Larger deltas are stored as a keyframe
+RAW_HTML_CACHE_MAX_BYTES = 128 * 1024 * 1024  # Reconstructed raw_html LRU
+
+# DB-backed work queue of the pipeline commands (--enqueue / --worker)
+WORK_LEASE_SECONDS = 10 * 60  # Visibility timeout, extended by heartbeats
+WORK_POLL_INTERVAL = 15  # Seconds a worker sleeps when its queue is empty
+WORK_MAX_ATTEMPTS = 3
+WORK_RETRY_DELAY = 5 * 60  # Seconds, multiplied by the attempts
+WORK_ITEM_RETENTION = 7  # Days the done and failed items are kept
+
+# Event-driven handoff between the stages: a new WebSnapshot is queued for
+# process_web_snapshot and a new DiffHtml for process_diff_html as soon as
+# they are committed, the --worker of the stage is woken up by a NOTIFY.
+WORK_HANDOFF = bool(int(env("WST_WORK_HANDOFF", default=0)))
+# Backpressure, no handoff to a stage with this many pending items (the
+# objects are then queued by the next --enqueue run of the stage)
+WORK_MAX_PENDING = {
+    "PROCESS_WEB_SNAPSHOT": 5000,
+    "PROCESS_DIFF_HTML": 2000,
+}
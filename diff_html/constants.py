@@ -129,3 +129,44 @@ EXTRACT_TEXT_XPATH = (
         " or ".join(map(lambda i: "self::" + i, IGNORE_DIFF_TAGS))
     )
 )
+
+
+# Tracker/advertising URL patterns, ignored by the diff and blocked by the
+# fetch job (--blockResources)
+JUNK_URL_PATTERNS = (
+    "bat.bing.com",
+    "bat.bing.net",
+    "td.doubleclick.net",
+    "doubleclick.net",
+    "googleadservices.com",
+    "pixel.wp.com",
+    "googlesyndication.com",
+    "analytics.twitter.com",
+    "google-analytics.com",
+    "images/blank.png",
+    "bat.bing"
+)
+
+# Seconds a diff (CFYDiffer.match) may take
+DIFF_TIMEOUT = 300
+# Node comparisons a diff may make, None for no limit
+DIFF_MAX_COMPARISONS = None
+# "scan" compares every pair of unmatched nodes, "indexed" pairs identical
+# subtrees first and compares the others with indexed candidates only
+DIFF_MATCH_STRATEGY = "scan"
+# Match the identical subtrees (Merkle hashes) before any ratio, diff() does
+# not walk into them. Off until benchmark_diff_match shows the same actions
+# as the scan on production snapshot pairs
+DIFF_SUBTREE_MATCH = False
+# Pairs of nodes whose leaf_ratio (text ratio) is cached during a match
+LEAF_RATIO_CACHE_SIZE = 200000
+# The DiffPool kills a diff later than the budget of the matcher, which
+# only covers match() and reports how far it got
+DIFF_POOL_TIMEOUT = DIFF_TIMEOUT + 60
+# Token diff of HTMLMatcher (sequence_match.py): "difflib" is
+# SequenceMatcher, "patience" the patience diff over interned tokens
+# (token_diff.py)
+SEQUENCE_DIFF_ALGORITHM = "difflib"
+# Edits after which Myers' diff of a region without any anchor gives up and
+# replaces the region
+MYERS_MAX_COST = 1000
@@ -0,0 +1,134 @@
+"""
+Indexed matching of CFYDiffer.match (match_strategy="indexed").
+
+The "scan" strategy compares every unmatched left node with every unmatched
+right node (node_ratio), tens of millions of comparisons on a page of 10k
+nodes. The indexed strategy matches in two phases:
+
+1.  Exact: the nodes are bucketed by their subtree signature (tag, text and
+    the signatures of their children), a left node takes the first
+    unmatched right node of its bucket.
+2.  Fuzzy: a left node without an exact match is compared with the
+    unmatched right nodes of the same tag only, all of them when there are
+    at most FUZZY_SCAN_LIMIT, otherwise the ones under the same parent path
+    and the TOP_CANDIDATES ones sharing the most text shingles.
+
+As in the scan, a left node takes the first candidate (document order) with
+a ratio of 1.0, else the first one with the best ratio, if at least F. The
+matches can differ from the scan for nodes whose tag changed or whose best
+match was not a candidate, the benchmark_diff_match command compares both
+strategies on real snapshot pairs.
+"""
+from collections import Counter, defaultdict, deque
+
+from xmldiff import utils
+
+
+FUZZY_SCAN_LIMIT = 200
+TOP_CANDIDATES = 50
+# Shingles of more right nodes (e.g. a common class) select nothing
+MAX_POSTING = 500
+PARENT_PATH_DEPTH = 3
+
+
+def get_signatures(root, text_fn):
+    """
+    Subtree signature of every node of the tree, keyed by the node (which
+    keeps the lxml proxies alive, their id() would change otherwise).
+    """
+    signatures = {}
+    for node in utils.post_order_traverse(root):
+        text = text_fn(node) if isinstance(node.tag, str) else node.text
+        signatures[node] = hash((
+            node.tag, text, tuple(signatures[child] for child in node)
+        ))
+    return signatures
+
+
+def get_parent_path(node):
+    path = []
+    parent = node.getparent()
+    while parent is not None and len(path) < PARENT_PATH_DEPTH:
+        path.append(parent.tag)
+        parent = parent.getparent()
+    return tuple(path)
+
+
+def get_shingles(text):
+    words = text.split()
+    if len(words) < 2:
+        return set(words)
+    return {f"{a} {b}" for a, b in zip(words, words[1:])}
+
+
+class MatchIndex:
+    """Index of the unmatched right nodes, in document order."""
+
+    def __init__(self, rnodes, text_fn, signatures):
+        self.text_fn = text_fn
+        self.order = {}
+        self.alive = {}
+        self.by_signature = defaultdict(deque)
+        self.by_tag = defaultdict(dict)
+        self.by_parent_path = defaultdict(dict)
+        self.by_shingle = defaultdict(dict)
+        # The buckets of a node, to remove it
+        self.node_keys = {}
+
+        for position, node in enumerate(rnodes):
+            node_id = id(node)
+            self.order[node_id] = position
+            self.alive[node_id] = node
+            self.by_signature[signatures[node]].append(node)
+
+            keys = [
+                (self.by_tag, node.tag),
+                (self.by_parent_path, (node.tag, get_parent_path(node))),
+            ]
+            if isinstance(node.tag, str):
+                keys.extend(
+                    (self.by_shingle, (node.tag, shingle))
+                    for shingle in get_shingles(text_fn(node))
+                )
+            for buckets, key in keys:
+                buckets[key][node_id] = node
+            self.node_keys[node_id] = keys
+
+    def remove(self, node):
+        node_id = id(node)
+        self.alive.pop(node_id, None)
+        for buckets, key in self.node_keys.pop(node_id, []):
+            buckets[key].pop(node_id, None)
+
+    def pop_exact(self, signature):
+        """The first unmatched right node of the signature, if any."""
+        bucket = self.by_signature.get(signature)
+        while bucket:
+            node = bucket.popleft()
+            if id(node) in self.alive:
+                return node
+        return None
+
+    def candidates(self, node):
+        """The unmatched right nodes worth a node_ratio, in document order."""
+        pool = self.by_tag.get(node.tag)
+        if not pool:
+            return []
+        if len(pool) <= FUZZY_SCAN_LIMIT:
+            return list(pool.values())
+
+        found = {}
+        same_path = self.by_parent_path.get((node.tag, get_parent_path(node)))
+        if same_path and len(same_path) <= FUZZY_SCAN_LIMIT:
+            found.update(same_path)
+
+        if isinstance(node.tag, str):
+            counts = Counter()
+            for shingle in get_shingles(self.text_fn(node)):
+                posting = self.by_shingle.get((node.tag, shingle))
+                if posting and len(posting) <= MAX_POSTING:
+                    counts.update(posting.keys())
+            for node_id, _ in counts.most_common(TOP_CANDIDATES):
+                found[node_id] = self.alive[node_id]
+
+        return sorted(found.values(), key=lambda rnode: self.order[id(rnode)])
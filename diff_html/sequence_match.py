@@ -1,10 +1,14 @@
 
 import logging
+from collections import deque
 from copy import copy
 from difflib import SequenceMatcher
 from io import BytesIO
 
 from contify.website_tracking.diff_html import constants
+from contify.website_tracking.diff_html.token_diff import (
+    TokenInterner, get_matching_blocks
+)
 from contify.website_tracking.diff_html.utils import (
     get_spacing, utf8_encode, utf8_decode, strip_tags, split_html,
     whitespacegen
@@ -29,24 +33,23 @@ class TagIter(object):
     """Iterable that returns tags in sequence."""
 
     def __init__(self, html_string):
-        self.html_string = html_string
+        # Decoded once, not for every token
+        self.html_string = utf8_decode(html_string)
         self.pos = 0
         self.end_reached = False
-        self.buffer = []
+        self.buffer = deque()
 
     def __iter__(self):
         return self
 
     def __next__(self):
         if self.buffer:
-            return self.buffer.pop(0)
+            return self.buffer.popleft()
 
         if self.end_reached:
             raise StopIteration
 
-        match = constants.TAG_RE.search(
-            utf8_decode(self.html_string), pos=self.pos
-        )
+        match = constants.TAG_RE.search(self.html_string, pos=self.pos)
         if not match:
             self.end_reached = True
             return self.html_string[self.pos:]
@@ -91,8 +94,15 @@ class HTMLMatcher(SequenceMatcher):
     #     '.tagDelete {\n\tbackground-color: #700;\n\tcolor: #FFF\n}\n'
     # )
 
-    def __init__(self, source1, source2, accurate_mode):
+    def __init__(
+        self, source1, source2, accurate_mode,
+        algorithm=constants.SEQUENCE_DIFF_ALGORITHM
+    ):
         logger.debug('Initializing HTMLMatcher...')
+        if algorithm not in {"difflib", "patience"}:
+            raise ValueError(f"Unknown diff algorithm: {algorithm}")
+        self.algorithm = algorithm
+        self.accurate_mode = accurate_mode
         if accurate_mode:
             logger.debug('Using accurate mode')
             super().__init__(lambda x: False, source1, source2, False)
@@ -114,6 +124,24 @@ class HTMLMatcher(SequenceMatcher):
     def set_seqs(self, a, b):
         super().set_seqs(self.split_html(a), self.split_html(b))
 
+    def get_matching_blocks(self):
+        if self.algorithm == "difflib" or self.matching_blocks is not None:
+            return super().get_matching_blocks()
+
+        logger.debug('Using the patience diff')
+        interner = TokenInterner()
+        a_ids = interner.ids(self.a)
+        b_ids = interner.ids(self.b)
+        is_anchor = None
+        if not self.accurate_mode:
+            junk_ids = {
+                token_id for token, token_id in interner.token_ids.items()
+                if is_junk(token)
+            }
+            is_anchor = lambda token_id: token_id not in junk_ids
+        self.matching_blocks = get_matching_blocks(a_ids, b_ids, is_anchor)
+        return self.matching_blocks
+
     def split_html(self, t):
         logger.debug('Splitting html into tag pieces and words')
         result = []
@@ -253,7 +281,9 @@ class HTMLMatcher(SequenceMatcher):
         ))
 
 
-def diff_strings(orig, new, accurate_mode):
+def diff_strings(
+    orig, new, accurate_mode, algorithm=constants.SEQUENCE_DIFF_ALGORITHM
+):
     """
     Given two strings of html, return a diffed string.
 
@@ -263,17 +293,22 @@ def diff_strings(orig, new, accurate_mode):
     :param new: new string for comparision against original string
     :type accurate_moode: boolean
     :param accurate_moode: use accurate mode or not
+    :type algorithm: string
+    :param algorithm: "difflib" or "patience"
     :returns: string containing diffed html
     """
     # Make sure we are dealing with bytes...
     orig = utf8_encode(orig)
     new = utf8_encode(new)
     logger.debug('Beginning to diff strings...')
-    h = HTMLMatcher(orig, new, accurate_mode)
+    h = HTMLMatcher(orig, new, accurate_mode, algorithm)
     return h.diff_html(True)
 
 
-def diff_files(initial_path, new_path, accurate_mode):
+def diff_files(
+    initial_path, new_path, accurate_mode,
+    algorithm=constants.SEQUENCE_DIFF_ALGORITHM
+):
     """
     Given two files, open them to variables and pass them to diff_strings
     for diffing.
@@ -284,6 +319,8 @@ def diff_files(initial_path, new_path, accurate_mode):
     :param new_path: new file to compare to f1
     :type accurate_mode: boolean
     :param accurate_mode: use accurate mode or not
+    :type algorithm: string
+    :param algorithm: "difflib" or "patience"
     :returns: string containing diffed html from initial_path and new_path
     """
     # Open the files
@@ -295,7 +332,7 @@ def diff_files(initial_path, new_path, accurate_mode):
         logger.debug('Reading file: {0}'.format(new_path))
         source2 = constants.COMMENT_RE.sub('', f.read())
 
-    return diff_strings(source1, source2, accurate_mode)
+    return diff_strings(source1, source2, accurate_mode, algorithm)
 
 
 def span_to_whitespace(html_string, span):
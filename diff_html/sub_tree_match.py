@@ -1,5 +1,6 @@
 import re
-import signal
+import time
+from collections import deque, namedtuple
 from copy import deepcopy
 from lxml import etree
 
@@ -9,9 +10,18 @@ from xmldiff.formatting import WS_NONE, WS_TEXT, DIFF_PREFIX, DIFF_NS
 from xmldiff.formatting import PlaceholderMaker, PlaceholderEntry, XMLFormatter
 
 from contify.website_tracking.diff_html.constants import (
-    IGNORE_DIFF_TAGS, EXTRACT_TEXT_XPATH
+    IGNORE_DIFF_TAGS, EXTRACT_TEXT_XPATH, JUNK_URL_PATTERNS, DIFF_TIMEOUT,
+    DIFF_MAX_COMPARISONS, DIFF_MATCH_STRATEGY, DIFF_SUBTREE_MATCH,
+    LEAF_RATIO_CACHE_SIZE
+)
+from contify.website_tracking.diff_html.match_index import (
+    MatchIndex, get_signatures
+)
+from contify.website_tracking.diff_html.subtree_hash import (
+    match_identical_subtrees
 )
 from contify.website_tracking.diff_html.utils import utf8_decode, split_html
+from contify.website_tracking.execptions import DiffBudgetExceeded
 
 WS_RE = re.compile(r'^([ \n\r\t]|&nbsp;)+$')
 HEAD_RE = re.compile(r'<\s*head\s*>', re.S | re.I)
@@ -547,14 +557,114 @@ class HTMLFormatter(XMLFormatter):
         return left_html, right_html
 
 
+JUNK_URL_RE = re.compile("|".join(map(re.escape, JUNK_URL_PATTERNS)))
+INVISIBLE_STYLE_RE = re.compile(
+    r"display: ?none|visibility: ?hidden|width: ?0|height: ?0"
+)
+JUNK_SRC_TAGS = frozenset({"script", "link", "iframe", "a", "img"})
+INVISIBLE_TAGS = frozenset({"img", "iframe", "div", "span"})
+
+
+def is_junk_node(node):
+    """
+    Whether the node is a tracker or an invisible element (see
+    CFYDiffer.is_junk_in_url_patterns), with the patterns compiled once.
+    """
+    if not isinstance(node.tag, str):
+        return False
+    tag = node.tag.lower()
+    attrib = node.attrib
+
+    if tag in JUNK_SRC_TAGS:
+        if (
+                JUNK_URL_RE.search(attrib.get("src", "").lower()) or
+                JUNK_URL_RE.search(attrib.get("href", "").lower())
+        ):
+            return True
+
+    if tag in INVISIBLE_TAGS:
+        if INVISIBLE_STYLE_RE.search(attrib.get("style", "").lower()):
+            return True
+        # A zero dimension, "0", "0px", ...
+        if attrib.get("width", "").strip().startswith("0"):
+            return True
+        if attrib.get("height", "").strip().startswith("0"):
+            return True
+
+    return False
+
+
+NodeSignature = namedtuple(
+    "NodeSignature", ["src", "href", "text", "children", "html"]
+)
+
+
 def get_to_string(node):
     return node, etree.tounicode(node, method="html").strip()
 
 
+class DiffBudget:
+    """
+    Cooperative time and comparison budget of CFYDiffer.match, charged in
+    its loops instead of a SIGALRM so a diff can run off the main thread
+    (executors, web requests).
+    """
+    # The clock is read every CHECK_EVERY comparisons
+    CHECK_EVERY = 256
+
+    def __init__(self, timeout=DIFF_TIMEOUT, max_comparisons=DIFF_MAX_COMPARISONS):
+        self.timeout = timeout
+        self.max_comparisons = max_comparisons
+        self.started_on = time.monotonic()
+        self.comparisons = 0
+        self.phase = None
+        self.left_done = 0
+        self.left_total = 0
+        self.right_total = 0
+        self.identical_nodes = 0
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started_on
+
+    def stats(self):
+        return {
+            "phase": self.phase,
+            "comparisons": self.comparisons,
+            "elapsed": f"{self.elapsed:0.2f}s",
+            "left_nodes": f"{self.left_done}/{self.left_total}",
+            "right_nodes": self.right_total,
+            "identical_nodes": self.identical_nodes,
+        }
+
+    def charge(self, comparisons=1):
+        self.comparisons += comparisons
+        if self.comparisons % self.CHECK_EVERY >= comparisons:
+            return
+        if self.max_comparisons and self.comparisons > self.max_comparisons:
+            raise DiffBudgetExceeded("comparisons", self.stats())
+        if self.timeout and self.elapsed > self.timeout:
+            raise DiffBudgetExceeded("timeout", self.stats())
+
+
 class CFYDiffer(Differ):
     def __init__(self, *args, **kwargs):
+        self.__timeout = kwargs.pop("timeout", DIFF_TIMEOUT)
+        self.__max_comparisons = kwargs.pop(
+            "max_comparisons", DIFF_MAX_COMPARISONS
+        )
+        self.__match_strategy = kwargs.pop(
+            "match_strategy", DIFF_MATCH_STRATEGY
+        )
+        self.__subtree_match = kwargs.pop("subtree_match", DIFF_SUBTREE_MATCH)
+        # Right roots of the identical subtrees, diff() does not walk them
+        self._identical_roots = set()
         self.__ratio_mode = kwargs.get("ratio_mode") or args[2]
         super().__init__(*args, **kwargs)
+        # DiffBudget of the last match, its stats tell the cost of a diff
+        self.budget = None
+        self._signature_cache = {}
+        self._leaf_ratio_cache = {}
 
         self.__tag_text = ["option", "label"]
         if self.__ratio_mode == "fast":
@@ -562,13 +672,11 @@ class CFYDiffer(Differ):
 
         self.__ignore_diff_tags = IGNORE_DIFF_TAGS
 
-    def timeout_handler(self, signum, frame):
-        """Signal handler for timeout"""
-        raise TimeoutError("Match operation timed out")
-
     def match(self, left=None, right=None):
-        signal.signal(signal.SIGALRM, self.timeout_handler)
-        signal.alarm(300)
+        """
+        Raises DiffBudgetExceeded (a TimeoutError) when the matching takes
+        longer than `timeout` seconds or `max_comparisons` node comparisons.
+        """
         # This is not a generator, because the diff() functions needs
         # _l2rmap and _r2lmap, so if match() was a generator, then
         # diff() would have to first do list(self.match()) without storing
@@ -592,6 +700,8 @@ class CFYDiffer(Differ):
         self._r2lmap = {}
         self._inorder = set()
         self._text_cache = {}
+        self._signature_cache = {}
+        self._leaf_ratio_cache = {}
 
         # Generate the node lists
         lnodes = list(utils.post_order_traverse(self.left))
@@ -608,10 +718,39 @@ class CFYDiffer(Differ):
         lnodes.remove(self.left)
         rnodes.remove(self.right)
 
+        budget = self.budget = DiffBudget(
+            self.__timeout, self.__max_comparisons
+        )
+        budget.left_total = len(lnodes)
+        budget.right_total = len(rnodes)
+
+        self._identical_roots = set()
+        if self.__subtree_match:
+            budget.phase = "subtree"
+            pairs, right_roots = match_identical_subtrees(
+                self.left, self.right, self.__ignore_diff_tags
+            )
+            for lnode, rnode in pairs:
+                self.append_match(lnode, rnode, 1.0)
+            self._identical_roots = set(right_roots)
+            budget.identical_nodes = len(pairs)
+            if pairs:
+                lnodes = [
+                    lnode for lnode in lnodes if id(lnode) not in self._l2rmap
+                ]
+                rnodes = [
+                    rnode for rnode in rnodes if id(rnode) not in self._r2lmap
+                ]
+
+        def lcs_match(x, y):
+            budget.charge()
+            return self.node_ratio(x, y) >= 0.5
+
         if self.fast_match:
+            budget.phase = "lcs"
             # First find matches with longest_common_subsequence:
             matches = list(utils.longest_common_subsequence(
-                lnodes, rnodes, lambda x, y: self.node_ratio(x, y) >= 0.5))
+                lnodes, rnodes, lcs_match))
             # Add the matches (I prefer this from start to finish):
             for left_match, right_match in matches:
                 self.append_match(lnodes[left_match],
@@ -622,17 +761,35 @@ class CFYDiffer(Differ):
                 lnode = lnodes.pop(left_match)
                 rnode = rnodes.pop(right_match)
 
+        budget.left_done = budget.left_total - len(lnodes)
+        if self.__match_strategy == "indexed":
+            self.indexed_match(lnodes, rnodes, budget)
+        else:
+            self.scan_match(lnodes, rnodes, budget)
+
+        # Match the roots
+        self.append_match(self.left, self.right, 1.0)
+        budget.phase = "done"
+        return self._matches
+
+    def scan_match(self, lnodes, rnodes, budget):
+        """Compares every left node with every unmatched right node."""
+        budget.phase = "match"
+        # Unmatched right nodes in document order, removed in O(1)
+        rnodes = {
+            id(rnode): rnode for rnode in rnodes
+            if rnode.tag not in self.__ignore_diff_tags
+        }
         for lnode in lnodes:
+            budget.left_done += 1
             if lnode.tag in self.__ignore_diff_tags:
                 continue
 
             max_match = 0
             match_node = None
 
-            for rnode in rnodes:
-                if rnode.tag in self.__ignore_diff_tags:
-                    continue
-
+            for rnode in rnodes.values():
+                budget.charge()
                 match = self.node_ratio(lnode, rnode)
                 if match > max_match:
                     match_node = rnode
@@ -649,46 +806,106 @@ class CFYDiffer(Differ):
 
                 # We don't want to check nodes that already are matched
                 if match_node is not None:
-                    rnodes.remove(match_node)
+                    del rnodes[id(match_node)]
 
-        # Match the roots
-        self.append_match(self.left, self.right, 1.0)
-        signal.alarm(0)
-        return self._matches
+    def indexed_match(self, lnodes, rnodes, budget):
+        """
+        Pairs the identical subtrees first, then compares the remaining left
+        nodes with the candidates of a MatchIndex only (see match_index).
+        """
+        lnodes = [
+            lnode for lnode in lnodes
+            if lnode.tag not in self.__ignore_diff_tags
+        ]
+        rnodes = [
+            rnode for rnode in rnodes
+            if rnode.tag not in self.__ignore_diff_tags
+        ]
+        l_signatures = get_signatures(self.left, self.node_text)
+        r_signatures = get_signatures(self.right, self.node_text)
+        index = MatchIndex(rnodes, self.node_text, r_signatures)
+
+        budget.phase = "exact"
+        leftovers = []
+        for lnode in lnodes:
+            rnode = index.pop_exact(l_signatures[lnode])
+            if rnode is not None:
+                budget.charge()
+                match = self.node_ratio(lnode, rnode)
+                if match >= self.F:
+                    budget.left_done += 1
+                    self.append_match(lnode, rnode, match)
+                    index.remove(rnode)
+                    continue
+            leftovers.append(lnode)
+
+        budget.phase = "fuzzy"
+        for lnode in leftovers:
+            budget.left_done += 1
+            max_match = 0
+            match_node = None
+
+            for rnode in index.candidates(lnode):
+                budget.charge()
+                match = self.node_ratio(lnode, rnode)
+                if match > max_match:
+                    match_node = rnode
+                    max_match = match
+                if match == 1.0:
+                    break
+
+            if match_node is not None and max_match >= self.F:
+                self.append_match(lnode, match_node, max_match)
+                index.remove(match_node)
+
+    def node_signature(self, node):
+        """
+        The parts of a node compared by node_ratio, computed once per node
+        of a match.
+        """
+        # Keyed by the node, which keeps the lxml proxies alive so their
+        # id() (the keys of the match maps) stay the same
+        signature = self._signature_cache.get(node)
+        if signature is None:
+            src = node.attrib.get("src")
+            signature = self._signature_cache[node] = NodeSignature(
+                src=src.split("?")[0] if src else None,
+                href=node.attrib.get("href"),
+                text=node.text,
+                children=tuple(node),
+                html=(
+                    etree.tounicode(node, method="html").strip()
+                    if node.tag in ["input", "textarea"] else None
+                ),
+            )
+        return signature
 
     def node_ratio(self, left, right):
+        l_sign = self.node_signature(left)
+        r_sign = self.node_signature(right)
+
         if left.tag == "img" or right.tag == "img":
             # TODO: Do we need to check the alt text
-            clean_left_src_url = (
-                left.attrib.get('src').split('?')[0]
-                if left.attrib.get('src') else None
-            )
-            clean_right_src_url = (
-                right.attrib.get('src').split('?')[0]
-                if right.attrib.get('src') else None
-            )
-            if clean_left_src_url != clean_right_src_url:
+            if l_sign.src != r_sign.src:
                 return 0
 
         if left.tag == "a" or right.tag == "a":
-            if left.attrib.get("href") != right.attrib.get("href") and left.text != right.text:
+            if l_sign.href != r_sign.href and l_sign.text != r_sign.text:
                 return 0
 
         if left.tag == "option" or right.tag == "option":
-            if left.text != right.text:
+            if l_sign.text != r_sign.text:
                 return 0
 
         if left.tag == "label" or right.tag == "label":
-            if left.text != right.text:
+            if l_sign.text != r_sign.text:
                 return 0
 
         if (left.tag in ["input", "textarea"] or
                 right.tag in ["input", "textarea"]):
             if left.tag != right.tag:
                 return 0
-            left_html = etree.tounicode(left, method="html").strip()
-            right_html = etree.tounicode(right, method="html").strip()
-            return left_html == right_html
+            return l_sign.html == r_sign.html
 
         if left.tag is etree.Comment or right.tag is etree.Comment:
             if left.tag is etree.Comment and right.tag is etree.Comment:
@@ -718,6 +935,46 @@ class CFYDiffer(Differ):
             match = (match + child_ratio) / 2
         return match
 
+    def leaf_ratio(self, left, right):
+        """
+        The ratio of the texts of the nodes, it only depends on the nodes
+        so it is cached (LEAF_RATIO_CACHE_SIZE pairs) by the node pair.
+        """
+        key = (left, right)
+        ratio = self._leaf_ratio_cache.get(key)
+        if ratio is None:
+            ltext = self.node_text(left)
+            rtext = self.node_text(right)
+            if ltext == rtext:
+                ratio = 1.0
+            else:
+                self._sequencematcher.set_seqs(ltext, rtext)
+                ratio = self._sequence_ratio()
+
+            if len(self._leaf_ratio_cache) >= LEAF_RATIO_CACHE_SIZE:
+                # Drop the oldest pair
+                del self._leaf_ratio_cache[next(iter(self._leaf_ratio_cache))]
+            self._leaf_ratio_cache[key] = ratio
+        return ratio
+
+    def child_ratio(self, left, right):
+        """
+        The share of the children of the nodes matched to each other. Not
+        cached, it changes as the matching goes on.
+        """
+        left_children = self.node_signature(left).children
+        right_children = self.node_signature(right).children
+        if not left_children and not right_children:
+            return None
+
+        r_child_ids = {id(rchild) for rchild in right_children}
+        count = 0
+        for lchild in left_children:
+            rchild = self._l2rmap.get(id(lchild))
+            if rchild is not None and id(rchild) in r_child_ids:
+                count += 1
+        return count / max(len(left_children), len(right_children))
+
     def node_text(self, node):
         if node in self._text_cache:
             return self._text_cache[node]
@@ -766,6 +1023,24 @@ class CFYDiffer(Differ):
         self._text_cache[node] = result
         return result
 
+    def iter_right_nodes(self):
+        """
+        Breadth-first walk of the right tree, yields (node, is_junk). The
+        walk does not go into the identical subtrees (matched to identical
+        left nodes) nor into the ignored tags which are not junk, their
+        descendants have no action.
+        """
+        queue = deque([self.right])
+        while queue:
+            node = queue.popleft()
+            is_junk = self.is_junk_in_url_patterns(node)
+            yield node, is_junk
+            if node in self._identical_roots:
+                continue
+            if not is_junk and node.tag in self.__ignore_diff_tags:
+                continue
+            queue.extend(node.getchildren())
+
     def diff(self, left=None, right=None):
         # Make sure the matching is done first, diff() needs the l2r/r2l maps.
         if not self._matches:
@@ -776,18 +1051,14 @@ class CFYDiffer(Differ):
         # implementation in turn differs in order yet again.
         ltree = self.left.getroottree()
 
-        ignored_node_descendants = []
-        for rnode in utils.breadth_first_traverse(self.right):
+        # The descendants of an ignored node are not walked, no point to
+        # checking the difference for them
+        for rnode, is_junk in self.iter_right_nodes():
 
-            if self.is_junk_in_url_patterns(rnode):
+            if is_junk:
                 continue
 
             if rnode.tag in self.__ignore_diff_tags:
-                ignored_node_descendants.extend(rnode.iterdescendants())
-                continue
-
-            # if ancestor of a node is already being ignored then no point to checking the difference for that node
-            if rnode in ignored_node_descendants:
                 continue
 
             # (a)
@@ -905,56 +1176,4 @@ class CFYDiffer(Differ):
         This is particularly useful for ignoring meaningless differences in HTML content when performing DOM diffing.
         """
 
-        junk_sources = [
-            "bat.bing.com",
-            "bat.bing.net",
-            "td.doubleclick.net",
-            "doubleclick.net",
-            "googleadservices.com",
-            "pixel.wp.com",
-            "googlesyndication.com",
-            "analytics.twitter.com",
-            "google-analytics.com",
-            "images/blank.png",
-            "bat.bing"
-        ]
-
-        def has_junk_src(attr):
-            return any(domain in attr.lower() for domain in junk_sources)
-
-        def has_invisible_style(style):
-            style = style.lower()
-            invisible_conditions = [
-                "display:none", "display: none",
-                "visibility:hidden", "visibility: hidden",
-                "width:0", "width: 0", "width:0px", "width: 0px",
-                "height:0", "height: 0", "height:0px", "height: 0px"
-            ]
-            return any(cond in style for cond in invisible_conditions)
-
-        def has_zero_dimension(attr):
-            attr = attr.strip()
-            return attr == "0" or attr.startswith("0")
-
-        tag = node.tag.lower()
-
-        if tag in {"script", "link", "iframe", "a", "img"}:
-            src = node.attrib.get("src", "")
-            href = node.attrib.get("href", "")
-            if has_junk_src(src) or has_junk_src(href):
-                return True
-
-        if tag in {"img", "iframe", "div", "span"}:
-            style = node.attrib.get("style", "").lower()
-            width = node.attrib.get("width", "").strip()
-            height = node.attrib.get("height", "").strip()
-
-            if has_invisible_style(style) or has_zero_dimension(width) or has_zero_dimension(height):
-                if tag in {"div", "span"}:
-                    for child in node.iterdescendants():
-                        if child.tag.lower() == "img":
-                            if has_junk_src(child.attrib.get("src", "")):
-                                return True
-                return True
-
-        return False
\ No newline at end of file
+        return is_junk_node(node)
\ No newline at end of file
@@ -0,0 +1,102 @@
+"""
+Merkle hashing of the DOM trees of a diff (CFYDiffer, subtree_match).
+
+The hash of a node covers its tag, attributes, text and the hashes and
+tails of its children, computed in one post-order pass. Two nodes with the
+same hash are the roots of identical subtrees, so the regions a change did
+not touch (header, footer, nav, ...) are matched node by node before any
+ratio is computed, and diff() does not walk into them: a matched subtree
+without any change produces no action.
+
+The left tree is walked top-down, so the largest identical subtrees are
+matched first, a left subtree takes the first unmatched right subtree of
+the same hash in document order. The subtrees are compared node by node
+before a pair is accepted, a hash collision is not a match.
+
+Usage:
+    pairs, right_roots = match_identical_subtrees(left, right)
+"""
+from collections import defaultdict, deque
+from itertools import zip_longest
+
+from xmldiff import utils
+
+
+def get_subtree_hashes(root):
+    """
+    Hash of the subtree of every node, keyed by the node (which keeps the
+    lxml proxies alive, so later walks of the tree return the same ones).
+    """
+    hashes = {}
+    for node in utils.post_order_traverse(root):
+        attrib = (
+            tuple(sorted(node.attrib.items()))
+            if isinstance(node.tag, str) else ()
+        )
+        hashes[node] = hash((
+            node.tag, attrib, node.text,
+            tuple((hashes[child], child.tail) for child in node)
+        ))
+    return hashes
+
+
+def is_identical_subtree(left, right):
+    """Whether the subtrees have the same tags, attributes, texts and tails."""
+    for lnode, rnode in zip_longest(left.iter(), right.iter()):
+        if lnode is None or rnode is None:
+            return False
+        if (
+                lnode.tag != rnode.tag or lnode.text != rnode.text or
+                len(lnode) != len(rnode)
+        ):
+            return False
+        # The tail of the root is not part of its subtree
+        if lnode is not left and lnode.tail != rnode.tail:
+            return False
+        if isinstance(lnode.tag, str) and (
+                dict(lnode.attrib) != dict(rnode.attrib)
+        ):
+            return False
+    return True
+
+
+def match_identical_subtrees(left, right, skip_tags=()):
+    """
+    Returns the (left, right) node pairs of the identical subtrees of the
+    trees, except the roots of the trees and the nodes of skip_tags, and
+    the roots of the matched right subtrees.
+    """
+    l_hashes = get_subtree_hashes(left)
+    r_hashes = get_subtree_hashes(right)
+
+    buckets = defaultdict(deque)
+    for rnode in right.iterdescendants():
+        buckets[r_hashes[rnode]].append(rnode)
+
+    matched = set()
+    pairs = []
+    right_roots = []
+    queue = deque(left.getchildren())
+    while queue:
+        lnode = queue.popleft()
+        rnode = None
+        bucket = buckets.get(l_hashes[lnode])
+        while bucket:
+            candidate = bucket.popleft()
+            # Neither inside nor around an already matched right subtree
+            if any(node in matched for node in candidate.iter()):
+                continue
+            if is_identical_subtree(lnode, candidate):
+                rnode = candidate
+                break
+
+        if rnode is None:
+            queue.extend(lnode.getchildren())
+            continue
+
+        right_roots.append(rnode)
+        for lchild, rchild in zip(lnode.iter(), rnode.iter()):
+            matched.add(rchild)
+            if lchild.tag not in skip_tags:
+                pairs.append((lchild, rchild))
+    return pairs, right_roots
@@ -0,0 +1,207 @@
+"""
+Patience diff of token sequences (HTMLMatcher, algorithm="patience").
+
+difflib.SequenceMatcher looks for the longest matching block of every
+region, which is quadratic on long pages with many repeated tokens
+(whitespace, punctuation, common tags). The patience diff instead:
+
+1.  Matches the common prefix and suffix of a region.
+2.  Anchors the tokens appearing exactly once on both sides, keeping the
+    longest increasing subsequence of them (the anchors in the same order on
+    both sides), and diffs the regions between the anchors the same way.
+3.  Diffs a region without any anchor with Myers' O(ND) algorithm, and past
+    MYERS_MAX_COST edits with SequenceMatcher over the interned tokens of
+    the region.
+
+The tokens are interned to ints first (TokenInterner), so every comparison
+is an int comparison. In fast mode the junk tokens (is_junk) are never
+anchors, as they are not matched first by SequenceMatcher either.
+
+Usage:
+    interner = TokenInterner()
+    blocks = get_matching_blocks(interner.ids(a), interner.ids(b))
+"""
+from bisect import bisect_left
+from difflib import Match, SequenceMatcher
+
+from contify.website_tracking.diff_html.constants import MYERS_MAX_COST
+
+
+class TokenInterner:
+    """Maps every distinct token to an int, the same for both sequences."""
+
+    def __init__(self):
+        self.token_ids = {}
+
+    def ids(self, tokens):
+        token_ids = self.token_ids
+        return [token_ids.setdefault(token, len(token_ids)) for token in tokens]
+
+
+def get_anchors(a, alo, ahi, b, blo, bhi, is_anchor):
+    """
+    The (i, j) pairs of the tokens unique on both sides of the region, the
+    longest sequence of them in the same order on both sides.
+    """
+    a_unique = {}
+    for i in range(alo, ahi):
+        token = a[i]
+        a_unique[token] = -1 if token in a_unique else i
+    b_unique = {}
+    for j in range(blo, bhi):
+        token = b[j]
+        if a_unique.get(token, -1) >= 0:
+            b_unique[token] = -1 if token in b_unique else j
+
+    pairs = [
+        (a_unique[token], j) for token, j in b_unique.items()
+        if j >= 0 and (is_anchor is None or is_anchor(token))
+    ]
+    if not pairs:
+        return []
+    pairs.sort()
+
+    # Longest increasing subsequence of j (patience sorting)
+    tails = []
+    tail_index = []
+    previous = [None] * len(pairs)
+    for index, (_, j) in enumerate(pairs):
+        pile = bisect_left(tails, j)
+        if pile == len(tails):
+            tails.append(j)
+            tail_index.append(index)
+        else:
+            tails[pile] = j
+            tail_index[pile] = index
+        previous[index] = tail_index[pile - 1] if pile else None
+
+    anchors = []
+    index = tail_index[-1]
+    while index is not None:
+        anchors.append(pairs[index])
+        index = previous[index]
+    anchors.reverse()
+    return anchors
+
+
+def myers_matches(a, alo, ahi, b, blo, bhi, max_cost=MYERS_MAX_COST):
+    """
+    The matching (i, j) pairs of a shortest edit script of the region, None
+    past max_cost edits.
+    """
+    n, m = ahi - alo, bhi - blo
+    v = {1: 0}
+    trace = []
+    for d in range(min(n + m, max_cost) + 1):
+        trace.append(dict(v))
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                return backtrack_myers(trace, x, y, alo, blo)
+    return None
+
+
+def backtrack_myers(trace, x, y, alo, blo):
+    matches = []
+    for d in range(len(trace) - 1, 0, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            matches.append((alo + x, blo + y))
+        x, y = prev_x, prev_y
+    while x > 0 and y > 0:
+        x -= 1
+        y -= 1
+        matches.append((alo + x, blo + y))
+    matches.reverse()
+    return matches
+
+
+def sequence_matches(a, alo, ahi, b, blo, bhi, is_anchor):
+    """The matching (i, j) pairs of SequenceMatcher for the region."""
+    is_junk = None
+    if is_anchor is not None:
+        is_junk = lambda token: not is_anchor(token)
+    matcher = SequenceMatcher(
+        is_junk, a[alo:ahi], b[blo:bhi], autojunk=False
+    )
+    return [
+        (alo + i + offset, blo + j + offset)
+        for i, j, size in matcher.get_matching_blocks()
+        for offset in range(size)
+    ]
+
+
+def get_matching_blocks(a, b, is_anchor=None):
+    """
+    The matching blocks of a and b, as SequenceMatcher.get_matching_blocks:
+    Match(i, j, size) triples ending with Match(len(a), len(b), 0).
+    """
+    matches = []
+    # Regions and anchor pairs, in reverse order
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        item = stack.pop()
+        if len(item) == 2:
+            matches.append(item)
+            continue
+
+        alo, ahi, blo, bhi = item
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            matches.append((alo, blo))
+            alo += 1
+            blo += 1
+        suffix = []
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+            suffix.append((ahi, bhi))
+        stack.extend(suffix)
+        if alo == ahi or blo == bhi:
+            continue
+
+        anchors = get_anchors(a, alo, ahi, b, blo, bhi, is_anchor)
+        if not anchors:
+            region_matches = myers_matches(a, alo, ahi, b, blo, bhi)
+            if region_matches is None:
+                region_matches = sequence_matches(
+                    a, alo, ahi, b, blo, bhi, is_anchor
+                )
+            matches.extend(region_matches)
+            continue
+
+        items = []
+        i, j = alo, blo
+        for anchor_i, anchor_j in anchors:
+            items.append((i, anchor_i, j, anchor_j))
+            items.append((anchor_i, anchor_j))
+            i, j = anchor_i + 1, anchor_j + 1
+        items.append((i, ahi, j, bhi))
+        stack.extend(reversed(items))
+
+    blocks = []
+    for i, j in matches:
+        if blocks and blocks[-1][0] + blocks[-1][2] == i \
+                and blocks[-1][1] + blocks[-1][2] == j:
+            blocks[-1][2] += 1
+        else:
+            blocks.append([i, j, 1])
+    blocks = [Match(i, j, size) for i, j, size in blocks]
+    blocks.append(Match(len(a), len(b), 0))
+    return blocks
@@ -0,0 +1,166 @@
+"""
+A pool of processes computing the DiffHtml of the WebSnapshots of
+process_web_snapshot (--workers).
+
+A diff is CPU-bound lxml/xmldiff work, so the diffs of a batch run in a
+ProcessPoolExecutor and only their results come back to the main process,
+which does all the DB writes.
+
+The timeout of a diff is enforced by the pool: at most `workers` diffs are
+submitted at a time, so a diff starts when it is submitted, and a diff
+still running `timeout` seconds later fails with a TimeoutError (the
+matcher of a diff gives up earlier on its own budget, DIFF_TIMEOUT). A running
+task can not be cancelled, so the processes of the pool are killed and the
+other running diffs are submitted again to a new pool.
+
+A process dying (e.g. killed by the OOM killer) breaks the whole pool, every
+running diff fails with BrokenProcessPool. Those diffs are submitted again
+one at a time, so only the diff that breaks the pool on its own fails.
+
+The processes are started by a forkserver, not forked from the command,
+which may run threads (the Heartbeat of a --worker) and hold DB
+connections; they set Django up on their own.
+
+Usage:
+    with DiffPool(workers=4) as pool:
+        for task, result, error in pool.map(compute_diff_html, tasks):
+            ...
+"""
+import logging
+import multiprocessing
+import signal
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+
+from contify.website_tracking.diff_html.constants import DIFF_POOL_TIMEOUT
+
+
+logger = logging.getLogger(__name__)
+
+
+def init_diff_process():
+    # Killed by the pool, not stopped by the handlers of the command
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # A fresh interpreter, DJANGO_SETTINGS_MODULE comes from the environment
+    django.setup()
+
+
+class DiffPool:
+
+    def __init__(self, workers, timeout=DIFF_POOL_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self.executor = None
+        self.restarts = 0
+
+    def start(self):
+        self.executor = ProcessPoolExecutor(
+            self.workers, mp_context=multiprocessing.get_context("forkserver"),
+            initializer=init_diff_process
+        )
+
+    def kill(self):
+        if self.executor is None:
+            return
+        # ProcessPoolExecutor has no public API to stop a running task, its
+        # private _processes (pid -> Process) is the only handle on them.
+        # Without it the processes are left to finish their task.
+        processes = list(
+            (getattr(self.executor, "_processes", None) or {}).values()
+        )
+        for process in processes:
+            process.kill()
+        self.executor.shutdown(wait=False)
+        for process in processes:
+            process.join()
+        self.executor = None
+
+    def restart(self):
+        logger.info(f"DiffPool! Restarting the {self.workers} processes")
+        self.kill()
+        self.start()
+        self.restarts += 1
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def map(self, fn, tasks):
+        """
+        Yields (task, result, error) of fn(*task) for the tasks in the order
+        they complete, `error` is the exception raised by the task.
+        """
+        pending = deque(tasks)
+        # Tasks running when the pool broke, submitted again one at a time
+        suspects = deque()
+        # future -> (task, deadline, isolated)
+        running = {}
+        try:
+            while pending or suspects or running:
+                if suspects:
+                    if not running:
+                        self.submit(running, fn, suspects.popleft(), True)
+                else:
+                    while pending and len(running) < self.workers:
+                        self.submit(running, fn, pending.popleft(), False)
+
+                next_deadline = min(
+                    deadline for _, deadline, _ in running.values()
+                )
+                done, _ = wait(
+                    running, timeout=max(0, next_deadline - time.monotonic()),
+                    return_when=FIRST_COMPLETED
+                )
+
+                broken = False
+                for future in done:
+                    task, _, isolated = running.pop(future)
+                    try:
+                        result, error = future.result(), None
+                    except BrokenProcessPool as err:
+                        broken = True
+                        if not isolated:
+                            # Maybe not the task that broke the pool
+                            suspects.append(task)
+                            continue
+                        result, error = None, err
+                    except Exception as err:
+                        result, error = None, err
+                    yield task, result, error
+
+                now = time.monotonic()
+                expired = [
+                    future for future, (_, deadline, _) in running.items()
+                    if deadline <= now and not future.done()
+                ]
+                for future in expired:
+                    task, _, _ = running.pop(future)
+                    yield task, None, TimeoutError(
+                        f"Diff took more than {self.timeout} seconds"
+                    )
+
+                if expired or broken:
+                    for task, _, isolated in reversed(list(running.values())):
+                        if broken and not isolated:
+                            suspects.appendleft(task)
+                        else:
+                            pending.appendleft(task)
+                    running = {}
+                    self.restart()
+        except GeneratorExit:
+            self.kill()
+            raise
+
+    def submit(self, running, fn, task, isolated):
+        future = self.executor.submit(fn, *task)
+        running[future] = (task, time.monotonic() + self.timeout, isolated)
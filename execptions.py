@@ -25,3 +25,19 @@ class WSTTimeoutException(Exception):
     Custom Exception class to help signal based timeout exceptions to propagate.
     """
     pass
+
+
+class DiffBudgetExceeded(TimeoutError):
+    """
+    Raised by CFYDiffer.match when the diff runs out of its time or
+    comparison budget, `stats` tells how far it got.
+    """
+
+    def __init__(self, reason, stats):
+        self.reason = reason
+        self.stats = stats
+        super().__init__(
+            f"Diff budget exceeded ({reason}) | " + " | ".join(
+                f"{key}: {value}" for key, value in stats.items()
+            )
+        )
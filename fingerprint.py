@@ -0,0 +1,149 @@
+"""
+Content fingerprints of the fetched HTML, stored in WebSnapshot.hash_html.
+
+Versions:
+-   1: MD5 of the html cleaned by utils.clean_invisible_element (parses
+    the page into a tree, runs the lxml Cleaner, serializes it back and
+    normalizes the white space).
+-   2: single pass, the page is fed to an lxml parser target that hashes
+    the canonical token stream of the visible content (tags, safe
+    attributes and normalized text) on the fly, without building a tree or
+    intermediate strings. The hash is prefixed by "v2:". It drops more
+    than v1 (SKIP_TAGS), e.g. the text of <title> and <noscript>.
+
+A fingerprint of one version never matches one of the other, so before
+the fetch job is switched to `--hashVersion 2` the existing hash_html
+values have to be migrated with the `rehash_web_snapshot` command,
+otherwise every WebSource gets one spurious new WebSnapshot.
+"""
+import hashlib
+import re
+
+from lxml import etree
+
+from contify.website_tracking.service import get_md5_hash_of_string
+from contify.website_tracking.utils import clean_invisible_element
+
+
+HASH_VERSIONS = (1, 2)
+DEFAULT_HASH_VERSION = 1
+FEED_CHUNK_SIZE = 64 * 1024
+
+# Subtrees that are not visible content, dropped with their text. Wider
+# than the Cleaner of v1, which only unwraps noscript, svg (defs, polygon,
+# rect, path), area, title, iframe, object, embed and param and keeps
+# template: v2 ignores the edits of the text inside these tags (e.g. a
+# changed <title> or <noscript> message), v1 does not.
+SKIP_TAGS = frozenset({
+    "script", "style", "noscript", "template", "link", "meta", "base",
+    "title", "svg", "defs", "polygon", "rect", "path", "area", "iframe",
+    "frame", "frameset", "object", "embed", "applet", "param",
+})
+# Tags whose content is kept but the tag itself is not part of the stream
+UNWRAP_TAGS = frozenset({"html", "head", "body"})
+SAFE_ATTRS = (
+    'abbr', 'accesskey', 'alt', 'axis', 'checked', 'cite', 'compact',
+    'coords', 'datetime', 'disabled', 'frame', 'headers', 'href', 'hreflang',
+    'media', 'method', 'multiple', 'nohref', 'nowrap', 'readonly', 'rules',
+    'scope', 'selected', 'shape', 'span', 'src', 'start', 'summary', 'title',
+    'type', 'usemap', 'value'
+)
+WS_RE = re.compile(r"\s+")
+
+
+class FingerprintTarget:
+    """
+    lxml parser target hashing the canonical token stream of the page:
+        <tag attr="value" ...>, normalized text, </tag>
+    separated by NUL bytes.
+    """
+
+    def __init__(self):
+        self._md5 = hashlib.md5()
+        self._skip_depth = 0
+        self._text = []
+
+    def _update(self, token):
+        self._md5.update(token.encode("utf-8", "surrogatepass"))
+        self._md5.update(b"\0")
+
+    def _flush_text(self):
+        if not self._text:
+            return
+        text = WS_RE.sub(" ", "".join(self._text).replace("\xa0", " ")).strip()
+        self._text = []
+        if text:
+            self._update(text)
+
+    def start(self, tag, attrib):
+        if not isinstance(tag, str):
+            return
+        tag = tag.lower()
+        if self._skip_depth or tag in SKIP_TAGS:
+            self._skip_depth += 1
+            return
+        if tag in UNWRAP_TAGS:
+            return
+
+        self._flush_text()
+        attrs = "".join(
+            f' {name}="{WS_RE.sub(" ", attrib[name]).strip()}"'
+            for name in SAFE_ATTRS if name in attrib
+        )
+        self._update(f"<{tag}{attrs}>")
+
+    def end(self, tag):
+        if not isinstance(tag, str):
+            return
+        tag = tag.lower()
+        if self._skip_depth:
+            self._skip_depth -= 1
+            return
+        if tag in UNWRAP_TAGS:
+            return
+
+        self._flush_text()
+        self._update(f"</{tag}>")
+
+    def data(self, data):
+        if not self._skip_depth:
+            self._text.append(data)
+
+    def comment(self, text):
+        pass
+
+    def close(self):
+        self._flush_text()
+        return self._md5.hexdigest()
+
+
+def get_streaming_fingerprint(raw_html):
+    """Version 2 fingerprint of the html, see FingerprintTarget."""
+    target = FingerprintTarget()
+    parser = etree.HTMLParser(
+        target=target, remove_comments=True, encoding="utf-8"
+    )
+    try:
+        for start in range(0, len(raw_html), FEED_CHUNK_SIZE):
+            parser.feed(
+                raw_html[start:start + FEED_CHUNK_SIZE].encode(
+                    "utf-8", "surrogatepass"
+                )
+            )
+        return f"v2:{parser.close()}"
+    except etree.XMLSyntaxError:
+        # Empty document, the tokens hashed so far are the fingerprint
+        return f"v2:{target.close()}"
+
+
+def get_hash_html(raw_html, version=DEFAULT_HASH_VERSION):
+    """Returns the hash_html of the fetched html for the given version."""
+    if version == 2:
+        return get_streaming_fingerprint(raw_html)
+    return get_md5_hash_of_string(
+        clean_invisible_element(raw_html.replace("\n", ""))
+    )
+
+
+def get_hash_version(hash_html):
+    return 2 if hash_html.startswith("v2:") else 1
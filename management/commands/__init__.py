@@ -5,3 +5,25 @@ from datetime import datetime
 def format_error_msg(error_msg):
     pre_fix = "Error caught on {}".format(datetime.now())
     return f"{pre_fix}\n\n{error_msg}"
+
+
+def add_work_queue_arguments(parser):
+    """--enqueue and --worker options of the commands using work_queue."""
+    parser.add_argument(
+        "--enqueue", action="store_true", dest="enqueue", default=False,
+        help=(
+            "Queue the IDs selected by the other options in the work queue "
+            "instead of processing them"
+        )
+    )
+    parser.add_argument(
+        "--worker", action="store_true", dest="worker", default=False,
+        help=(
+            "Run as a long-running worker processing the work queue in "
+            "batches of --batchSize, no lock file and no sharding"
+        )
+    )
+    parser.add_argument(
+        "--maxBatches", dest="max_batches", type=int, default=None,
+        help="Stop the worker after this number of batches"
+    )
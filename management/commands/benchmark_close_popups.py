@@ -0,0 +1,148 @@
+"""
+Compares close_all_popups (single in-page probe) with the locator based
+close_all_popups_by_locator on saved fixture pages.
+
+For every fixture both implementations run on a fresh page and the command
+prints the number of browser round trips (awaited Playwright calls) and the
+wall time of each. The fixtures are HTML files saved from real pages with
+their popups, relative to contify/website_tracking/dist.
+
+Usage:
+python manage.py benchmark_close_popups -f popups/page_1.html popups/page_2.html
+python manage.py benchmark_close_popups -f popups/page_1.html --repeat 3 --settle
+"""
+import inspect
+import os
+import sys
+import time
+import asyncio
+from os.path import abspath
+
+from django.core.management.base import BaseCommand
+from playwright.async_api import async_playwright, Locator, Mouse
+
+from contify.website_tracking import constants as wt_constant
+from contify.website_tracking.browser_pool import BROWSER_LAUNCH_ARGS
+from contify.website_tracking.utils import (
+    close_all_popups, close_all_popups_by_locator
+)
+
+
+class RoundTripCounter:
+    """
+    Wraps a Playwright Page (and the Locators/Mouse it returns) and counts
+    every awaited call, each one is a round trip to the browser.
+    """
+
+    def __init__(self, target, counter):
+        self._target = target
+        self._counter = counter
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return self._wrap(attr)
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if inspect.isawaitable(result):
+                return self._count(result)
+            return self._wrap(result)
+
+        return call
+
+    async def _count(self, awaitable):
+        self._counter["round_trips"] += 1
+        return self._wrap(await awaitable)
+
+    def _wrap(self, value):
+        if isinstance(value, (Locator, Mouse)):
+            return RoundTripCounter(value, self._counter)
+        return value
+
+
+class Command(BaseCommand):
+    IMPLEMENTATIONS = (
+        ("locator", close_all_popups_by_locator),
+        ("probe", close_all_popups),
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-f", "--fixtures", nargs="+", dest="fixtures", required=True,
+            help="Saved HTML pages, relative to contify/website_tracking/dist"
+        )
+        parser.add_argument(
+            "--repeat", dest="repeat", type=int, default=1,
+            help="Number of runs of each implementation per fixture"
+        )
+        parser.add_argument(
+            "--settle", action="store_true", dest="settle", default=False,
+            help="Wait for the page to settle after a click instead of 800ms"
+        )
+
+    def handle(self, *args, **options):
+        file_prefix = "contify/website_tracking/dist"
+        fixtures = []
+        for fixture in options["fixtures"]:
+            file_path = abspath(f"{file_prefix}/{fixture}")
+            if not os.path.exists(file_path):
+                print(f"Could not find fixture: {file_path}")
+                sys.exit(1)
+            with open(file_path) as f:
+                fixtures.append((fixture, f.read()))
+
+        results = asyncio.run(
+            self.run_benchmark(fixtures, options["repeat"], options["settle"])
+        )
+
+        print(
+            f"{'Fixture':<40} {'Implementation':<15} {'Round trips':>12} "
+            f"{'Wall time (s)':>14}"
+        )
+        totals = {}
+        for fixture, name, round_trips, wall_time in results:
+            print(
+                f"{fixture[:40]:<40} {name:<15} {round_trips:>12} "
+                f"{wall_time:>14.3f}"
+            )
+            total = totals.setdefault(name, [0, 0])
+            total[0] += round_trips
+            total[1] += wall_time
+
+        for name, (round_trips, wall_time) in totals.items():
+            print(
+                f"{'Total':<40} {name:<15} {round_trips:>12} "
+                f"{wall_time:>14.3f}"
+            )
+
+    async def run_benchmark(self, fixtures, repeat, settle):
+        results = []
+        async with async_playwright() as p:
+            browser = await p.chromium.launch(
+                headless=True, args=BROWSER_LAUNCH_ARGS
+            )
+            context = await browser.new_context(**wt_constant.CONTEXT_DICT)
+            try:
+                for fixture, html in fixtures:
+                    for name, implementation in self.IMPLEMENTATIONS:
+                        for _ in range(repeat):
+                            page = await context.new_page()
+                            await page.set_content(html, wait_until="load")
+
+                            counter = {"round_trips": 0}
+                            start = time.perf_counter()
+                            await implementation(
+                                RoundTripCounter(page, counter), settle=settle
+                            )
+                            wall_time = time.perf_counter() - start
+
+                            results.append(
+                                (fixture, name, counter["round_trips"],
+                                 wall_time)
+                            )
+                            await page.close()
+            finally:
+                await context.close()
+                await browser.close()
+        return results
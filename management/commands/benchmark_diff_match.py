@@ -0,0 +1,173 @@
+"""
+Compares the matching options of CFYDiffer on real snapshot pairs, nothing
+is written:
+
+-   scan: the plain scan of every pair of nodes, the reference.
+-   subtree: the identical subtrees matched first (diff_html/subtree_hash.py)
+    then the scan.
+-   indexed: the identical subtrees, then the indexed strategy
+    (diff_html/match_index.py).
+
+Every pair (the old and new WebSnapshot of a DiffHtml) is diffed with each
+of them the way get_diff_html does, the command prints the match and the
+total diff time, the node comparisons and whether the diff actions and the
+generated old and new diff html are the same as the scan ones.
+
+Usage:
+python manage.py benchmark_diff_match --limit 20
+python manage.py benchmark_diff_match --dh_ids 101,102 --ratio_mode fast
+"""
+import statistics
+import time
+from io import StringIO
+
+from django.core.management.base import BaseCommand, CommandError
+from lxml import etree
+
+from contify.website_tracking.diff_html.sub_tree_match import (
+    CFYDiffer, HTMLFormatter
+)
+from contify.website_tracking.models import WebSource
+from contify.website_tracking.normalized_html import (
+    get_html_parser, normalize_html
+)
+from contify.website_tracking.service import remove_junk
+from contify.website_tracking.utils import set_values
+from contify.website_tracking.web_snapshot.models import DiffHtml, WebSnapshot
+
+
+CONFIGS = {
+    "scan": {"match_strategy": "scan", "subtree_match": False},
+    "subtree": {"match_strategy": "scan", "subtree_match": True},
+    "indexed": {"match_strategy": "indexed", "subtree_match": True},
+}
+
+
+class Command(BaseCommand):
+    help = "Compares the matching options of CFYDiffer."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dh_ids", dest="dh_ids", type=set_values, default=None,
+            help="DiffHtml IDs whose snapshot pairs are diffed"
+        )
+        parser.add_argument(
+            "--limit", dest="limit", type=int, default=20,
+            help="Number of the latest DiffHtml used without --dh_ids"
+        )
+        parser.add_argument(
+            "-r", "--ratio_mode", dest="ratio_mode", default="accurate",
+            choices={"accurate", "fast", "faster"}
+        )
+        parser.add_argument(
+            "-F", type=float, dest="threshold", default=None,
+            help="A value between 0 and 1 that determines how similar nodes "
+                 "must be to match."
+        )
+
+    def handle(self, *args, **options):
+        dh_qs = DiffHtml.objects.order_by("-id")
+        if options["dh_ids"]:
+            dh_qs = dh_qs.filter(id__in=options["dh_ids"])
+        pairs = list(
+            dh_qs.values_list("id", "old_web_snapshot_id", "new_web_snapshot_id")
+            [:options["limit"]]
+        )
+        if not pairs:
+            raise CommandError("No DiffHtml found")
+
+        wss_map = WebSnapshot.objects.in_bulk(
+            {wss_id for pair in pairs for wss_id in pair[1:]}
+        )
+        ws_map = WebSource.objects.in_bulk(
+            {wss.web_source_id for wss in wss_map.values()}
+        )
+
+        times = {name: [] for name in CONFIGS}
+        diff_times = {name: [] for name in CONFIGS}
+        same_actions = {name: 0 for name in CONFIGS}
+        same_html = {name: 0 for name in CONFIGS}
+        for dh_id, old_wss_id, new_wss_id in pairs:
+            old_wss, new_wss = wss_map.get(old_wss_id), wss_map.get(new_wss_id)
+            if old_wss is None or new_wss is None:
+                print(f"DiffHtml {dh_id:<8} skipped, a WebSnapshot is deleted")
+                continue
+            ws = ws_map[new_wss.web_source_id]
+
+            results = {
+                name: self.run_diff(old_wss, new_wss, ws, config, options)
+                for name, config in CONFIGS.items()
+            }
+            scan = results["scan"]
+            line = f"DiffHtml {dh_id:<8} Nodes: {scan['nodes']:<6}"
+            for name, result in results.items():
+                times[name].append(result["match_time"])
+                diff_times[name].append(result["diff_time"])
+                same_actions[name] += result["actions"] == scan["actions"]
+                same_html[name] += result["html"] == scan["html"]
+                line += (
+                    f" | {name}: {result['match_time']:.2f}s "
+                    f"({result['comparisons']} comparisons"
+                    f", {result['identical']} identical)"
+                )
+                if name != "scan":
+                    line += (
+                        f" same actions: {result['actions'] == scan['actions']}"
+                        f" same html: {result['html'] == scan['html']}"
+                    )
+            print(line)
+
+        diffed = len(times["scan"])
+        if not diffed:
+            return
+        for name in CONFIGS:
+            print(
+                f"{name:<8} match mean: {statistics.mean(times[name]):.2f}s | "
+                f"max: {max(times[name]):.2f}s | total: {sum(times[name]):.2f}s"
+                f" | diff total: {sum(diff_times[name]):.2f}s | speedup: "
+                f"{sum(diff_times['scan']) / max(sum(diff_times[name]), 1e-6):.1f}x"
+                f" | same actions: {same_actions[name]}/{diffed} | "
+                f"same html: {same_html[name]}/{diffed}"
+            )
+
+    @staticmethod
+    def run_diff(old_wss, new_wss, ws, config, options):
+        """The steps of get_diff_html with the given CFYDiffer options."""
+        html_parser = get_html_parser()
+        o_start, o_body, o_end = normalize_html(
+            old_wss.raw_html or "", ws.base_url, html_parser
+        )
+        _, n_body, _ = normalize_html(
+            new_wss.raw_html or "", ws.base_url, html_parser
+        )
+        old_tree = etree.parse(StringIO(o_body), html_parser)
+        new_tree = etree.parse(StringIO(n_body), html_parser)
+        if ws.junk_xpaths:
+            old_tree, new_tree = remove_junk(ws.junk_xpaths, old_tree, new_tree)
+
+        formatter = HTMLFormatter(normalize=True, pretty_print=True)
+        formatter.prepare(old_tree, new_tree)
+
+        differ = CFYDiffer(
+            ratio_mode=options["ratio_mode"], F=options["threshold"],
+            fast_match=True, timeout=None,
+            uniqueattrs=['{http://www.w3.org/XML/1998/namespace}id'], **config
+        )
+        start = time.perf_counter()
+        differ.match(old_tree, new_tree)
+        match_time = time.perf_counter() - start
+
+        diffs = list(differ.diff())
+        diff_time = time.perf_counter() - start
+        actions = [repr(action) for action in diffs]
+        diffed_tree = formatter.format(diffs, old_tree)
+        html = formatter.cfy_gen_separate_old_n_new(diffed_tree, o_start, o_end)
+        return {
+            "nodes": differ.budget.left_total + differ.budget.right_total,
+            "match_time": match_time,
+            "diff_time": diff_time,
+            "comparisons": differ.budget.comparisons,
+            "identical": differ.budget.identical_nodes,
+            "actions": actions,
+            "html": html,
+        }
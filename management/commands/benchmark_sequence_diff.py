@@ -0,0 +1,105 @@
+"""
+Compares the algorithms of HTMLMatcher (diff_html/sequence_match.py) on the
+old and new HTML files of sequence_html_diff, nothing is written:
+
+-   difflib: SequenceMatcher over the tokens, the reference.
+-   patience: the patience diff over the interned tokens
+    (diff_html/token_diff.py).
+
+Each algorithm diffs the files --repeat times, the command prints the best
+setup (tokenize), match and total diff time, the matched tokens and
+whether the diffed html is the same as the difflib one.
+
+Usage:
+python manage.py benchmark_sequence_diff -l old.html -r new.html
+python manage.py benchmark_sequence_diff -l old.html -r new.html -a --repeat 5
+"""
+import os
+import time
+from os.path import abspath
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contify.website_tracking.diff_html.sequence_match import (
+    HTMLMatcher, utf8_encode, constants
+)
+
+
+ALGORITHMS = ("difflib", "patience")
+
+
+class Command(BaseCommand):
+    help = "Compares the algorithms of HTMLMatcher."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-l", "--old-file", action="store", dest="old_file",
+            help="Old HTML file that has to compare with the new Html file"
+        )
+        parser.add_argument(
+            "-r", "--new-file", action="store", dest="new_file",
+            help="New HTML file that has to be compare with old html file"
+        )
+        parser.add_argument(
+            '-a', '--accurate-mode', action='store_true', dest='accurate_mode',
+            default=False, help='Use accurate mode instead of risky mode'
+        )
+        parser.add_argument(
+            "--repeat", dest="repeat", type=int, default=3,
+            help="Number of diffs per algorithm, the best time is printed"
+        )
+
+    def handle(self, *args, **options):
+        file_prefix = "contify/website_tracking/dist"
+        old_file = abspath(f'{file_prefix}/{options["old_file"]}')
+        new_file = abspath(f'{file_prefix}/{options["new_file"]}')
+        for path in (old_file, new_file):
+            if not os.path.exists(path):
+                raise CommandError(f"Could not find file: {path}")
+
+        with open(old_file) as f:
+            old_html = utf8_encode(constants.COMMENT_RE.sub('', f.read()))
+        with open(new_file) as f:
+            new_html = utf8_encode(constants.COMMENT_RE.sub('', f.read()))
+
+        print(f"Using '{options['accurate_mode']}' mode")
+        results = {
+            algorithm: self.run_diff(
+                old_html, new_html, options["accurate_mode"], algorithm,
+                options["repeat"]
+            )
+            for algorithm in ALGORITHMS
+        }
+        reference = results["difflib"]
+        for algorithm, result in results.items():
+            print(
+                f"{algorithm:<9} Tokens: {result['tokens']:<7} | setup: "
+                f"{result['setup_time']:.2f}s | match: "
+                f"{result['match_time']:.2f}s | total: "
+                f"{result['total_time']:.2f}s | speedup: "
+                f"{reference['total_time'] / max(result['total_time'], 1e-6):.1f}x"
+                f" | matched tokens: {result['matched']} | same html: "
+                f"{result['html'] == reference['html']}"
+            )
+
+    @staticmethod
+    def run_diff(old_html, new_html, accurate_mode, algorithm, repeat):
+        best = None
+        for _ in range(max(repeat, 1)):
+            start = time.perf_counter()
+            matcher = HTMLMatcher(old_html, new_html, accurate_mode, algorithm)
+            setup_time = time.perf_counter() - start
+            blocks = matcher.get_matching_blocks()
+            match_time = time.perf_counter() - start - setup_time
+            html = matcher.diff_html(True)
+            total_time = time.perf_counter() - start
+            if best is None or total_time < best["total_time"]:
+                best = {
+                    "tokens": len(matcher.a) + len(matcher.b),
+                    "setup_time": setup_time,
+                    "match_time": match_time,
+                    "total_time": total_time,
+                    "matched": sum(block.size for block in blocks),
+                    "html": html,
+                }
+        return best
@@ -0,0 +1,125 @@
+"""
+Measures the delta chains of snapshot_delta on the real WebSnapshots of a
+WebSource, nothing is written.
+
+The raw_html of the WebSnapshots (in the order of their IDs) is encoded as
+a chain with a keyframe every --keyframeInterval versions, the command
+prints the stored size against the raw and the compressed full html of
+every version, and the reconstruction latency of the versions: cold from
+their keyframe, and warm from the previous version (the reconstruction
+cache hit of process_web_snapshot).
+
+Usage:
+python manage.py benchmark_snapshot_delta --ws_id 1203
+python manage.py benchmark_snapshot_delta --ws_id 1203 --limit 50 --keyframeInterval 10
+"""
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contify.website_tracking.blob_store import compress, decompress
+from contify.website_tracking.constants import RAW_HTML_MAX_DELTA_RATIO
+from contify.website_tracking.snapshot_delta import apply_delta, make_delta
+from contify.website_tracking.web_snapshot.models import WebSnapshot
+
+
+class Command(BaseCommand):
+    help = "Measures the storage and reconstruction of raw_html delta chains."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--ws_id", dest="ws_id", type=int, required=True,
+            help="WebSource whose WebSnapshots are the chain"
+        )
+        parser.add_argument(
+            "--limit", dest="limit", type=int, default=100,
+            help="Number of the latest WebSnapshots used"
+        )
+        parser.add_argument(
+            "--keyframeInterval", dest="keyframe_interval", type=int,
+            default=20, help="A keyframe every N versions"
+        )
+
+    def handle(self, *args, **options):
+        wss_qs = WebSnapshot.objects.filter(
+            web_source_id=options["ws_id"]
+        ).order_by("-id")[:options["limit"]]
+        versions = [wss.raw_html or "" for wss in reversed(list(wss_qs))]
+        if len(versions) < 2:
+            raise CommandError(
+                f"WebSource {options['ws_id']} has less than 2 WebSnapshots"
+            )
+
+        raw_size = full_size = chain_size = 0
+        encode_times = []
+        # (blob, index of the base version or None for a keyframe, depth)
+        chain = []
+        for i, text in enumerate(versions):
+            full_blob = compress(text.encode("utf-8"))
+            raw_size += len(text.encode("utf-8"))
+            full_size += len(full_blob)
+
+            blob, base, depth = full_blob, None, 0
+            if chain and chain[-1][2] + 1 < options["keyframe_interval"]:
+                start = time.perf_counter()
+                delta = make_delta(versions[i - 1], text)
+                encode_times.append(time.perf_counter() - start)
+                if len(delta) <= len(text) * RAW_HTML_MAX_DELTA_RATIO:
+                    blob = compress(delta.encode("utf-8"))
+                    base, depth = i - 1, chain[-1][2] + 1
+            chain_size += len(blob)
+            chain.append((blob, base, depth))
+
+        cold_times, warm_times = [], []
+        for i, (blob, base, _) in enumerate(chain):
+            start = time.perf_counter()
+            text = self.reconstruct(chain, i)
+            cold_times.append(time.perf_counter() - start)
+            assert text == versions[i], f"Version {i} does not round trip"
+
+            if base is not None:
+                start = time.perf_counter()
+                apply_delta(versions[base], decompress(blob).decode("utf-8"))
+                warm_times.append(time.perf_counter() - start)
+
+        keyframes = sum(1 for _, base, _ in chain if base is None)
+        print(
+            f"Versions: {len(versions)} | Keyframes: {keyframes} | "
+            f"Deltas: {len(versions) - keyframes}"
+        )
+        print(
+            f"Raw: {raw_size // 1024} KB | Compressed full: "
+            f"{full_size // 1024} KB | Delta chain: {chain_size // 1024} KB"
+        )
+        print(
+            f"Storage ratio: {raw_size / chain_size:.1f}x of raw, "
+            f"{full_size / chain_size:.1f}x of compressed full"
+        )
+        for name, times in (
+                ("Delta encode", encode_times),
+                ("Reconstruct (cold)", cold_times),
+                ("Reconstruct (warm)", warm_times),
+        ):
+            if times:
+                print(
+                    f"{name:<20} mean: {statistics.mean(times) * 1000:.1f} ms "
+                    f"| p95: {self.percentile(times, 95) * 1000:.1f} ms "
+                    f"| max: {max(times) * 1000:.1f} ms"
+                )
+
+    @staticmethod
+    def reconstruct(chain, index):
+        path = []
+        while chain[index][1] is not None:
+            path.append(index)
+            index = chain[index][1]
+        text = decompress(chain[index][0]).decode("utf-8")
+        for index in reversed(path):
+            text = apply_delta(text, decompress(chain[index][0]).decode("utf-8"))
+        return text
+
+    @staticmethod
+    def percentile(values, percent):
+        values = sorted(values)
+        return values[min(len(values) - 1, len(values) * percent // 100)]
@@ -0,0 +1,300 @@
+"""
+Takes the raw_snapshot (full-page screenshot) of the WebSnapshots created
+without one by `fetch_web_source --deferScreenshot`.
+
+Key Points:
+-   Works from the stored WebSnapshot.raw_html, the web page is not fetched
+    again. A <base> tag pointing to the WebSource URL is added so the
+    relative links of the page are resolved.
+-   JavaScript is disabled, raw_html already holds the rendered DOM.
+-   Sub-resources (stylesheets, images, fonts, scripts) are served from an
+    in-memory LRU ResourceCache shared by all the pages of the run.
+-   At most --workers pages are rendered at the same time, so the memory
+    spent rasterizing long pages stays bounded and independent of the
+    fetch job.
+-   A failed capture increments WebSnapshot.capture_attempts, the
+    WebSnapshots that failed CAPTURE_MAX_ATTEMPTS runs are not selected
+    again (--wss_ids still selects them).
+
+Example Usage:
+-   `python manage.py capture_web_snapshot`
+-   `python manage.py capture_web_snapshot --workers 4 --batchSize 200`
+-   `python manage.py capture_web_snapshot --shardNo 1 --maxShard 4`
+"""
+# Python Imports
+import os
+import asyncio
+import fcntl
+import logging
+import traceback
+from collections import defaultdict
+from asgiref.sync import sync_to_async
+from datetime import datetime, timedelta
+from io import StringIO
+
+# Django Imports
+from django.core.files.base import ContentFile
+from django.core.management import BaseCommand
+from django.db.models import F, Q
+from lxml import etree
+from playwright.async_api import async_playwright
+
+# Project Imports
+from contify.website_tracking import cfy_enum as wt_enum
+from contify.website_tracking import constants as wt_constant
+from contify.website_tracking.browser_pool import BrowserPool
+from contify.website_tracking.diff_html.utils import patch_base_tag
+from contify.website_tracking.models import WebSource
+from contify.website_tracking.resource_cache import ResourceCache
+from contify.website_tracking.utils import (
+    prepare_error_report, set_values, fit_viewport_to_page
+)
+from contify.website_tracking.web_snapshot.models import WebSnapshot
+
+logger = logging.getLogger(__name__)
+
+# Constants
+MAX_RETRY = 2
+PAGE_TIMEOUT = 120  # Seconds
+PROCESS_TIMEOUT = 60 * 60  # 1 hour in seconds
+ERROR_DICT = defaultdict(list)
+
+
+class Command(BaseCommand):
+    LOCK_FILE = '/tmp/capture_web_snapshot'
+    """Takes the deferred screenshots of the WebSnapshots."""
+
+    def __init__(self):
+        super().__init__()
+        self.start_date = datetime.now()
+        self.captured_count = 0
+        self.failed_count = 0
+        self.ws_url_map = {}
+
+    def add_arguments(self, parser):
+        """Define command-line arguments."""
+        parser.add_argument(
+            "--wss_ids", action="store", dest="wss_ids", default=None,
+            type=set_values, help="Capture the provided WebSnapshot IDs"
+        )
+        parser.add_argument(
+            "-d", "--duration", dest="duration", default=24, type=int,
+            help="Capture WebSnapshots of the last n hours. Default=24 Hours"
+        )
+        parser.add_argument(
+            "-b", "--batchSize", action="store", dest="batch_size",
+            type=int, default=100,
+            help="Number of WebSnapshots captured in a run"
+        )
+        parser.add_argument(
+            "-w", "--workers", dest="workers", type=int, default=2,
+            help="Number of pages rendered at the same time"
+        )
+        parser.add_argument(
+            "--cacheSize", dest="cache_size", type=int,
+            default=wt_constant.RESOURCE_CACHE_MAX_BYTES // (1024 * 1024),
+            help="Size of the resource cache in MB"
+        )
+        parser.add_argument(
+            "--shardNo", action="store", dest="shard_no", type=int,
+            default=None, help="Used for sharding in job"
+        )
+        parser.add_argument(
+            "--maxShard", dest="max_shard", type=int, default=4,
+            help="The maximum cluster size to process"
+        )
+
+    def handle(self, *args, **options):
+        logger.info(
+            f"CaptureWebSnapshot!, handle function initiated with args: "
+            f"{args} and options: {options}"
+        )
+        shard_no = options.get("shard_no")
+        max_shards = options["max_shard"]
+
+        try:
+            lock_file_name = f"{self.LOCK_FILE}_{shard_no}_{max_shards}"
+            lock_fp = open(lock_file_name, 'w')
+            fcntl.flock(lock_fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            logger.warning(
+                f"CaptureWebSnapshot!, job is probably already running for "
+                f"shard {shard_no}"
+            )
+            return
+
+        wss_qs = WebSnapshot.objects.filter(
+            Q(raw_snapshot__isnull=True) | Q(raw_snapshot=""),
+            state=wt_enum.State.ACTIVE.value,
+            created_on__gte=self.start_date - timedelta(
+                hours=options["duration"]
+            )
+        ).order_by("created_on")
+
+        if options["wss_ids"]:
+            wss_qs = wss_qs.filter(id__in=options["wss_ids"])
+        else:
+            wss_qs = wss_qs.filter(
+                capture_attempts__lt=wt_constant.CAPTURE_MAX_ATTEMPTS
+            )
+
+        # Sharding logic to distribute load across multiple processes
+        if shard_no:
+            wss_qs = wss_qs.extra(
+                where=[f"{WebSnapshot._meta.db_table}.id %% {max_shards} = %s"],
+                params=[shard_no]
+            )
+
+        wss_list = list(wss_qs[:options["batch_size"]])
+        if not wss_list:
+            logger.info("CaptureWebSnapshot!, No WebSnapshot to capture.")
+            return
+
+        self.ws_url_map = dict(
+            WebSource.objects.filter(
+                id__in={wss.web_source_id for wss in wss_list}
+            ).values_list("id", "web_url")
+        )
+
+        err_msg = ""
+        cache = ResourceCache(max_bytes=options["cache_size"] * 1024 * 1024)
+        try:
+            asyncio.run(
+                asyncio.wait_for(
+                    self.capture_snapshots(
+                        wss_list, options["workers"], cache
+                    ),
+                    timeout=PROCESS_TIMEOUT
+                )
+            )
+        except asyncio.TimeoutError:
+            # kill the process group.[Parent + child processes]
+            os.killpg(os.getpgid(os.getpid()), 15)
+            logger.info("asyncio.TimeoutError | Command timed out (1 hour).")
+        except Exception as err:
+            err_msg = f" |\nError: {err} |\nTraceback: {traceback.format_exc()}"
+
+        if ERROR_DICT:
+            prepare_error_report(
+                ERROR_DICT, len(wss_list), "capture_web_snapshot"
+            )
+
+        end_time = datetime.now()
+        execution_time = (end_time - self.start_date).seconds
+        logger.info(
+            f'WebSnapshot capture job '
+            f'Started At: {self.start_date.strftime("%b %d %H:%M:%S")} | '
+            f'Finished At: {end_time.strftime("%b %d %H:%M:%S")} | '
+            f'Time Taken: {execution_time // 60} mins {execution_time % 60} secs | '
+            f'Shard No.: {shard_no} | Max Shards: {max_shards} | '
+            f'Workers: {options["workers"]} | '
+            f'Total WebSnapshot(s): {len(wss_list)} | '
+            f'Captured: {self.captured_count} | Failed: {self.failed_count} | '
+            f'Resource cache: {cache.stats()}' + err_msg
+        )
+
+    async def capture_snapshots(self, wss_list, workers, cache):
+        """Renders the WebSnapshots, `workers` pages at a time."""
+        context_options = dict(
+            wt_constant.CONTEXT_DICT, java_script_enabled=False
+        )
+        async with async_playwright() as p:
+            async with BrowserPool(
+                p, browsers=1, pages_per_browser=workers,
+                context_options=context_options, context_open_delay=0
+            ) as pool:
+                async def handler(context, wss):
+                    await self.capture_snapshot(context, wss, cache)
+
+                await pool.run(wss_list, handler)
+
+    async def capture_snapshot(self, context, wss, cache):
+        """Takes the screenshot of a single WebSnapshot and saves it."""
+        # raw_html of a delta snapshot is read from the DB and blob store
+        raw_html = await _get_raw_html(wss)
+        html = self.prepare_html(
+            raw_html, self.ws_url_map.get(wss.web_source_id)
+        )
+        last_error = None
+        for attempt in range(1, MAX_RETRY + 1):
+            page = await context.new_page()
+            try:
+                await page.route("**/*", cache.handle_route)
+                await page.set_viewport_size({
+                    "width": wt_constant.DEFAULT_VIEWPORT_WIDTH,
+                    "height": wt_constant.DEFAULT_VIEWPORT_HEIGHT,
+                })
+                await page.set_content(
+                    html, timeout=PAGE_TIMEOUT * 1000, wait_until="load"
+                )
+                await page.add_style_tag(content="""
+                    *, *::before, *::after {
+                        animation: none !important;
+                        transition: none !important;
+                    }
+                """)
+                await fit_viewport_to_page(page)
+                screenshot = await page.screenshot(
+                    type="jpeg", full_page=True, quality=100
+                )
+                await _save_raw_snapshot(wss, screenshot)
+                self.captured_count += 1
+                logger.info(
+                    f"CaptureWebSnapshot!, Captured WebSnapshot ID: {wss.id} "
+                    f"| WebSource ID: {wss.web_source_id}"
+                )
+                return
+            except Exception as err:
+                last_error = err
+                logger.info(
+                    f"CaptureWebSnapshot!, WebSnapshot ID: {wss.id} | "
+                    f"Attempt: {attempt}/{MAX_RETRY} | Error: {err}"
+                )
+            finally:
+                await page.close()
+
+        self.failed_count += 1
+        ERROR_DICT[str(last_error)].append({wss.id: str(last_error)[:1000]})
+        try:
+            await _record_failed_capture(wss)
+        except Exception as err:
+            logger.info(
+                f"CaptureWebSnapshot!, WebSnapshot ID: {wss.id} | Unable to "
+                f"record the failed capture: {err}"
+            )
+
+    @staticmethod
+    def prepare_html(raw_html, base_url):
+        """Adds a <base> tag so the relative URLs of raw_html resolve."""
+        if not base_url:
+            return raw_html
+
+        parser = etree.HTMLParser(encoding="utf-8", compact=False)
+        html_tree = etree.parse(StringIO(raw_html), parser)
+        if html_tree.getroot() is None:
+            return raw_html
+
+        patch_base_tag(html_tree, base_url)
+        return etree.tounicode(html_tree, method="html")
+
+
+def get_raw_html(wss):
+    return wss.raw_html
+
+
+def save_raw_snapshot(wss, screenshot):
+    wss.raw_snapshot.save(
+        f"{datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}.jpeg",
+        ContentFile(screenshot)
+    )
+
+
+def record_failed_capture(wss):
+    WebSnapshot.objects.filter(pk=wss.pk).update(
+        capture_attempts=F("capture_attempts") + 1
+    )
+
+
+_get_raw_html = sync_to_async(get_raw_html)
+_save_raw_snapshot = sync_to_async(save_raw_snapshot)
+_record_failed_capture = sync_to_async(record_failed_capture)
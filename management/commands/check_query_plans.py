@@ -0,0 +1,143 @@
+"""
+Query plan regression check of the WebSnapshot queries of the pipeline.
+
+Runs EXPLAIN on the queries below with sequential scans disabled for the
+session, so the planner has to use an index when one can serve the query
+even on a small (e.g. staging) table, and fails when a plan still reads
+web_snapshot_websnapshot with a Seq Scan or does not use the index meant
+for the query (EXPECTED_INDEXES), any other index (primary key, state,
+created_on, ...) would serve it with seq scans disabled:
+
+-   draft: oldest draft WebSnapshot per WebSource (process_web_snapshot).
+-   processed: latest processed WebSnapshot of the drafts' WebSources
+    (process_web_snapshot).
+-   protected: processed WebSnapshots ranked per WebSource
+    (wst_archive_data_maintenance).
+-   latest_hash: latest hash_html per WebSource (fetch_web_source).
+
+Run it after the migrations of web_snapshot, e.g. in the deployment
+pipeline; --verbose prints the full plans. The app has no test suite (and
+the plans need a PostgreSQL database with the real table), so the
+query-plan regression check is this command, not a test.
+
+Usage:
+python manage.py check_query_plans
+python manage.py check_query_plans --ws_ids 12,13 --verbose
+"""
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contify.cutils.utils import get_db_connection
+from contify.website_tracking import cfy_enum as wt_enum
+from contify.website_tracking.management.commands.wst_archive_data_maintenance import (
+    PROTECTED_SNAPSHOTS_QUERY, LATEST_SNAPSHOTS_TO_KEEP_COUNT
+)
+from contify.website_tracking.service import (
+    get_draft_snapshot_qs, get_latest_hash_map_qs,
+    get_latest_processed_snapshot_qs
+)
+from contify.website_tracking.utils import set_values
+from contify.website_tracking.web_snapshot.models import WebSnapshot
+
+
+# Query -> the indexes its plan has to use (one of them)
+EXPECTED_INDEXES = {
+    "draft": {"wss_draft_source_created_idx"},
+    "processed": {"wss_source_status_created_idx", "wss_processed_source_idx"},
+    "latest_hash": {"wss_source_status_created_idx"},
+    "protected": {"wss_processed_source_idx"},
+}
+
+
+def iter_plan_nodes(plan):
+    yield plan
+    for sub_plan in plan.get("Plans", []):
+        yield from iter_plan_nodes(sub_plan)
+
+
+class Command(BaseCommand):
+    help = (
+        "Fails when a WebSnapshot query of the pipeline needs a Seq Scan or "
+        "does not use its index."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--ws_ids", dest="ws_ids", type=set_values, default={1, 2, 3},
+            help="WebSource IDs used as parameters of the queries"
+        )
+        parser.add_argument(
+            "--verbose", action="store_true", dest="verbose", default=False,
+            help="Print the full plans"
+        )
+
+    def get_queries(self, ws_ids):
+        ws_ids = list(ws_ids)
+        queries = [
+            ("draft", get_draft_snapshot_qs()),
+            ("processed", get_latest_processed_snapshot_qs(ws_ids)),
+            ("latest_hash", get_latest_hash_map_qs(ws_ids)),
+        ]
+        queries = [
+            (name, *qs.query.sql_with_params()) for name, qs in queries
+        ]
+        queries.append((
+            "protected", PROTECTED_SNAPSHOTS_QUERY.strip().rstrip(";"), [
+                wt_enum.DiffStatus.PUBLISHED.value,
+                wt_enum.DiffStatus.PUBLISHED.value,
+                wt_enum.SnapshotStatus.PROCESSED.value,
+                LATEST_SNAPSHOTS_TO_KEEP_COUNT
+            ]
+        ))
+        return queries
+
+    def handle(self, *args, **options):
+        table = WebSnapshot._meta.db_table
+        failed = []
+        with get_db_connection(db_alias="web_snapshot") as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SET enable_seqscan = off")
+                try:
+                    for name, sql, params in self.get_queries(options["ws_ids"]):
+                        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+                        plan = cursor.fetchone()[0]
+                        if isinstance(plan, str):
+                            plan = json.loads(plan)
+                        plan = plan[0]["Plan"]
+
+                        nodes = list(iter_plan_nodes(plan))
+                        seq_scans = [
+                            node for node in nodes
+                            if node["Node Type"] == "Seq Scan" and
+                            node.get("Relation Name") == table
+                        ]
+                        indexes = sorted({
+                            node["Index Name"] for node in nodes
+                            if "Index Name" in node
+                        })
+                        expected = EXPECTED_INDEXES[name]
+                        errors = []
+                        if seq_scans:
+                            errors.append(f"Seq Scan on {table}")
+                        if not expected & set(indexes):
+                            errors.append(
+                                f"none of {', '.join(sorted(expected))} used"
+                            )
+                        status = "FAIL" if errors else "OK"
+                        print(
+                            f"{name:<12} {status:<5} Cost: "
+                            f"{plan['Total Cost']:<12} Indexes: "
+                            f"{', '.join(indexes) or '-'}"
+                        )
+                        if options["verbose"]:
+                            print(json.dumps(plan, indent=2))
+                        if errors:
+                            failed.append(f"{name} ({'; '.join(errors)})")
+                finally:
+                    cursor.execute("RESET enable_seqscan")
+
+        if failed:
+            raise CommandError(
+                f"Query plan check failed for: {', '.join(failed)}"
+            )
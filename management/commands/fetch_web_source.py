@@ -5,27 +5,52 @@ pages defined in the WebSource model.
 Key Points:
 -   Retrieves active WebSource records, which define the URLs to be scraped.
 -   Uses Playwright to:
-    -   Launch a headless browser.
+    -   Launch a pool of headless browsers (--browsers x --pagesPerBrowser
+        pages are fetched concurrently, at most --domainConcurrency of them
+        for the same domain and paced by a per-domain token bucket).
+    -   Optionally (--blockResources) capture the DOM with heavy resources
+        blocked and re-render with the full resources only for the
+        screenshot of a new snapshot.
+    -   Optionally (--settleMode adaptive) wait for the page to settle
+        (network idle and no DOM mutation) instead of fixed sleeps, and
+        record the settle time of each WebSource.
+    -   Optionally (--consentCache) inject the cached consent cookies of the
+        domain and skip the cookie dialog discovery.
+    -   Optionally (--httpCache) serve the static assets from an on-disk
+        HTTP cache and restore the storage state of the domain, both kept
+        across runs.
+    -   Optionally (--deferScreenshot) skip the screenshot, it is taken later
+        from the stored raw html by the capture_web_snapshot command.
+    -   Optionally (--preflight) send a conditional HTTP request first and
+        skip the browser render when the server tells nothing changed.
     -   Navigate to each web page.
     -   Optionally handle cookie dialogs to ensure proper page loading.
     -   Scroll the page to load dynamically loaded content.
     -   Capture the full HTML content of the page.
     -   Capture a full-page screenshot of the page.
--  Calculates an MD5 hash of the cleaned HTML content to detect changes.
+-  Calculates a fingerprint of the HTML content to detect changes (MD5 of
+   the cleaned HTML, or with --hashVersion 2 a single pass hash of the
+   visible content).
 -  Stores the HTML and screenshot as a WebSnapshot in the database *only if*
    the content has changed since the last snapshot. (unique MD5 hash)
 -  Implements retry logic to handle transient network errors or website issues.
 
 Usage:
-python manage.py scrape_web_sources --frequency 24 --batchSize 100
+python manage.py fetch_web_source --frequency 2 --batchSize 100
+python manage.py fetch_web_source --browsers 2 --pagesPerBrowser 4
+python manage.py fetch_web_source --frequency 2 --enqueue
+python manage.py fetch_web_source --worker --batchSize 20
+
+With WST_WORK_HANDOFF, a new WebSnapshot is queued for the
+process_web_snapshot workers as soon as it is saved.
 """
 
 # Python Imports
 import os
-import copy
 import asyncio
 import fcntl
 import logging
+import time
 import traceback
 from collections import defaultdict
 from asgiref.sync import sync_to_async
@@ -34,9 +59,8 @@ from datetime import datetime, timedelta
 # Django Imports
 from django.core.files.base import ContentFile
 from django.core.management.base import BaseCommand
-from django.db.utils import DataError
 from django.db import IntegrityError
-from django.db import transaction
+from django.db import router, transaction
 from django.db.models import Q
 from playwright.async_api import (
     async_playwright, TimeoutError as PlaywrightTimeoutError,
@@ -44,26 +68,42 @@ from playwright.async_api import (
 )
 
 # Project Imports
+from contify.website_tracking.browser_pool import BrowserPool
+from contify.website_tracking.consent_cache import ConsentCache
 from contify.website_tracking.cfy_enum import (
-    RunTimeFrequency, State, SnapshotStatus
+    RunTimeFrequency, State, SnapshotStatus, WorkQueue
 )
 from contify.website_tracking.constants import (
-    DEFAULT_VIEWPORT_WIDTH, DEFAULT_VIEWPORT_HEIGHT, CONTEXT_DICT
+    DEFAULT_VIEWPORT_WIDTH, DEFAULT_VIEWPORT_HEIGHT, DOMAIN_RATE_LIMIT_DB,
+    BLOCKED_RESOURCE_TYPES, HTTP_CACHE_DIR, HTTP_CACHE_MAX_BYTES
+)
+from contify.website_tracking.fingerprint import (
+    DEFAULT_HASH_VERSION, HASH_VERSIONS, get_hash_html
 )
 from contify.website_tracking.models import WebSource
+from contify.website_tracking.preflight import PreflightChecker
+from contify.website_tracking.rate_limiter import (
+    DomainRateLimiter, MemoryBucketBackend, SQLiteBucketBackend
+)
+from contify.website_tracking.resource_cache import DiskResourceCache
 from contify.website_tracking.web_snapshot.models import WebSnapshot
 from contify.website_tracking.utils import (
-    set_values, clean_invisible_element, prepare_error_report,
-    handle_cookie_dialog, close_all_popups
+    set_values, prepare_error_report,
+    handle_cookie_dialog, close_all_popups, route_resources,
+    fit_viewport_to_page, pause
 )
 from contify.website_tracking.service import (
-    get_md5_hash_of_string, is_web_snapshot_exists
+    is_web_snapshot_exists, get_latest_hash_map, WebSourceUpdateBuffer
 )
+from contify.website_tracking.management.commands import (
+    add_work_queue_arguments
+)
+from contify.website_tracking.work_queue import QueueWorker, enqueue, handoff
 
 # Limits and configurations constants
 MAX_RETRY = 3  # Maximum number of retries for fetching a webpage
-BATCH_GROUP = 2  # Number of pages processed together in a batch
 CONTEXT_OPEN_DELAY = 1  # Delay before opening a new browser context
+CONTEXT_ROTATE_AFTER = 10  # Pages processed by a worker before a new context
 PROCESS_TIMEOUT = 1 * 60 * 60
 ERROR_DICT = defaultdict(list)
 
@@ -84,6 +124,16 @@ class Command(BaseCommand):
         self.total_snapshots_created = 0  # Counter to track created snapshots
         self.no_change_detected = 0  # Counter to track ws with no change
         self.failed_ws = 0  # Counter to track failed ws
+        self.preflight_skipped = 0  # Counter to track ws skipped by preflight
+        self.preflight = None  # PreflightChecker, set if --preflight is used
+        self.block_resources = False  # Two-phase fetch, set by --blockResources
+        self.defer_screenshot = False  # Set by --deferScreenshot
+        self.settle = False  # Adaptive waits, set by --settleMode adaptive
+        self.consent_cache = None  # ConsentCache, set if --consentCache is used
+        self.http_cache = None  # DiskResourceCache, set if --httpCache is used
+        self.hash_version = DEFAULT_HASH_VERSION  # Set by --hashVersion
+        self.latest_hash_map = {}  # Latest hash_html per WebSource of the batch
+        self.update_buffer = WebSourceUpdateBuffer()
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -118,24 +168,145 @@ class Command(BaseCommand):
             "--ex_client_ids", action="store", dest="exclude_client_ids",
             default=None, type=set_values, help="Client IDs not to process"
         )
+        parser.add_argument(
+            "--browsers", dest="browsers", type=int, default=1,
+            help="Number of Chromium browsers launched by the pool"
+        )
+        parser.add_argument(
+            "--pagesPerBrowser", dest="pages_per_browser", type=int,
+            default=2, help="Number of pages fetched concurrently per browser"
+        )
+        parser.add_argument(
+            "--domainConcurrency", dest="domain_concurrency", type=int,
+            default=1, help=(
+                "Maximum number of pages of the same domain fetched "
+                "concurrently"
+            )
+        )
+        parser.add_argument(
+            "--rateBackend", dest="rate_backend", default="memory",
+            choices={"memory", "sqlite"}, help=(
+                "Where the per-domain token buckets are kept, use 'sqlite' to "
+                "share the limits between the shards running on a host"
+            )
+        )
+        parser.add_argument(
+            "--preflight", action="store_true", dest="preflight",
+            default=False, help=(
+                "Send a conditional HTTP request before rendering a page and "
+                "skip the render when nothing changed"
+            )
+        )
+        parser.add_argument(
+            "--blockResources", action="store_true", dest="block_resources",
+            default=False, help=(
+                "Two-phase fetch: capture the DOM and hash with images, media, "
+                "fonts and trackers blocked, and re-render with the full "
+                "resources only when a screenshot of a new snapshot is needed"
+            )
+        )
+        parser.add_argument(
+            "--deferScreenshot", action="store_true", dest="defer_screenshot",
+            default=False, help=(
+                "Only capture the DOM, the WebSnapshot is created without "
+                "raw_snapshot and capture_web_snapshot takes the screenshot"
+            )
+        )
+        parser.add_argument(
+            "--settleMode", dest="settle_mode", default="fixed",
+            choices=["fixed", "adaptive"], help=(
+                "'fixed' sleeps a fixed time after scrolls and clicks, "
+                "'adaptive' only waits until the page is settled (network "
+                "idle and no DOM mutation) with the fixed time as deadline"
+            )
+        )
+        parser.add_argument(
+            "--consentCache", action="store_true", dest="consent_cache",
+            default=False, help=(
+                "Cache the cookie-consent strategy and cookies per domain and "
+                "skip the dialog discovery when the cache is valid"
+            )
+        )
+        parser.add_argument(
+            "--httpCache", action="store_true", dest="http_cache",
+            default=False, help=(
+                "Serve static assets from an on-disk HTTP cache scoped by "
+                "domain and keep the storage state of the domains across runs"
+            )
+        )
+        parser.add_argument(
+            "--httpCacheDir", dest="http_cache_dir", default=HTTP_CACHE_DIR,
+            help="Directory of the on-disk HTTP cache"
+        )
+        parser.add_argument(
+            "--httpCacheSize", dest="http_cache_size", type=int,
+            default=HTTP_CACHE_MAX_BYTES // (1024 * 1024),
+            help="Size of the on-disk HTTP cache in MB"
+        )
+        parser.add_argument(
+            "--hashVersion", dest="hash_version", type=int,
+            default=DEFAULT_HASH_VERSION, choices=HASH_VERSIONS, help=(
+                "Version of the hash_html fingerprint, run "
+                "rehash_web_snapshot before switching to version 2"
+            )
+        )
+        parser.add_argument(
+            "--rateDB", dest="rate_db", default=DOMAIN_RATE_LIMIT_DB,
+            help="SQLite file used by the 'sqlite' rate backend"
+        )
+        add_work_queue_arguments(parser)
 
     def handle(self, *args, **options):
         """Handles the command execution."""
         start_time = datetime.now()
         frequency = options["frequency"]
         shard_no = options.get('shard_no')
+        max_shards = options['max_shards']
 
-        try:
-            lock_file_name = f"{self.LOCK_FILE}_{frequency}_{shard_no}"
-            lock_fp = open(lock_file_name, 'w')
-            fcntl.flock(lock_fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
-        except IOError:
-            logger.warning(
-                f"FetchWebSource!, job is probably already running for "
-                f"frequency: {frequency} and shard: {shard_no}"
+        if options["worker"]:
+            total_ws_qs_items = self.run_worker(options)
+            self.log_summary(start_time, options, total_ws_qs_items)
+            return
+
+        if not options["enqueue"]:
+            try:
+                lock_file_name = f"{self.LOCK_FILE}_{frequency}_{shard_no}"
+                lock_fp = open(lock_file_name, 'w')
+                fcntl.flock(lock_fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                logger.warning(
+                    f"FetchWebSource!, job is probably already running for "
+                    f"frequency: {frequency} and shard: {shard_no}"
+                )
+                return
+
+        ws_qs = self.get_web_source_qs(options)
+
+        if not ws_qs.exists():
+            logger.info(
+                f"No WebSources to process | Frequency: {frequency} "
+                f"({self.FREQUENCY_RUN_TIME_MAP[frequency]} hours) | "
+                f"Shard No.: {shard_no} | Max Shards: {max_shards}."
             )
             return
 
+        if options["enqueue"]:
+            ws_ids = {ws_id for ws_id, _ in ws_qs.values_list("id", "last_run")}
+            enqueue(WorkQueue.FETCH_WEB_SOURCE, ws_ids)
+            logger.info(
+                f"FetchWebSource!, {len(ws_ids)} WebSource(s) queued | "
+                f"Frequency: {frequency}"
+            )
+            return
+
+        err_msg = self.run_batch(list(ws_qs[:options["batch_size"]]), options)
+        self.log_summary(start_time, options, len(ws_qs), err_msg)
+
+    def get_web_source_qs(self, options):
+        """Active WebSources of the frequency due for a fetch."""
+        frequency = options["frequency"]
+        shard_no = options.get('shard_no')
+
         # Query WebSource records that are active and need processing
         ws_qs = (
             WebSource.objects
@@ -173,46 +344,112 @@ class Command(BaseCommand):
             ws_qs = ws_qs.extra(
                 where=[f"{WebSource._meta.db_table}.id %% {max_shards} = {shard_no}"]
             )
+        return ws_qs
 
-        if not ws_qs.exists():
-            logger.info(
-                f"No WebSources to process | Frequency: {frequency} "
-                f"({self.FREQUENCY_RUN_TIME_MAP[frequency]} hours) | "
-                f"Shard No.: {shard_no} | Max Shards: {max_shards}."
-            )
-            return
-
+    def run_batch(self, ws_list, options):
+        """Fetches the WebSources, returns the error message of the run."""
         err_msg = ""
-        ws_list = list(ws_qs[:options["batch_size"]])
+        self.block_resources = options["block_resources"]
+        self.defer_screenshot = options["defer_screenshot"]
+        self.settle = options["settle_mode"] == "adaptive"
+        self.hash_version = options["hash_version"]
+        rate_limiter = self.get_rate_limiter(
+            ws_list, options["rate_backend"], options["rate_db"]
+        )
+        self.latest_hash_map = get_latest_hash_map([ws.id for ws in ws_list])
+        if options["http_cache"] and self.http_cache is None:
+            self.http_cache = DiskResourceCache(
+                options["http_cache_dir"],
+                max_bytes=options["http_cache_size"] * 1024 * 1024
+            )
+        if options["consent_cache"]:
+            self.consent_cache = ConsentCache.load(
+                ws.domain for ws in ws_list
+            )
         try:
             asyncio.run(
                 asyncio.wait_for(
-                    self.process_batches(ws_list), timeout=PROCESS_TIMEOUT
+                    self.process_batches(
+                        ws_list, browsers=options["browsers"],
+                        pages_per_browser=options["pages_per_browser"],
+                        domain_concurrency=options["domain_concurrency"],
+                        rate_limiter=rate_limiter,
+                        preflight=options["preflight"]
+                    ),
+                    timeout=PROCESS_TIMEOUT
                 )
             )
         except asyncio.TimeoutError:
-            # kill the process group.[Parent + child processes]
-            os.killpg(os.getpgid(os.getpid()), 15)
-            logger.info(
-                "asyncio.TimeoutError | Command execution exceeded 1 hour."
-            )
+            if options["worker"]:
+                # wait_for cancelled the batch, its work items are failed
+                # and retried, the worker keeps its other leases
+                err_msg = (
+                    f" |\nError: Batch execution exceeded {PROCESS_TIMEOUT} "
+                    f"seconds."
+                )
+            else:
+                # kill the process group.[Parent + child processes]
+                os.killpg(os.getpgid(os.getpid()), 15)
+                logger.info(
+                    "asyncio.TimeoutError | Command execution exceeded 1 hour."
+                )
         except Exception as err:
             err_msg = f" |\nError: {err} |\nTraceback: {traceback.format_exc()}"
+        finally:
+            rate_limiter.close()
+        return err_msg
+
+    def run_worker(self, options):
+        """
+        Fetches the WebSources of the work queue until stopped, returns the
+        number of WebSources processed.
+        """
+        def handler(ws_ids):
+            ws_list = list(
+                WebSource.objects.filter(id__in=ws_ids, state=State.ACTIVE.value)
+            )
+            try:
+                if ws_list:
+                    err_msg = self.run_batch(ws_list, options)
+                    if err_msg:
+                        raise RuntimeError(err_msg)
+            finally:
+                # Reported per batch, the worker does not exit
+                if ERROR_DICT:
+                    prepare_error_report(
+                        ERROR_DICT, len(ws_ids), "fetch_web_source"
+                    )
+                    ERROR_DICT.clear()
 
+        worker = QueueWorker(
+            WorkQueue.FETCH_WEB_SOURCE, batch_size=options["batch_size"],
+            max_batches=options["max_batches"]
+        )
+        worker.run(handler)
+        return worker.processed + worker.failed
+
+    def log_summary(self, start_time, options, total_ws_qs_items, err_msg=""):
+        frequency = options["frequency"]
         end_time = datetime.now()
         execution_time = (end_time - start_time).seconds
-        total_ws_qs_items = len(ws_qs)
         end_log = (
             f'WebSource fetch job '
             f'Started At: {start_time.strftime("%b %d %H:%M:%S")} | '
             f'Finished At: {end_time.strftime("%b %d %H:%M:%S")} | '
             f'Time Taken: {execution_time // 60} mins {execution_time % 60} secs | '
             f'Frequency: {frequency} ({self.FREQUENCY_RUN_TIME_MAP[frequency]} hours) | '
-            f'Shard No.: {shard_no} | Max Shards: {max_shards} | '
+            f'Shard No.: {options.get("shard_no")} | Max Shards: {options["max_shards"]} | '
+            f'Worker: {options["worker"]} | '
             f'Total WebSource(s) Processed: {total_ws_qs_items} | '
             f'Total WebSnapshot(s) Created: {self.total_snapshots_created} | '
-            f'WebSource(s) with no change detected: {self.no_change_detected}'
-        ) + err_msg
+            f'WebSource(s) with no change detected: {self.no_change_detected} | '
+            f'WebSource(s) skipped by preflight: {self.preflight_skipped}'
+        )
+        if self.consent_cache:
+            end_log += f" | Consent cache: {self.consent_cache.stats()}"
+        if self.http_cache:
+            end_log += f" | HTTP cache: {self.http_cache.stats()}"
+        end_log += err_msg
 
         logger.info(end_log)
         if ERROR_DICT:
@@ -220,49 +457,52 @@ class Command(BaseCommand):
                 ERROR_DICT, total_ws_qs_items, "fetch_web_source"
             )
 
-    async def process_batches(self, ws_qs):
+    @staticmethod
+    def get_rate_limiter(ws_list, backend, db_path):
         """
-        Processes WebSource objects in pairs, deciding processing strategy
-        based on domain match.
+        Creates the per-domain rate limiter and configures it from the
+        domain_rate_limit and domain_rate_burst of the WebSources.
         """
-        async with async_playwright() as p:
-            browser = None
-            context = None
-            try:
-                browser = await p.chromium.launch(
-                    headless=True,
-                    args=[
-                        "--no-sandbox",
-                        "--disable-http2",
-                        "--disable-setuid-sandbox",
-                        f"--window-size={DEFAULT_VIEWPORT_WIDTH},{DEFAULT_VIEWPORT_HEIGHT}",
-                          ]
+        if backend == "sqlite":
+            bucket_backend = SQLiteBucketBackend(db_path)
+        else:
+            bucket_backend = MemoryBucketBackend()
+
+        rate_limiter = DomainRateLimiter(bucket_backend)
+        for ws in ws_list:
+            if ws.domain:
+                rate_limiter.configure(
+                    ws.domain, ws.domain_rate_limit, ws.domain_rate_burst
                 )
-                for i in range(0, len(ws_qs), BATCH_GROUP):
-                    # Rotate context every 10 batches
-                    if i % (BATCH_GROUP * 10) == 0:
-                        if context:
-                            await context.close()
-                        context = await browser.new_context(**CONTEXT_DICT)
-                        await asyncio.sleep(CONTEXT_OPEN_DELAY)
-
-                    batch = ws_qs[i:i + BATCH_GROUP]
-
-                    # Different domain, process them parallely
-                    if len(batch) == 2 and batch[0].domain == batch[1].domain:
-                        await self.process_single_source(context, batch[0])
-                        await asyncio.sleep(3)
-                        await self.process_single_source(context, batch[1])
-                    else:
-                        await asyncio.gather(
-                            *[self.process_single_source(context, ws) for ws in batch]
-                        )
+        return rate_limiter
 
+    async def process_batches(self, ws_qs, browsers=1, pages_per_browser=2,
+                              domain_concurrency=1, rate_limiter=None,
+                              preflight=False):
+        """
+        Processes WebSource objects through a BrowserPool, WebSources of the
+        same domain are limited by `domain_concurrency` and `rate_limiter`.
+        """
+        async with async_playwright() as p:
+            if preflight:
+                self.preflight = await PreflightChecker(p).start()
+            pool = BrowserPool(
+                p, browsers=browsers, pages_per_browser=pages_per_browser,
+                domain_concurrency=domain_concurrency,
+                rate_limiter=rate_limiter,
+                context_rotate_after=CONTEXT_ROTATE_AFTER,
+                context_open_delay=CONTEXT_OPEN_DELAY
+            )
+            try:
+                async with pool:
+                    await pool.run(
+                        ws_qs, self.process_single_source,
+                        key=lambda ws: ws.domain
+                    )
             finally:
-                if context:
-                    await context.close()
-                if browser:
-                    await browser.close()
+                await self.update_buffer.flush()
+                if self.preflight:
+                    await self.preflight.close()
 
     async def process_single_source(self, context, ws_obj, max_timeout=180):
         """Fetches a single WebSource and creates a snapshot if needed."""
@@ -270,6 +510,24 @@ class Command(BaseCommand):
         web_url = ws_obj.web_url
         response = None
 
+        preflight_result = None
+        if self.preflight and not ws_obj.skip_preflight:
+            preflight_result = await self.preflight.check(ws_obj)
+            if not preflight_result.changed:
+                self.no_change_detected += 1
+                self.preflight_skipped += 1
+                logger.info(
+                    f"Preflight! No changes detected for WebSource-ID: "
+                    f"{ws_obj_id}, URL: {web_url}, Status: "
+                    f"{preflight_result.status}."
+                )
+                if preflight_result.info != ws_obj.preflight_info:
+                    await self.save_preflight_info(
+                        ws_obj, preflight_result.info
+                    )
+                await self.update_web_source(ws_obj, None)
+                return
+
         page = await context.new_page()
         await page.set_viewport_size({
             "width": DEFAULT_VIEWPORT_WIDTH,
@@ -283,52 +541,41 @@ class Command(BaseCommand):
                 f"Web URL: {web_url} | Attempt: {attempt}/{MAX_RETRY}"
             )
             try:
-                response = await page.goto(
-                    web_url, timeout=max_timeout * 1000,
-                    wait_until="domcontentloaded"
+                # Phase one: DOM and hash, heavy resources are blocked in the
+                # two-phase mode
+                response = await self.load_page(
+                    page, ws_obj, max_timeout, block_heavy=True
                 )
-
-                accept_cookie_xpaths = ws_obj.accept_cookie_xpaths
-                if accept_cookie_xpaths:
-                    for accept_cookie_xpath in accept_cookie_xpaths:
-                        await handle_cookie_dialog(
-                            page, xpath=accept_cookie_xpath
-                        )
-                else:
-                    await close_all_popups(page)
-                await self.auto_scroll(page)
-
-                # Remove animations and transitions to avoid flickering in
-                # screenshot
-                await page.add_style_tag(content="""
-                    *, *::before, *::after {
-                        animation: none !important;
-                        transition: none !important;
-                    }
-                """)
-
-                await page.evaluate("window.scrollTo(0, 0)")
-                await page.wait_for_timeout(1000)
-                height = await page.evaluate(
-                    "document.documentElement.offsetHeight"
-                )
-                if height > DEFAULT_VIEWPORT_HEIGHT:
-                    await page.set_viewport_size({
-                        "width": DEFAULT_VIEWPORT_WIDTH,
-                        "height": height - 10
-                    })
+                if not (self.block_resources or self.defer_screenshot):
+                    await fit_viewport_to_page(page, settle=self.settle)
 
                 raw_html = await page.content()
-                new_md5_hash = get_md5_hash_of_string(
-                    clean_invisible_element(copy.deepcopy(raw_html.replace(
-                        "\n", ""
-                    )))
-                )
+                new_md5_hash = get_hash_html(raw_html, self.hash_version)
 
-                if not await is_web_snapshot_exists(ws_obj_id, new_md5_hash):
+                if await self.is_web_snapshot_exists(ws_obj_id, new_md5_hash):
+                    self.no_change_detected += 1
+                    logger.info(
+                        f"No changes detected for WebSource-ID: {ws_obj_id}, "
+                        f"URL: {web_url}."
+                    )
+                elif self.defer_screenshot:
+                    # raw_snapshot is taken later by capture_web_snapshot
+                    await self.create_web_snapshot(
+                        ws_obj, new_md5_hash, None, raw_html
+                    )
+                    self.total_snapshots_created += 1
+                else:
                     screenshot = None
                     try:
-                        await page.wait_for_timeout(1000)
+                        if self.block_resources:
+                            # Phase two: re-render with the full resources
+                            # only for the screenshot
+                            response = await self.load_page(
+                                page, ws_obj, max_timeout, block_heavy=False
+                            )
+                            await fit_viewport_to_page(page, settle=self.settle)
+
+                        await pause(page, 1000, settle=self.settle)
                         screenshot = await page.screenshot(
                             type="jpeg", full_page=True, quality=100
                         )
@@ -342,11 +589,16 @@ class Command(BaseCommand):
                             ws_obj, new_md5_hash, screenshot, raw_html
                         )
                         self.total_snapshots_created += 1
-                else:
-                    self.no_change_detected += 1
-                    logger.info(
-                        f"No changes detected for WebSource-ID: {ws_obj_id}, "
-                        f"URL: {web_url}."
+
+                if self.http_cache:
+                    await self.http_cache.save_storage_state(
+                        page, ws_obj.domain
+                    )
+
+                # Validators are stored only after a successful fetch
+                if preflight_result and preflight_result.info and not last_error:
+                    await self.save_preflight_info(
+                        ws_obj, preflight_result.info
                     )
                 break
 
@@ -398,19 +650,99 @@ class Command(BaseCommand):
         if page:
             await page.close()
 
-    @staticmethod
-    async def update_web_source(ws_obj, error):
-        """Updates WebSource fields asynchronously using sync_to_async."""
+    async def update_web_source(self, ws_obj, error):
+        """
+        Updates WebSource fields, the updates are buffered and written with
+        a bulk UPDATE.
+        """
         ws_obj.last_error = str(error)
-        now = datetime.now()
-        state = ws_obj.state
-        # Using update to prevent race conditions
-        await sync_to_async(WebSource.objects.filter(pk=ws_obj.pk).update)(
-            last_run=now, last_error=error, updated_on=now, state=state
+        await self.update_buffer.add(ws_obj, error)
+
+    async def is_web_snapshot_exists(self, ws_obj_id, new_hash):
+        """
+        Checks the preloaded latest hash first, the DB is only queried when
+        the page differs from the latest WebSnapshot.
+        """
+        if self.latest_hash_map.get(ws_obj_id) == new_hash:
+            return True
+        return await is_web_snapshot_exists(ws_obj_id, new_hash)
+
+    async def load_page(self, page, ws_obj, max_timeout, block_heavy=False):
+        """
+        Navigates to the WebSource, handles the cookie dialog and popups and
+        scrolls the page to load its lazy content.
+
+        In the two-phase mode (--blockResources) tracker requests are always
+        aborted, and the heavy resources (images, media and fonts) too if
+        `block_heavy`. With --httpCache the other requests go through the
+        on-disk cache of the domain.
+        """
+        if self.block_resources:
+            await route_resources(
+                page, resource_types=(
+                    BLOCKED_RESOURCE_TYPES if block_heavy else ()
+                ), resource_cache=self.http_cache, domain=ws_obj.domain
+            )
+        elif self.http_cache:
+            await route_resources(
+                page, url_patterns=(), resource_cache=self.http_cache,
+                domain=ws_obj.domain
+            )
+        if self.http_cache:
+            await self.http_cache.load_storage_state(page, ws_obj.domain)
+
+        consent = None
+        if self.consent_cache:
+            consent = await self.consent_cache.inject(page, ws_obj)
+
+        response = await page.goto(
+            ws_obj.web_url, timeout=max_timeout * 1000,
+            wait_until="domcontentloaded"
         )
+        loaded_on = time.monotonic()
+
+        accept_cookie_xpaths = ws_obj.accept_cookie_xpaths
+        if accept_cookie_xpaths:
+            if not (
+                    self.consent_cache and
+                    await self.consent_cache.replay(page, consent, self.settle)
+            ):
+                consent_results = []
+                for accept_cookie_xpath in accept_cookie_xpaths:
+                    consent_results.append(await handle_cookie_dialog(
+                        page, xpath=accept_cookie_xpath, settle=self.settle
+                    ))
+                if self.consent_cache:
+                    await self.consent_cache.record(
+                        page, ws_obj, consent_results
+                    )
+        else:
+            await close_all_popups(page, settle=self.settle)
+        await self.auto_scroll(page)
+        if self.settle:
+            ws_obj.settle_time = int((time.monotonic() - loaded_on) * 1000)
+
+        # Remove animations and transitions to avoid flickering in
+        # screenshot
+        await page.add_style_tag(content="""
+            *, *::before, *::after {
+                animation: none !important;
+                transition: none !important;
+            }
+        """)
+
+        await page.evaluate("window.scrollTo(0, 0)")
+        return response
 
     @staticmethod
-    async def auto_scroll(page, scroll_limit=5):
+    async def save_preflight_info(ws_obj, info):
+        """Stores the pre-flight validators of the last successful fetch."""
+        ws_obj.preflight_info = info
+        await sync_to_async(WebSource.objects.filter(pk=ws_obj.pk).update)(
+            preflight_info=info
+        )
+
+    async def auto_scroll(self, page, scroll_limit=5):
         """
         Scrolls until the page stops loading new content or reaches the scroll
         limit.
@@ -425,7 +757,7 @@ class Command(BaseCommand):
                 await page.evaluate(
                     "window.scrollTo(0, document.body.scrollHeight)"
                 )
-                await asyncio.sleep(1)
+                await pause(page, 1000, settle=self.settle)
             except Exception:
                 break
 
@@ -447,9 +779,14 @@ class Command(BaseCommand):
                     hash_html=new_hash
                 )
 
-                snapshot.raw_snapshot.save(
-                    f"{datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}.jpeg",
-                    ContentFile(screenshot)
+                if screenshot:
+                    snapshot.raw_snapshot.save(
+                        f"{datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}.jpeg",
+                        ContentFile(screenshot)
+                    )
+                handoff(
+                    WorkQueue.PROCESS_WEB_SNAPSHOT, [ws_obj.id],
+                    using=router.db_for_write(WebSnapshot)
                 )
                 return snapshot.id
             except IntegrityError as e:
@@ -459,24 +796,9 @@ class Command(BaseCommand):
                 )
 
         snapshot_id = await _create_snapshot_sync()
+        if snapshot_id:
+            self.latest_hash_map[ws_obj.id] = new_hash
         logger.info(
             f"Created WebSnapshot ID: {snapshot_id} for WebSource {ws_obj.id}."
         )
 
-
-@sync_to_async
-def save_ws_obj(ws_obj):
-    try:
-        ws_obj.save()
-    except DataError as e:
-        logger.warning(
-            f"DataError: WS ID: {ws_obj.id}, Error: {e}, Traceback: "
-            f"{traceback.format_exc()}"
-        )
-        pass
-    except Exception as err:
-        logger.error(
-            f'Error: WS ID: {ws_obj.id}, '
-            f'Unexpected Error: {err}, Traceback: {traceback.format_exc()}'
-        )
-        pass
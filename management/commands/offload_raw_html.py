@@ -0,0 +1,144 @@
+"""
+Moves the raw_html of the existing WebSnapshots to the raw_html blob store.
+
+New WebSnapshots are offloaded on save once RAW_HTML_BLOB_BACKEND is set,
+this command backfills the older ones in the order of their IDs: the
+compressed raw_html is stored under the key of its hash_html, then the
+WebSnapshot keeps the key and its raw_html column is emptied. With
+WST_RAW_HTML_KEYFRAME_INTERVAL set they are stored as delta chains (see
+snapshot_delta), --verify then reconstructs every version from its
+keyframe. Pass the "Last ID" logged by a run as --afterId of the next one.
+
+Usage:
+python manage.py offload_raw_html --dryRun
+python manage.py offload_raw_html --batchSize 5000 --verify
+python manage.py offload_raw_html --batchSize 5000 --afterId 120000
+"""
+# Python Imports
+import fcntl
+import logging
+import traceback
+from datetime import datetime
+
+# Django Imports
+from django.core.management.base import BaseCommand, CommandError
+
+# Project Imports
+from contify.website_tracking.blob_store import get_blob_store
+from contify.website_tracking.snapshot_delta import (
+    CHAIN_FIELDS, ReconstructionCache, get_raw_html, store_raw_html
+)
+from contify.website_tracking.utils import set_values
+from contify.website_tracking.web_snapshot.models import WebSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    LOCK_FILE = "/tmp/offload_raw_html"
+    help = "Moves the raw_html of the WebSnapshots to the blob store."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-b", "--batchSize", dest="batch_size", type=int, default=1000,
+            help="Number of WebSnapshots offloaded in a run"
+        )
+        parser.add_argument(
+            "--ws_ids", dest="ws_ids", type=set_values, default=None,
+            help="Only offload the WebSnapshots of the given WebSource IDs"
+        )
+        parser.add_argument(
+            "--afterId", dest="after_id", type=int, default=0,
+            help="Only offload the WebSnapshots with a greater ID"
+        )
+        parser.add_argument(
+            "--verify", action="store_true", dest="verify", default=False,
+            help="Read every blob back before emptying the raw_html column"
+        )
+        parser.add_argument(
+            "--dryRun", action="store_true", dest="dry_run", default=False,
+            help="Only count the WebSnapshots to offload"
+        )
+
+    def handle(self, *args, **options):
+        logger.info(
+            f"OffloadRawHtml!, handle function initiated with args: "
+            f"{args} and options: {options}"
+        )
+        start_time = datetime.now()
+
+        blob_store = get_blob_store()
+        if blob_store is None:
+            raise CommandError(
+                "WST_RAW_HTML_BLOB_BACKEND is not set, there is no blob store "
+                "to offload the raw_html to."
+            )
+
+        try:
+            lock_fp = open(self.LOCK_FILE, 'w')
+            fcntl.flock(lock_fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            logger.warning("OffloadRawHtml!, job is probably already running")
+            return
+
+        wss_qs = WebSnapshot.objects.filter(
+            raw_html_key__isnull=True
+        ).exclude(_raw_html="")
+        if options["ws_ids"]:
+            wss_qs = wss_qs.filter(web_source_id__in=options["ws_ids"])
+
+        wss_ids = list(
+            wss_qs.filter(id__gt=options["after_id"]).order_by("id")
+            .values_list("id", flat=True)[:options["batch_size"]]
+        )
+
+        offloaded = deltas = failed = raw_bytes = 0
+        for wss in (
+                WebSnapshot.objects.filter(id__in=wss_ids).order_by("id")
+                .only(*CHAIN_FIELDS)
+                .iterator(chunk_size=100)
+        ):
+            if options["dry_run"]:
+                offloaded += 1
+                raw_bytes += len(wss._raw_html.encode("utf-8"))
+                continue
+
+            raw_html = wss._raw_html
+            try:
+                store_raw_html(wss, blob_store)
+                wss._raw_html = ""
+                if (
+                        options["verify"] and
+                        get_raw_html(wss, blob_store, ReconstructionCache())
+                        != raw_html
+                ):
+                    raise ValueError(
+                        f"Blob {wss.raw_html_key} does not match the raw_html"
+                    )
+                WebSnapshot.objects.filter(pk=wss.pk).update(
+                    raw_html_key=wss.raw_html_key,
+                    delta_base_id=wss.delta_base_id,
+                    delta_keyframe_id=wss.delta_keyframe_id,
+                    delta_depth=wss.delta_depth, _raw_html=""
+                )
+            except Exception as err:
+                failed += 1
+                logger.info(
+                    f"OffloadRawHtml!, WebSnapshot ID: {wss.id} | Error: "
+                    f"{err} | Traceback: {traceback.format_exc()}"
+                )
+                continue
+            offloaded += 1
+            deltas += bool(wss.delta_base_id)
+            raw_bytes += len(raw_html.encode("utf-8"))
+
+        execution_time = (datetime.now() - start_time).seconds
+        logger.info(
+            f"OffloadRawHtml!, Dry run: {options['dry_run']} | "
+            f"WebSnapshot(s): {len(wss_ids)} | Offloaded: {offloaded} | "
+            f"Deltas: {deltas} | "
+            f"Raw HTML: {raw_bytes // (1024 * 1024)} MB | Failed: {failed} | "
+            f"Remaining: {wss_qs.count()} | "
+            f"Last ID: {wss_ids[-1] if wss_ids else None} | "
+            f"Time Taken: {execution_time // 60} mins {execution_time % 60} secs"
+        )
@@ -23,6 +23,9 @@ Example Usage:
     `python manage.py process_diff_html --failed`
 -   Process DiffHtml objects in shard 1 of 4:
     `python manage.py process_diff_html --shard_no 1 --max_shard 4`
+-   Queue the DiffHtml objects and process them with long-running workers:
+    `python manage.py process_diff_html --enqueue`
+    `python manage.py process_diff_html --worker --batchSize 20`
 """
 # Python Imports
 import os
@@ -50,12 +53,16 @@ from contify.website_tracking.utils import (
     prepare_error_report, authenticate_context, set_values,
     handle_cookie_dialog, close_all_popups
 )
+from contify.website_tracking.management.commands import (
+    add_work_queue_arguments
+)
 from contify.website_tracking.models import WebSource
 from contify.website_tracking import cfy_enum as wt_enum
 from contify.website_tracking import constants as wt_constant
 from contify.website_tracking.web_snapshot.models import (
     DiffContent, DiffHtml, WebSnapshot
 )
+from contify.website_tracking.work_queue import QueueWorker, enqueue
 
 logger = logging.getLogger(__name__)
 
@@ -117,6 +124,7 @@ class Command(BaseCommand):
             "--maxShard", dest="max_shard", type=int, default=4,
             help="The maximum cluster size to process"
         )
+        add_work_queue_arguments(parser)
 
     def handle(self, *args, **options):
         logger.info(
@@ -148,21 +156,27 @@ class Command(BaseCommand):
         if process_failed:
             status = wt_enum.DiffHtmlStatus.FAILED.value
 
-        extra_str = ''
-        if options:
-            for k, v in list(options.items()):
-                extra_str += '{}_{}'.format(k, v)
-        try:
-            lock_file_name = f"{self.LOCK_FILE}_{extra_str}"
-            lock_fp = open(lock_file_name, 'w')
-            fcntl.flock(lock_fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
-        except IOError:
-            logger.warning(
-                "ProcessDiffHtml!, job is probably already running for and "
-                "shard {}".format(shard_no)
-            )
+        if options["worker"]:
+            self.run_worker(status, options)
+            self.log_summary(options)
             return
 
+        if not options["enqueue"]:
+            extra_str = ''
+            if options:
+                for k, v in list(options.items()):
+                    extra_str += '{}_{}'.format(k, v)
+            try:
+                lock_file_name = f"{self.LOCK_FILE}_{extra_str}"
+                lock_fp = open(lock_file_name, 'w')
+                fcntl.flock(lock_fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                logger.warning(
+                    "ProcessDiffHtml!, job is probably already running for and "
+                    "shard {}".format(shard_no)
+                )
+                return
+
         dh_queryset = DiffHtml.objects.filter(
             status=status,
             state=wt_enum.State.ACTIVE.value,
@@ -184,6 +198,12 @@ class Command(BaseCommand):
                 params=[shard_no]
             )
 
+        if options["enqueue"]:
+            dh_ids = list(dh_queryset.values_list("id", flat=True))
+            enqueue(wt_enum.WorkQueue.PROCESS_DIFF_HTML, dh_ids)
+            logger.info(f"ProcessDiffHtml!, {len(dh_ids)} DiffHtml(s) queued")
+            return
+
         err_msg = ''
         if dh_queryset.exists():
             try:
@@ -207,6 +227,29 @@ class Command(BaseCommand):
         if ERROR_DICT:
             prepare_error_report(ERROR_DICT, processed_count,"process_diff_html")
 
+        self.log_summary(options, err_msg)
+
+    def run_worker(self, status, options):
+        """Processes the DiffHtmls of the work queue until stopped."""
+        def handler(dh_ids):
+            dh_list = list(
+                DiffHtml.objects.filter(
+                    id__in=dh_ids, status=status,
+                    state=wt_enum.State.ACTIVE.value
+                ).order_by("created_on")
+            )
+            if dh_list:
+                asyncio.run(self.process_diff_htmls(dh_list))
+            if ERROR_DICT:
+                prepare_error_report(ERROR_DICT, len(dh_list), "process_diff_html")
+                ERROR_DICT.clear()
+
+        QueueWorker(
+            wt_enum.WorkQueue.PROCESS_DIFF_HTML,
+            batch_size=options["batch_size"], max_batches=options["max_batches"]
+        ).run(handler)
+
+    def log_summary(self, options, err_msg=""):
         end_time = datetime.now()
         execution_time = (end_time - self.start_date).seconds
         logger.info(
@@ -214,8 +257,10 @@ class Command(BaseCommand):
             f'Started At: {self.start_date.strftime("%b %d %H:%M:%S")} | '
             f'Finished At: {end_time.strftime("%b %d %H:%M:%S")} | '
             f'Time Taken: {execution_time // 60} mins {execution_time % 60} secs | '
-            f'Shard No.: {shard_no} | Max Shards: {max_shards} | '
-            f'Process Failed DiffHtml: {process_failed} | '
+            f'Shard No.: {options.get("shard_no")} | '
+            f'Max Shards: {options["max_shard"]} | '
+            f'Worker: {options["worker"]} | '
+            f'Process Failed DiffHtml: {options.get("process_failed")} | '
             f'Total DiffHtml(s) Processed: {self.processed_count} | '
             f'Failed: {self.failed_count}' + err_msg
         )
@@ -7,13 +7,19 @@ import traceback
 from datetime import datetime
 
 from django.core.management.base import BaseCommand
-from django.db import transaction, IntegrityError
+from django.db import router, transaction, IntegrityError
 from contify.website_tracking import cfy_enum as wt_enum
-from contify.website_tracking.management.commands import format_error_msg
+from contify.website_tracking.management.commands import (
+    add_work_queue_arguments, format_error_msg
+)
+from contify.website_tracking.diff_pool import DiffPool
 from contify.website_tracking.models import WebSource
 from contify.website_tracking.web_snapshot.models import WebSnapshot, DiffHtml
-from contify.website_tracking.service import get_diff_html
+from contify.website_tracking.service import (
+    get_diff_html, get_draft_snapshot_qs, get_latest_processed_snapshot_map
+)
 from contify.website_tracking.utils import prepare_error_report, set_values
+from contify.website_tracking.work_queue import QueueWorker, enqueue, handoff
 
 
 logger = logging.getLogger(__name__)
@@ -59,6 +65,13 @@ class Command(BaseCommand):
             "--maxShard", dest="max_shard", type=int, default=4,
             help="The maximum cluster size to process"
         )
+        parser.add_argument(
+            "--workers", dest="workers", type=int, default=1, help=(
+                "Number of processes computing the diffs, the timeout of a "
+                "diff is enforced by the pool"
+            )
+        )
+        add_work_queue_arguments(parser)
 
     def __init__(self, *args, **kwargs):
         self.start_date = datetime.now()
@@ -79,26 +92,27 @@ class Command(BaseCommand):
         shard_no = options["shard_no"]
         max_shard = options["max_shard"]
 
-        try:
-            lock_file_name = "{}_{}".format(self.LOCK_FILE, shard_no)
-            lock_fp = open(lock_file_name, 'w')
-            fcntl.flock(lock_fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
-        except IOError:
-            logger.warning(
-                "ProcessWebSnapshot!, job is probably already running for and "
-                "shard {}".format(shard_no)
+        if options["worker"]:
+            total = self.run_worker(options)
+            logger.info(
+                f"ProcessWebSnapshot!, Worker took {time.time() - t:0.4f} "
+                f"seconds in processing the {total} WebSource items."
             )
             return
 
-        wss_draft_qs = (
-            WebSnapshot.objects
-            .filter(
-                status=wt_enum.SnapshotStatus.DRAFT.value,
-                state=wt_enum.State.ACTIVE.value
-            )
-            .order_by('web_source_id', 'created_on')
-            .distinct('web_source_id')
-        )
+        if not options["enqueue"]:
+            try:
+                lock_file_name = "{}_{}".format(self.LOCK_FILE, shard_no)
+                lock_fp = open(lock_file_name, 'w')
+                fcntl.flock(lock_fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                logger.warning(
+                    "ProcessWebSnapshot!, job is probably already running for and "
+                    "shard {}".format(shard_no)
+                )
+                return
+
+        wss_draft_qs = get_draft_snapshot_qs()
 
         if ws_ids:
             wss_draft_qs = wss_draft_qs.filter(web_source_id__in=ws_ids)
@@ -113,88 +127,122 @@ class Command(BaseCommand):
                 params=[shard_no]
             )
 
-        wss_draft_qs = wss_draft_qs[:batch_size]
-
-        if wss_draft_qs.exists():
-            web_source_ids = [s.web_source_id for s in wss_draft_qs]
-
+        if options["enqueue"]:
+            web_source_ids = list(
+                wss_draft_qs.values_list("web_source_id", flat=True)
+            )
+            enqueue(wt_enum.WorkQueue.PROCESS_WEB_SNAPSHOT, web_source_ids)
             logger.info(
-                "ProcessWebSnapshot!, {} WebSnapshot found to fetch".format(
-                    len(web_source_ids)
-                )
+                f"ProcessWebSnapshot!, {len(web_source_ids)} WebSource(s) "
+                f"queued"
             )
+            return
 
-            wss_processed_qs = (
-                WebSnapshot.objects
-                .filter(
-                    status=wt_enum.SnapshotStatus.PROCESSED.value,
-                    web_source_id__in=web_source_ids
-                )
-                .order_by('web_source_id', '-created_on')
-                .distinct('web_source_id')
-            )
+        wss_draft_qs = wss_draft_qs[:batch_size]
 
-            wss_processed_obj_id_map = {
-                s.web_source_id: s for s in wss_processed_qs
-            }
-            first_fetch_web_snapshots = []
-            old_n_new_ws_map = {}
-            web_sources_id = []
-            process_web_snapshot = 0
-            for new_wss_obj in wss_draft_qs:
-                process_web_snapshot += 1
-                tmp_ws_id = new_wss_obj.web_source_id
-                web_sources_id.append(tmp_ws_id)
-                if tmp_ws_id not in wss_processed_obj_id_map:
-                    first_fetch_web_snapshots.append(new_wss_obj)
-                    continue
-
-                old_wss_obj = wss_processed_obj_id_map[tmp_ws_id]
-                old_n_new_ws_map[tmp_ws_id] = {
-                    "o": old_wss_obj, "n": new_wss_obj
-                }
-
-            ws_data_list = list(
-                WebSource.objects.filter(id__in=web_sources_id)
-                .values_list("id", "base_url", "junk_xpaths")
-            )
-            ws_base_url_map = dict([list(tup)[:-1] for tup in ws_data_list])
-            ws_junk_xpaths_map = dict([list(tup)[::2] for tup in ws_data_list])
+        process_web_snapshot = process_draft_snapshots(
+            wss_draft_qs, ratio_mode, threshold, options["workers"]
+        )
+        if not process_web_snapshot:
             logger.info(
-                "ProcessWebSnapshot!, old and new WebSnapshot map: {}".format(
-                    old_n_new_ws_map
-                )
+                "ProcessWebSnapshot!, no WebSnapshot found to process"
             )
 
-            # --------- Get the diff HTML for the fetched WebSnapshot ---------
-            subsequent_fetch_diff_html(
-                ws_base_url_map, ws_junk_xpaths_map, old_n_new_ws_map, ratio_mode, threshold
-            )
-            logger.info(
-                "ProcessWebSnapshot!, Done generation DiffHtml of both old and"
-                " new WebSnapshots"
+        logger.info(
+            f"ProcessWebSnapshot!, Took {time.time() - t:0.4f} seconds in "
+            f"processing the {process_web_snapshot} WebSnapshot items."
+        )
+
+    def run_worker(self, options):
+        """
+        Processes the draft WebSnapshots of the WebSources of the work queue
+        until stopped.
+        """
+        def handler(web_source_ids):
+            process_draft_snapshots(
+                get_draft_snapshot_qs().filter(web_source_id__in=web_source_ids),
+                options["ratio_mode"], options["threshold"],
+                options["workers"]
             )
 
-            # ------------- Generating diff for the first fetch ---------------
-            if len(first_fetch_web_snapshots) > 0:
-                first_fetch_diff_html(first_fetch_web_snapshots)
-                logger.info(
-                    "ProcessWebSnapshot!, Done DiffHtml generation for the "
-                    "first fetch of WebSnapshot"
-                )
-            if ERROR_DICT:
-                prepare_error_report(ERROR_DICT, process_web_snapshot, "process_web_snapshot")
+        worker = QueueWorker(
+            wt_enum.WorkQueue.PROCESS_WEB_SNAPSHOT,
+            batch_size=options["batch_size"], max_batches=options["max_batches"]
+        )
+        worker.run(handler)
+        return worker.processed + worker.failed
 
-        else:
-            web_source_ids = []
-            logger.info(
-                "ProcessWebSnapshot!, no WebSnapshot found to process"
-            )
 
+def process_draft_snapshots(wss_draft_qs, ratio_mode, threshold, workers=1):
+    """
+    Creates the DiffHtml of the draft WebSnapshots with the latest processed
+    WebSnapshot of their WebSource, returns the number of drafts processed.
+    """
+    wss_draft_list = list(wss_draft_qs)
+    if not wss_draft_list:
+        return 0
+
+    web_source_ids = [s.web_source_id for s in wss_draft_list]
+
+    logger.info(
+        "ProcessWebSnapshot!, {} WebSnapshot found to fetch".format(
+            len(web_source_ids)
+        )
+    )
+
+    wss_processed_obj_id_map = get_latest_processed_snapshot_map(
+        web_source_ids
+    )
+    first_fetch_web_snapshots = []
+    old_n_new_ws_map = {}
+    web_sources_id = []
+    process_web_snapshot = 0
+    for new_wss_obj in wss_draft_list:
+        process_web_snapshot += 1
+        tmp_ws_id = new_wss_obj.web_source_id
+        web_sources_id.append(tmp_ws_id)
+        if tmp_ws_id not in wss_processed_obj_id_map:
+            first_fetch_web_snapshots.append(new_wss_obj)
+            continue
+
+        old_wss_obj = wss_processed_obj_id_map[tmp_ws_id]
+        old_n_new_ws_map[tmp_ws_id] = {
+            "o": old_wss_obj, "n": new_wss_obj
+        }
+
+    ws_data_list = list(
+        WebSource.objects.filter(id__in=web_sources_id)
+        .values_list("id", "base_url", "junk_xpaths")
+    )
+    ws_base_url_map = dict([list(tup)[:-1] for tup in ws_data_list])
+    ws_junk_xpaths_map = dict([list(tup)[::2] for tup in ws_data_list])
+    logger.info(
+        "ProcessWebSnapshot!, old and new WebSnapshot map: {}".format(
+            old_n_new_ws_map
+        )
+    )
+
+    # --------- Get the diff HTML for the fetched WebSnapshot ---------
+    subsequent_fetch_diff_html(
+        ws_base_url_map, ws_junk_xpaths_map, old_n_new_ws_map, ratio_mode,
+        threshold, workers
+    )
+    logger.info(
+        "ProcessWebSnapshot!, Done generation DiffHtml of both old and"
+        " new WebSnapshots"
+    )
+
+    # ------------- Generating diff for the first fetch ---------------
+    if len(first_fetch_web_snapshots) > 0:
+        first_fetch_diff_html(first_fetch_web_snapshots)
         logger.info(
-            f"ProcessWebSnapshot!, Took {time.time() - t:0.4f} seconds in "
-            f"processing the {len(web_source_ids)} WebSnapshot items."
+            "ProcessWebSnapshot!, Done DiffHtml generation for the "
+            "first fetch of WebSnapshot"
         )
+    if ERROR_DICT:
+        prepare_error_report(ERROR_DICT, process_web_snapshot, "process_web_snapshot")
+        ERROR_DICT.clear()
+    return process_web_snapshot
 
 
 def first_fetch_diff_html(first_fetch_wss_map):
@@ -234,28 +282,59 @@ def first_fetch_diff_html(first_fetch_wss_map):
                 ERROR_DICT[str(e)].append({new_wss_obj.id: traceback.format_exc()[:1000]})
 
 
-def subsequent_fetch_diff_html(ws_base_url_map, ws_junk_xpaths_map, old_n_new_ws_map, ratio_mode,
-                               threshold):
+def compute_diff_html(new_wss_obj, old_wss_obj, ws_base_url, ws_junk_xpaths,
+                      ratio_mode, threshold):
     """
-        It generates Diff HTML for the old and new WebSnapshots.
+        Returns the diff of the old and new WebSnapshots, runs in the
+        processes of the DiffPool with --workers.
     """
-    for ws_id, data in old_n_new_ws_map.items():
-        old_wss_obj = data["o"]
-        new_wss_obj = data["n"]
-        ws_base_url = ws_base_url_map.get(ws_id)
-        ws_junk_xpaths = ws_junk_xpaths_map.get(ws_id, [])
+    logger.info(
+        "ProcessWebSnapshot!, Compare and Get the DiffHtml for base_url: "
+        "{}, old_wss_id: {} and new_wss_id: {}".format(
+            ws_base_url, old_wss_obj.id, new_wss_obj.id
+        )
+    )
+    return get_diff_html(
+        new_wss_obj, old_wss_obj, ws_base_url, ratio_mode, threshold, junk_xpaths=ws_junk_xpaths
+    )
 
-        logger.info(
-            "ProcessWebSnapshot!, Compare and Get the DiffHtml for base_url: "
-            "{}, old_wss_id: {} and new_wss_id: {}".format(
-                ws_base_url, old_wss_obj.id, new_wss_obj.id
-            )
+
+def iter_diff_html(diff_tasks, workers=1):
+    """
+        Yields (task, cxt, error) of the diff tasks, in a DiffPool of
+        `workers` processes when there is more than one.
+    """
+    if workers > 1 and len(diff_tasks) > 1:
+        with DiffPool(min(workers, len(diff_tasks))) as pool:
+            yield from pool.map(compute_diff_html, diff_tasks)
+        return
+
+    for task in diff_tasks:
+        try:
+            yield task, compute_diff_html(*task), None
+        except Exception as e:
+            yield task, None, e
+
+
+def subsequent_fetch_diff_html(ws_base_url_map, ws_junk_xpaths_map, old_n_new_ws_map, ratio_mode,
+                               threshold, workers=1):
+    """
+        It generates Diff HTML for the old and new WebSnapshots. The diffs
+        are computed by `workers` processes, the DB writes are done here.
+    """
+    diff_tasks = [
+        (
+            data["n"], data["o"], ws_base_url_map.get(ws_id),
+            ws_junk_xpaths_map.get(ws_id, []), ratio_mode, threshold
         )
+        for ws_id, data in old_n_new_ws_map.items()
+    ]
+    for task, cxt, error in iter_diff_html(diff_tasks, workers):
+        new_wss_obj, old_wss_obj = task[:2]
 
         try:
-            cxt = get_diff_html(
-                new_wss_obj, old_wss_obj, ws_base_url, ratio_mode, threshold, junk_xpaths=ws_junk_xpaths
-            )
+            if error is not None:
+                raise error
 
             added_diff_text = cxt.get("added_diff_info", {})
             a_t = added_diff_text.get("T")
@@ -392,6 +471,12 @@ def create_diff_html_n_update_snapshot(new_wss_obj, old_wss_id, diff_data):
         new_wss_obj.status = wt_enum.SnapshotStatus.PROCESSED.value
 
     new_wss_obj.save()
+    if dh_id:
+        # Rendered by the process_diff_html workers right away
+        handoff(
+            wt_enum.WorkQueue.PROCESS_DIFF_HTML, [dh_id],
+            using=router.db_for_write(DiffHtml)
+        )
 
     logger.info(
         "ProcessWebSnapshot!, DiffHtml created with ID: {} and Snapshot "
@@ -0,0 +1,67 @@
+"""
+Rebuilds the WebSourceHead pointers from the WebSnapshots.
+
+Run it once after the migration that creates the table, and whenever the
+WebSnapshots were changed with queryset updates (which bypass the heads).
+Until a WebSource has a head the jobs fall back to the DISTINCT ON
+queries, so it can run while they are running.
+
+Usage:
+python manage.py rebuild_web_source_head
+python manage.py rebuild_web_source_head --ws_ids 12,13
+"""
+# Python Imports
+import logging
+from datetime import datetime
+
+# Django Imports
+from django.core.management.base import BaseCommand
+
+# Project Imports
+from contify.website_tracking.utils import set_values
+from contify.website_tracking.web_snapshot.models import (
+    WebSnapshot, WebSourceHead
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the WebSourceHead pointers from the WebSnapshots."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--ws_ids", dest="ws_ids", type=set_values, default=None,
+            help="Only rebuild the heads of the given WebSource IDs"
+        )
+        parser.add_argument(
+            "-b", "--batchSize", dest="batch_size", type=int, default=500,
+            help="Number of WebSources rebuilt per transaction"
+        )
+
+    def handle(self, *args, **options):
+        logger.info(
+            f"RebuildWebSourceHead!, handle function initiated with args: "
+            f"{args} and options: {options}"
+        )
+        start_time = datetime.now()
+
+        ws_ids = options["ws_ids"]
+        if not ws_ids:
+            ws_ids = (
+                WebSnapshot.objects.order_by("web_source_id")
+                .values_list("web_source_id", flat=True).distinct()
+            )
+        ws_ids = sorted(ws_ids)
+
+        batch_size = options["batch_size"]
+        rebuilt = 0
+        for i in range(0, len(ws_ids), batch_size):
+            rebuilt += WebSourceHead.rebuild(ws_ids[i:i + batch_size])
+
+        execution_time = (datetime.now() - start_time).seconds
+        logger.info(
+            f"RebuildWebSourceHead!, WebSource(s): {len(ws_ids)} | "
+            f"Heads: {rebuilt} | Time Taken: {execution_time // 60} mins "
+            f"{execution_time % 60} secs"
+        )
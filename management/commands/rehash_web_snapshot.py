@@ -0,0 +1,167 @@
+"""
+Migrates WebSnapshot.hash_html to another fingerprint version.
+
+The fetch job detects changes by looking up the fingerprint of the fetched
+page in the hash_html of the WebSnapshots of the WebSource, so the stored
+values have to use the same version as `fetch_web_source --hashVersion`.
+This command recomputes them from the stored raw_html in the order of their
+IDs, and can be run in several rounds (--batchSize) since the WebSnapshots
+already on the target version are skipped.
+
+A WebSnapshot whose new fingerprint already belongs to another WebSnapshot
+(hash_html is unique) keeps its old value, it is reported as a conflict.
+Pass the "Last ID" logged by a run as --afterId of the next one so the
+conflicts are not tried again.
+
+Usage:
+python manage.py rehash_web_snapshot --dryRun
+python manage.py rehash_web_snapshot --hashVersion 2 --batchSize 5000
+python manage.py rehash_web_snapshot --batchSize 5000 --afterId 120000
+python manage.py rehash_web_snapshot --hashVersion 1 [Rollback]
+"""
+# Python Imports
+import fcntl
+import logging
+import traceback
+from datetime import datetime
+
+# Django Imports
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, router, transaction
+
+# Project Imports
+from contify.website_tracking import cfy_enum as wt_enum
+from contify.website_tracking.blob_store import get_blob_store
+from contify.website_tracking.fingerprint import HASH_VERSIONS, get_hash_html
+from contify.website_tracking.normalized_html import delete_normalized_html
+from contify.website_tracking.snapshot_delta import CHAIN_FIELDS
+from contify.website_tracking.utils import set_values
+from contify.website_tracking.web_snapshot.models import (
+    WebSnapshot, WebSourceHead
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    LOCK_FILE = "/tmp/rehash_web_snapshot"
+    help = "Migrates WebSnapshot.hash_html to another fingerprint version."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hashVersion", dest="hash_version", type=int, default=2,
+            choices=HASH_VERSIONS, help="Target fingerprint version"
+        )
+        parser.add_argument(
+            "-b", "--batchSize", dest="batch_size", type=int, default=1000,
+            help="Number of WebSnapshots migrated in a run"
+        )
+        parser.add_argument(
+            "--ws_ids", dest="ws_ids", type=set_values, default=None,
+            help="Only migrate the WebSnapshots of the given WebSource IDs"
+        )
+        parser.add_argument(
+            "--afterId", dest="after_id", type=int, default=0,
+            help="Only migrate the WebSnapshots with a greater ID"
+        )
+        parser.add_argument(
+            "--dryRun", action="store_true", dest="dry_run", default=False,
+            help="Compute the fingerprints without saving them"
+        )
+
+    def handle(self, *args, **options):
+        logger.info(
+            f"RehashWebSnapshot!, handle function initiated with args: "
+            f"{args} and options: {options}"
+        )
+        start_time = datetime.now()
+        hash_version = options["hash_version"]
+
+        try:
+            lock_fp = open(self.LOCK_FILE, 'w')
+            fcntl.flock(lock_fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            logger.warning("RehashWebSnapshot!, job is probably already running")
+            return
+
+        wss_qs = WebSnapshot.objects.filter(state=wt_enum.State.ACTIVE.value)
+        if hash_version == 2:
+            wss_qs = wss_qs.exclude(hash_html__startswith="v2:")
+        else:
+            wss_qs = wss_qs.filter(hash_html__startswith="v2:")
+        if options["ws_ids"]:
+            wss_qs = wss_qs.filter(web_source_id__in=options["ws_ids"])
+
+        wss_ids = list(
+            wss_qs.filter(id__gt=options["after_id"]).order_by("id")
+            .values_list("id", flat=True)[:options["batch_size"]]
+        )
+
+        blob_store = get_blob_store()
+        migrated = conflicts = failed = 0
+        for wss in (
+                WebSnapshot.objects.filter(id__in=wss_ids).order_by("id")
+                .only(*CHAIN_FIELDS)
+                .iterator(chunk_size=100)
+        ):
+            try:
+                new_hash = get_hash_html(wss.raw_html or "", hash_version)
+            except Exception as err:
+                failed += 1
+                logger.info(
+                    f"RehashWebSnapshot!, WebSnapshot ID: {wss.id} | Error: "
+                    f"{err} | Traceback: {traceback.format_exc()}"
+                )
+                continue
+
+            if options["dry_run"]:
+                if WebSnapshot.objects.filter(hash_html=new_hash).exists():
+                    conflicts += 1
+                else:
+                    migrated += 1
+                continue
+
+            try:
+                using = router.db_for_write(WebSnapshot)
+                with transaction.atomic(using=using):
+                    if blob_store is not None:
+                        # The normalized html is stored under the old hash
+                        transaction.on_commit(
+                            lambda wss=wss: delete_old_normalized_html(
+                                wss, blob_store
+                            ), using=using
+                        )
+                    WebSnapshot.objects.filter(pk=wss.pk).update(
+                        hash_html=new_hash
+                    )
+                    WebSourceHead.objects.filter(
+                        latest_snapshot_id=wss.pk
+                    ).update(hash_html=new_hash)
+                migrated += 1
+            except IntegrityError:
+                conflicts += 1
+                logger.info(
+                    f"RehashWebSnapshot!, WebSnapshot ID: {wss.id} | "
+                    f"hash_html {new_hash} already exists, keeping "
+                    f"{wss.hash_html}"
+                )
+
+        execution_time = (datetime.now() - start_time).seconds
+        logger.info(
+            f"RehashWebSnapshot!, Hash version: {hash_version} | "
+            f"Dry run: {options['dry_run']} | WebSnapshot(s): {len(wss_ids)} | "
+            f"Migrated: {migrated} | Conflicts: {conflicts} | "
+            f"Failed: {failed} | Remaining: {wss_qs.count()} | "
+            f"Last ID: {wss_ids[-1] if wss_ids else None} | "
+            f"Time Taken: {execution_time // 60} mins {execution_time % 60} secs"
+        )
+
+
+def delete_old_normalized_html(wss, blob_store):
+    try:
+        delete_normalized_html(wss, blob_store)
+    except Exception as err:
+        logger.info(
+            f"RehashWebSnapshot!, WebSnapshot ID: {wss.id} | Unable to "
+            f"delete the normalized html of {wss.hash_html}: {err}"
+        )
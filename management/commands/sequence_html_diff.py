@@ -32,6 +32,12 @@ class Command(BaseCommand):
             '-a', '--accurate-mode', action='store_true', dest='accurate_mode',
             default=False, help='Use accurate mode instead of risky mode'
         )
+        parser.add_argument(
+            '--algorithm', action='store', dest='algorithm',
+            default=constants.SEQUENCE_DIFF_ALGORITHM,
+            choices={"difflib", "patience"},
+            help='difflib SequenceMatcher or the patience diff of the tokens'
+        )
         parser.add_argument(
             '--oc', action='store', dest='output_container',
             default="side_by_side", choices={"side_by_side", "individuals"},
@@ -49,6 +55,7 @@ class Command(BaseCommand):
         new_file = abspath(f'{file_prefix}/{options["new_file"]}')
         output_file = options["out_fn"] if options["out_fn"] else None
         accurate_mode = options["accurate_mode"]
+        algorithm = options["algorithm"]
         output_container = options["output_container"]
 
         if not os.path.exists(old_file):
@@ -59,7 +66,7 @@ class Command(BaseCommand):
             print('Could not find new-file: {0}'.format(new_file))
             sys.exit(1)
 
-        print(f"Using '{accurate_mode}' mode")
+        print(f"Using '{accurate_mode}' mode, '{algorithm}' algorithm")
 
         try:
             with open(old_file) as f:
@@ -70,7 +77,7 @@ class Command(BaseCommand):
 
             matcher = HTMLMatcher(
                 utf8_encode(raw_old_tree), utf8_encode(new_html_str),
-                accurate_mode
+                accurate_mode, algorithm
             )
             diffed_html = matcher.diff_html(True)
 
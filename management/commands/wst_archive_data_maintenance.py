@@ -7,16 +7,58 @@ from datetime import datetime, timedelta
 
 # Django Imports
 from django.core.management.base import BaseCommand
-from django.db import transaction
+from django.db import router, transaction
 from django.db.utils import IntegrityError
 
 # Project Imports
 from contify.cutils.utils import get_db_connection
 from contify.website_tracking import cfy_enum as wt_enum
-from contify.website_tracking.web_snapshot.models import DiffContent, DiffHtml
+from contify.website_tracking import work_queue
+from contify.website_tracking.blob_store import get_blob_store
+from contify.website_tracking.management.commands import (
+    add_work_queue_arguments
+)
+from contify.website_tracking.normalized_html import delete_normalized_html
+from contify.website_tracking.snapshot_delta import detach_raw_html
+from contify.website_tracking.web_snapshot.models import (
+    DiffContent, DiffHtml, WebSnapshot
+)
+from contify.website_tracking.work_queue import QueueWorker, enqueue
 
 logger = logging.getLogger(__name__)
+
+# The latest processed WebSnapshot IDs per web source id (the ranking is
+# served by the wss_processed_source_idx partial index) and the WebSnapshot
+# IDs present in DiffContent(s) of the given status.
+PROTECTED_SNAPSHOTS_QUERY = """
+    SELECT
+        ws_id
+    FROM (
+        SELECT
+            ws.id AS ws_id,
+            ws.web_source_id,
+            ws.created_on,
+            dcnws.id AS dc_nws_id,
+            dcows.id AS dc_ows_id,
+            ROW_NUMBER() OVER(
+                PARTITION BY ws.web_source_id
+                ORDER BY ws.created_on DESC
+            ) AS row_no
+        FROM
+            web_snapshot_websnapshot As ws
+            LEFT JOIN web_snapshot_diffcontent AS dcnws
+                ON dcnws.new_snapshot_id = ws.id AND dcnws.status = %s
+            LEFT JOIN web_snapshot_diffcontent AS dcows
+                ON dcows.old_snapshot_id = ws.id AND dcows.status = %s
+        WHERE
+            ws.status = %s
+    ) AS ranked_snapshots
+    WHERE
+        row_no <= %s OR dc_nws_id IS NOT NULL OR dc_ows_id IS NOT NULL;
+"""
 LATEST_SNAPSHOTS_TO_KEEP_COUNT = 2
+# How long a worker (--worker) uses the protected WebSnapshot IDs
+PROTECTED_IDS_REFRESH_SECONDS = 10 * 60
 
 class Command(BaseCommand):
     """
@@ -26,6 +68,8 @@ class Command(BaseCommand):
         Usage:
         python manage.py wst_archive_data_maintenance [For Testing]
         python manage.py wst_archive_data_maintenance --delete [To Delete, **USE CAREFULLY**]
+        python manage.py wst_archive_data_maintenance --enqueue [Queue the DiffContent(s) to delete]
+        python manage.py wst_archive_data_maintenance --delete --worker [Delete the queued DiffContent(s)]
 
         Note:
           1. If an S3 file is deleted, then only we can delete the related
@@ -53,6 +97,7 @@ class Command(BaseCommand):
         self.duration = 9
         self.web_snapshots_to_delete = []
         self.do_not_delete_web_snapshot_ids = set()
+        self.protected_ids_loaded_on = None
 
 
     def add_arguments(self, parser):
@@ -68,23 +113,25 @@ class Command(BaseCommand):
             '-m', '--max', type=int, default=200, dest='max',
             help="Max number of items to process.",
         )
+        add_work_queue_arguments(parser)
 
 
     def handle(self, *args, **options):
         logger.info(f'Initiated with Args: {args} | Options: {options}')
-        extra_str = ''
-        if options:
-            for key, value in list(options.items()):
-                extra_str += f'{key}_{value}'
-        try:
-            lock_file_name = f"/tmp/{self.command_name}_{extra_str}"
-            with open(lock_file_name, 'w') as lock_fp:
-                fcntl.flock(lock_fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
-        except IOError:
-            logger.warning(
-                f"{self.command_name}!, job is probably already running."
-            )
-            return
+        if not options["worker"]:
+            extra_str = ''
+            if options:
+                for key, value in list(options.items()):
+                    extra_str += f'{key}_{value}'
+            try:
+                lock_file_name = f"/tmp/{self.command_name}_{extra_str}"
+                with open(lock_file_name, 'w') as lock_fp:
+                    fcntl.flock(lock_fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                logger.warning(
+                    f"{self.command_name}!, job is probably already running."
+                )
+                return
 
         self.max_items = options['max']
         self.duration = options['duration']
@@ -93,34 +140,58 @@ class Command(BaseCommand):
                 self.start_time.date() - timedelta(days=self.duration*30)
         )
 
-        # Fetching the latest two Processed WebSnapshot IDs per web source id
-        # ALSO WebSnapshot IDs present in Published DiffContent(s).
-        raw_query = ("""
-            SELECT
-                ws_id
-            FROM (
-                SELECT
-                    ws.id AS ws_id,
-                    ws.web_source_id,
-                    ws.created_on,
-                    dcnws.id AS dc_nws_id,
-                    dcows.id AS dc_ows_id,
-                    ROW_NUMBER() OVER(
-                        PARTITION BY ws.web_source_id
-                        ORDER BY ws.created_on DESC
-                    ) AS row_no
-                FROM
-                    web_snapshot_websnapshot As ws
-                    LEFT JOIN web_snapshot_diffcontent AS dcnws
-                        ON dcnws.new_snapshot_id = ws.id AND dcnws.status = %s
-                    LEFT JOIN web_snapshot_diffcontent AS dcows
-                        ON dcows.old_snapshot_id = ws.id AND dcows.status = %s
-                WHERE
-                    ws.status = %s
-            ) AS ranked_snapshots
-            WHERE
-                row_no <= %s OR dc_nws_id IS NOT NULL OR dc_ows_id IS NOT NULL;
-        """)
+        if options["worker"]:
+            self.run_worker(options)
+            return
+
+        # All DiffContent(s) objects to delete
+        diff_contents = self.get_diff_content_qs()[:self.max_items]
+
+        if options["enqueue"]:
+            dc_ids = [diff_content.id for diff_content in diff_contents]
+            enqueue(wt_enum.WorkQueue.ARCHIVE_DATA, dc_ids)
+            logger.info(
+                f'{self.command_name}! {len(dc_ids)} DiffContent(s) queued.'
+            )
+            return
+
+        if not self.load_protected_snapshot_ids():
+            return
+
+        total_diff_contents = len(diff_contents)
+        diff_content_objs_deleted = self.delete_diff_contents(diff_contents)
+        if self.can_delete:
+            logger.info(
+                f'{self.command_name}! {work_queue.purge()} old WorkItem(s) '
+                f'deleted.'
+            )
+
+        end_time = datetime.now()
+        execution_time = (end_time - self.start_time).seconds
+        logger.info(
+            f'{self.command_name} Completed! | Total DiffContent objects '
+            f'deleted: {diff_content_objs_deleted}/{total_diff_contents}. '
+            f'Started at: {self.start_time.strftime("%b %d %H:%M:%S")} | '
+            f'Finished at: {end_time.strftime("%b %d %H:%M:%S")} | '
+            f'Time Taken: {execution_time//60} mins {execution_time%60} secs.'
+        )
+
+    def get_diff_content_qs(self):
+        fields_to_fetch = [
+            'old_snapshot', 'new_snapshot', 'old_diff_image', 'new_diff_image'
+        ]
+        return DiffContent.objects.filter(
+            created_on__lt=self.deletion_threshold,
+            status__in=[wt_enum.DiffStatus.PENDING.value,
+                        wt_enum.DiffStatus.REJECT.value]
+        ).only(*fields_to_fetch).order_by('created_on')
+
+    def load_protected_snapshot_ids(self):
+        """
+        Fetches the latest two Processed WebSnapshot IDs per web source id
+        ALSO WebSnapshot IDs present in Published DiffContent(s).
+        """
+        raw_query = PROTECTED_SNAPSHOTS_QUERY
         params = [wt_enum.DiffStatus.PUBLISHED.value,
                   wt_enum.DiffStatus.PUBLISHED.value,
                   wt_enum.SnapshotStatus.PROCESSED.value,
@@ -137,19 +208,12 @@ class Command(BaseCommand):
                 f"ERROR occurred while executing SQL query: {raw_query} | "
                 f"Error: {err}.\nTraceback: {traceback.format_exc()}"
             )
-            return
-
-        # All DiffContent(s) objects to delete
-        fields_to_fetch = [
-            'old_snapshot', 'new_snapshot', 'old_diff_image', 'new_diff_image'
-        ]
-        diff_contents = DiffContent.objects.filter(
-            created_on__lt=self.deletion_threshold,
-            status__in=[wt_enum.DiffStatus.PENDING.value,
-                        wt_enum.DiffStatus.REJECT.value]
-        ).only(*fields_to_fetch).order_by('created_on')[:self.max_items]
+            return False
+        self.protected_ids_loaded_on = datetime.now()
+        return True
 
-        total_diff_contents = len(diff_contents)
+    def delete_diff_contents(self, diff_contents):
+        """Returns the number of DiffContent objects deleted."""
         diff_content_objs_deleted = 0
         for diff_content in diff_contents:
             try:
@@ -164,22 +228,40 @@ class Command(BaseCommand):
         # but not the WebSnapshot object itself.
         for ws in self.web_snapshots_to_delete:
             try:
+                detach_delta_chain(ws)
                 ws.delete()
+                delete_raw_html_blob(ws)
             except IntegrityError:
                 pass
             except Exception as err:
                 logger.info(f"WebSnapshot ID: {ws.id} | Unexpected Error: {err}")
+        self.web_snapshots_to_delete = []
+        return diff_content_objs_deleted
 
-        end_time = datetime.now()
-        execution_time = (end_time - self.start_time).seconds
-        logger.info(
-            f'{self.command_name} Completed! | Total DiffContent objects '
-            f'deleted: {diff_content_objs_deleted}/{total_diff_contents}. '
-            f'Started at: {self.start_time.strftime("%b %d %H:%M:%S")} | '
-            f'Finished at: {end_time.strftime("%b %d %H:%M:%S")} | '
-            f'Time Taken: {execution_time//60} mins {execution_time%60} secs.'
-        )
+    def run_worker(self, options):
+        """
+        Deletes the DiffContent(s) of the work queue until stopped, the
+        protected WebSnapshot IDs are refreshed every
+        PROTECTED_IDS_REFRESH_SECONDS.
+        """
+        def handler(dc_ids):
+            if (
+                    self.protected_ids_loaded_on is None or
+                    (datetime.now() - self.protected_ids_loaded_on).seconds >=
+                    PROTECTED_IDS_REFRESH_SECONDS
+            ):
+                if not self.load_protected_snapshot_ids():
+                    raise RuntimeError("Unable to load the protected WebSnapshots")
+
+            # The queued DiffContent(s) still matching the criteria
+            self.delete_diff_contents(
+                list(self.get_diff_content_qs().filter(id__in=dc_ids))
+            )
 
+        QueueWorker(
+            wt_enum.WorkQueue.ARCHIVE_DATA, batch_size=self.max_items,
+            max_batches=options["max_batches"]
+        ).run(handler)
 
     @transaction.atomic
     def process_and_delete_diff_content(self, diff_content):
@@ -224,10 +306,55 @@ class Command(BaseCommand):
                     ws_obj.raw_snapshot.delete()
 
                 try:
+                    detach_delta_chain(ws_obj)
                     ws_obj.delete()
+                    delete_raw_html_blob(ws_obj)
                 except IntegrityError:
                     # WS referenced in other DiffContent (ForeignKey).
                     self.web_snapshots_to_delete.append(ws_obj)
 
         logger.info(f'Deletion of DiffContent, DiffHtml and WebSnapshot '
                     f'completed for DiffContent ID: {diff_content_id}.')
+
+
+def detach_delta_chain(ws_obj):
+    """
+    Turns the WebSnapshots whose raw_html is a delta against ws_obj into
+    keyframes before ws_obj is deleted.
+    """
+    blob_store = get_blob_store()
+    if blob_store is not None and ws_obj.raw_html_key:
+        detach_raw_html(ws_obj, blob_store)
+
+
+def delete_raw_html_blob(ws_obj):
+    """
+    Deletes the offloaded raw_html and the normalized html of a deleted
+    WebSnapshot once the transaction commits: the delete of a WebSnapshot
+    still referenced by a DiffContent only fails at the commit (deferred
+    ForeignKey), the restored row must still find its blobs. The blobs are
+    content-addressed, the ones another WebSnapshot still uses are kept.
+    """
+    blob_store = get_blob_store()
+    if blob_store is None:
+        return
+
+    def delete_blobs():
+        try:
+            if ws_obj.raw_html_key and not WebSnapshot.objects.filter(
+                    raw_html_key=ws_obj.raw_html_key
+            ).exists():
+                blob_store.delete(ws_obj.raw_html_key)
+            if ws_obj.hash_html and not WebSnapshot.objects.filter(
+                    hash_html=ws_obj.hash_html
+            ).exists():
+                delete_normalized_html(ws_obj, blob_store)
+        except Exception as err:
+            logger.info(
+                f"WebSnapshot hash: {ws_obj.hash_html} | Unable to delete "
+                f"raw_html blob {ws_obj.raw_html_key}: {err}"
+            )
+
+    transaction.on_commit(
+        delete_blobs, using=router.db_for_write(WebSnapshot)
+    )
@@ -0,0 +1,23 @@
+# Generated by Django 3.0.5 on 2026-10-18 11:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website_tracking', '0016_auto_20250519_1212'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='websource',
+            name='domain_rate_burst',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Number of pages of this domain that can be fetched back to back before the rate limit applies.', null=True),
+        ),
+        migrations.AddField(
+            model_name='websource',
+            name='domain_rate_limit',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Maximum number of pages of this domain fetched per minute. The strictest value of the WebSources sharing the domain is used.', null=True),
+        ),
+    ]
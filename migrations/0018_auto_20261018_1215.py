@@ -0,0 +1,25 @@
+# Generated by Django 3.0.5 on 2026-10-18 12:15
+
+import django.contrib.postgres.fields.jsonb
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website_tracking', '0017_auto_20261018_1130'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='websource',
+            name='preflight_info',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, help_text='ETag, Last-Modified, Content-Length and body hash of the last successful fetch, used by the pre-flight check.', null=True),
+        ),
+        migrations.AddField(
+            model_name='websource',
+            name='skip_preflight',
+            field=models.BooleanField(default=False, help_text='Always render the page in the browser, use it for JS heavy sites whose HTML shell never changes.'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.5 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website_tracking', '0018_auto_20261018_1215'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='websource',
+            name='settle_time',
+            field=models.PositiveIntegerField(blank=True, help_text='Milliseconds the page took to settle (popups closed and lazy content loaded) in the last adaptive fetch.', null=True),
+        ),
+    ]
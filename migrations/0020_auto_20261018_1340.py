@@ -0,0 +1,27 @@
+# Generated by Django 3.0.5 on 2026-10-18 13:40
+
+import django.contrib.postgres.fields.jsonb
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website_tracking', '0019_auto_20261018_1305'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DomainConsent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('domain', models.CharField(max_length=250, unique=True)),
+                ('strategy', models.PositiveSmallIntegerField(choices=[(0, 'No Dialog'), (1, 'Xpath'), (2, 'Text')], default=0)),
+                ('selector', models.TextField(blank=True, help_text='XPath or button text that accepted the consent dialog', null=True)),
+                ('cookies', django.contrib.postgres.fields.jsonb.JSONField(default=list, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('updated_on', models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.0.5 on 2026-10-18 16:00
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website_tracking', '0020_auto_20261018_1340'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('queue', models.PositiveSmallIntegerField(choices=[(0, 'Fetch Web Source'), (1, 'Process Web Snapshot'), (2, 'Process Diff Html'), (3, 'Archive Data')])),
+                ('object_id', models.PositiveIntegerField()),
+                ('status', models.PositiveSmallIntegerField(choices=[(0, 'Pending'), (1, 'Leased'), (2, 'Done'), (3, 'Failed')], default=0)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('max_attempts', models.PositiveSmallIntegerField(default=3)),
+                ('available_on', models.DateTimeField(default=datetime.datetime.now, help_text='Not leased before this time')),
+                ('leased_by', models.CharField(blank=True, max_length=100, null=True)),
+                ('leased_until', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('updated_on', models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='workitem',
+            index=models.Index(fields=['queue', 'status', 'available_on'], name='workitem_queue_status_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='workitem',
+            constraint=models.UniqueConstraint(condition=models.Q(status__in=[0, 1]), fields=('queue', 'object_id'), name='website_tracking_workitem_unique_open_item'),
+        ),
+    ]
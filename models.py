@@ -2,6 +2,7 @@
 import copy
 import logging
 import os
+from datetime import datetime
 from urllib.parse import urlparse
 
 from django.conf import settings
@@ -99,6 +100,36 @@ class WebSource(models.Model):
         related_name="ws_pbc", on_delete=models.SET_NULL,
     )
     screenshot_sleep_time = models.PositiveIntegerField(blank=True, null=True, db_index=True)
+    domain_rate_limit = models.PositiveSmallIntegerField(
+        null=True, blank=True, help_text=(
+            "Maximum number of pages of this domain fetched per minute. The "
+            "strictest value of the WebSources sharing the domain is used."
+        )
+    )
+    domain_rate_burst = models.PositiveSmallIntegerField(
+        null=True, blank=True, help_text=(
+            "Number of pages of this domain that can be fetched back to back "
+            "before the rate limit applies."
+        )
+    )
+    skip_preflight = models.BooleanField(
+        default=False, help_text=(
+            "Always render the page in the browser, use it for JS heavy sites "
+            "whose HTML shell never changes."
+        )
+    )
+    settle_time = models.PositiveIntegerField(
+        null=True, blank=True, help_text=(
+            "Milliseconds the page took to settle (popups closed and lazy "
+            "content loaded) in the last adaptive fetch."
+        )
+    )
+    preflight_info = JSONField(
+        null=True, blank=True, encoder=DjangoJSONEncoder, help_text=(
+            "ETag, Last-Modified, Content-Length and body hash of the last "
+            "successful fetch, used by the pre-flight check."
+        )
+    )
 
     class Meta:
         pass
@@ -166,6 +197,87 @@ class WebClientSource(models.Model):
         return f"{self.client}-{self.source}"
 
 
+class DomainConsent(models.Model):
+    """
+    Cookie-consent cache of a WebSource.domain, used by the fetch job. It
+    keeps the strategy that handled the consent dialog of the domain and
+    the cookies set by accepting it, so later fetches inject the cookies
+    up front and skip the dialog discovery.
+    """
+    domain = models.CharField(max_length=250, unique=True)
+    strategy = models.PositiveSmallIntegerField(
+        choices=get_choices(wt_enum.ConsentStrategy),
+        default=wt_enum.ConsentStrategy.NO_DIALOG.value
+    )
+    selector = models.TextField(
+        null=True, blank=True,
+        help_text="XPath or button text that accepted the consent dialog"
+    )
+    cookies = JSONField(encoder=DjangoJSONEncoder, default=list)
+
+    created_on = models.DateTimeField(auto_now_add=True)
+    updated_on = models.DateTimeField(db_index=True, auto_now=True)
+
+    def __str__(self):
+        return f"{self.domain}-{self.get_strategy_display()}"
+
+
+class WorkItem(models.Model):
+    """
+    An item of the work queue of the pipeline commands, the ID of the object
+    to process (a WebSource, the WebSource of a draft WebSnapshot, a
+    DiffHtml or a DiffContent, see cfy_enum.WorkQueue).
+
+    Workers lease items with SELECT ... FOR UPDATE SKIP LOCKED, a lease
+    expires at leased_until unless the worker extends it with heartbeats,
+    then the item is visible again to the other workers (see work_queue).
+    """
+    queue = models.PositiveSmallIntegerField(
+        choices=get_choices(wt_enum.WorkQueue)
+    )
+    object_id = models.PositiveIntegerField()
+    status = models.PositiveSmallIntegerField(
+        choices=get_choices(wt_enum.WorkItemStatus),
+        default=wt_enum.WorkItemStatus.PENDING.value
+    )
+
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(
+        default=ws_constant.WORK_MAX_ATTEMPTS
+    )
+    available_on = models.DateTimeField(
+        default=datetime.now, help_text="Not leased before this time"
+    )
+    leased_by = models.CharField(max_length=100, null=True, blank=True)
+    leased_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+
+    created_on = models.DateTimeField(auto_now_add=True)
+    updated_on = models.DateTimeField(db_index=True, auto_now=True)
+
+    class Meta:
+        constraints = [
+            # An object is queued once until it is processed
+            models.UniqueConstraint(
+                fields=["queue", "object_id"],
+                condition=models.Q(status__in=[
+                    wt_enum.WorkItemStatus.PENDING.value,
+                    wt_enum.WorkItemStatus.LEASED.value
+                ]),
+                name="%(app_label)s_%(class)s_unique_open_item"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["queue", "status", "available_on"],
+                name="workitem_queue_status_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_queue_display()}-{self.object_id}"
+
+
 class WebUpdate(models.Model):
     """
     It will have final web-content updates, just like the story.
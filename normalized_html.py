@@ -0,0 +1,106 @@
+"""
+Normalized html of the WebSnapshots, the input of service.get_diff_html.
+
+Diffing a pair parses the raw_html of both WebSnapshots, patches the base
+tag, serializes them back and splits them into start, body and end before
+the bodies are parsed again for the differ. The result only depends on the
+raw_html (and the base URL for the start), and the new WebSnapshot of a
+diff is the old one of the next diff of its WebSource, so it is stored in
+the blob store next to the raw_html the first time it is computed, under
+the hash_html of the WebSnapshot. Later diffs load it and only parse the
+body.
+
+Without a blob store backend (RAW_HTML_BLOB_BACKEND) nothing is stored and
+the html is normalized on every diff.
+
+Usage:
+    start, body, end = get_normalized_html(wss, base_url)
+"""
+import json
+import logging
+from collections import namedtuple
+from io import StringIO
+
+from lxml import etree
+
+from contify.website_tracking.blob_store import get_blob_store
+from contify.website_tracking.diff_html.utils import split_html, patch_base_tag
+
+
+logger = logging.getLogger(__name__)
+
+NORMALIZED_HTML_KIND = "normalized"
+NORMALIZED_HTML_VERSION = 1
+
+NormalizedHtml = namedtuple("NormalizedHtml", ["start", "body", "end"])
+
+
+def get_html_parser():
+    return etree.HTMLParser(
+        encoding="utf-8", remove_comments=True, compact=False,
+        # default_doctype=False
+    )
+
+
+def normalize_html(raw_html, base_url, html_parser=None):
+    """
+    Returns the start (up to <body), the body and the end of the raw_html
+    serialized by lxml, with the base tag of base_url.
+    """
+    raw_tree = etree.parse(StringIO(raw_html), html_parser or get_html_parser())
+    patch_base_tag(raw_tree, base_url)
+    return NormalizedHtml(*split_html(etree.tounicode(raw_tree, method="html")))
+
+
+def load_normalized_html(wss, base_url, blob_store):
+    key = blob_store.get_key(wss.hash_html, NORMALIZED_HTML_KIND)
+    try:
+        cached = json.loads(blob_store.get(key))
+    except Exception:
+        # Not normalized yet
+        return None
+
+    if (
+            cached.get("version") != NORMALIZED_HTML_VERSION or
+            cached.get("base_url") != base_url
+    ):
+        blob_store.delete(key)
+        return None
+    return NormalizedHtml(cached["start"], cached["body"], cached["end"])
+
+
+def save_normalized_html(wss, base_url, normalized_html, blob_store):
+    try:
+        blob_store.put(wss.hash_html, json.dumps({
+            "version": NORMALIZED_HTML_VERSION,
+            "base_url": base_url,
+            "start": normalized_html.start,
+            "body": normalized_html.body,
+            "end": normalized_html.end,
+        }), NORMALIZED_HTML_KIND)
+    except Exception as err:
+        logger.info(
+            f"NormalizedHtml! Unable to store WebSnapshot ID: {wss.id} | "
+            f"Error: {err}"
+        )
+
+
+def get_normalized_html(wss, base_url, html_parser=None):
+    """
+    Returns the NormalizedHtml of the WebSnapshot from the blob store,
+    normalizes and stores it when missing.
+    """
+    blob_store = get_blob_store()
+    if blob_store is not None and wss.hash_html:
+        normalized_html = load_normalized_html(wss, base_url, blob_store)
+        if normalized_html is not None:
+            return normalized_html
+
+    normalized_html = normalize_html(wss.raw_html or "", base_url, html_parser)
+    if blob_store is not None and wss.hash_html:
+        save_normalized_html(wss, base_url, normalized_html, blob_store)
+    return normalized_html
+
+
+def delete_normalized_html(wss, blob_store):
+    blob_store.delete(blob_store.get_key(wss.hash_html, NORMALIZED_HTML_KIND))
@@ -0,0 +1,116 @@
+"""
+Lightweight HTTP pre-flight check for the fetch job.
+
+Before a WebSource is rendered in a browser, a plain GET (through
+Playwright's APIRequestContext, which keeps a pool of connections) is sent
+with the If-None-Match/If-Modified-Since headers of the last successful
+fetch. The browser render is skipped when the server answers 304, or when
+the ETag or the MD5 of the body is the same as last time.
+
+The validators of the last successful fetch are kept in
+WebSource.preflight_info:
+    {
+        "etag": "W/\"5f1-17c\"",
+        "last_modified": "Mon, 12 Oct 2026 10:00:00 GMT",
+        "content_length": "1521",
+        "body_hash": "0cc175b9c0f1b6a831c399e269772661"
+    }
+
+JS heavy sites whose HTML shell never changes must set
+WebSource.skip_preflight, otherwise their updates would never be fetched.
+"""
+import hashlib
+import logging
+from collections import namedtuple
+
+from contify.website_tracking.constants import (
+    CONTEXT_DICT, PREFLIGHT_TIMEOUT, USER_AGENT
+)
+
+
+logger = logging.getLogger(__name__)
+
+PreflightResult = namedtuple("PreflightResult", ["changed", "info", "status"])
+
+
+class PreflightChecker:
+    """Sends the conditional GET requests of the pre-flight stage."""
+
+    def __init__(self, playwright, timeout=PREFLIGHT_TIMEOUT):
+        self.playwright = playwright
+        self.timeout = timeout
+        self._request_context = None
+
+    async def start(self):
+        self._request_context = await self.playwright.request.new_context(
+            user_agent=USER_AGENT, ignore_https_errors=True,
+            extra_http_headers={
+                k: v for k, v in CONTEXT_DICT["extra_http_headers"].items()
+                if k not in ("Accept-Encoding", "Access-Control-Allow-Origin")
+            }
+        )
+        return self
+
+    async def close(self):
+        if self._request_context:
+            await self._request_context.dispose()
+            self._request_context = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def check(self, ws_obj):
+        """
+        Returns a PreflightResult, `changed` is False only when the server
+        tells that nothing changed since the last successful fetch. `info`
+        holds the validators to store once the fetch succeeds.
+        """
+        old_info = ws_obj.preflight_info or {}
+
+        headers = {}
+        if old_info.get("etag"):
+            headers["If-None-Match"] = old_info["etag"]
+        if old_info.get("last_modified"):
+            headers["If-Modified-Since"] = old_info["last_modified"]
+
+        try:
+            response = await self._request_context.get(
+                ws_obj.web_url, headers=headers, timeout=self.timeout * 1000
+            )
+        except Exception as err:
+            logger.info(
+                f"Preflight! Request failed for WebSource-ID: {ws_obj.id} | "
+                f"URL: {ws_obj.web_url} | Error: {err}"
+            )
+            return PreflightResult(True, None, None)
+
+        status = response.status
+        try:
+            if status == 304 and old_info:
+                return PreflightResult(False, old_info, status)
+
+            if status != 200:
+                return PreflightResult(True, None, status)
+
+            body = await response.body()
+        finally:
+            await response.dispose()
+
+        response_headers = response.headers
+        info = {
+            "etag": response_headers.get("etag"),
+            "last_modified": response_headers.get("last-modified"),
+            "content_length": response_headers.get("content-length"),
+            "body_hash": hashlib.md5(body).hexdigest(),
+        }
+
+        changed = True
+        if old_info.get("body_hash") == info["body_hash"]:
+            changed = False
+        elif old_info.get("etag") and old_info["etag"] == info["etag"]:
+            changed = False
+
+        return PreflightResult(changed, info, status)
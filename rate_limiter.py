@@ -0,0 +1,164 @@
+"""
+Domain keyed token-bucket rate limiter used by the fetch job.
+
+Every domain owns a bucket of `burst` tokens refilled at `rate` tokens per
+minute, fetching a page takes one token. When the bucket is empty the
+caller sleeps until its token is available, tokens are reserved up front so
+concurrent callers are served in order.
+
+Backends:
+-   MemoryBucketBackend: buckets live in the current process.
+-   SQLiteBucketBackend: buckets live in a local SQLite file, so the shards of
+    the fetch job (--shardNo/--maxShard) running on the same host share the
+    same limits.
+
+Usage:
+    limiter = DomainRateLimiter(SQLiteBucketBackend("/tmp/wst_rate.sqlite3"))
+    limiter.configure("contify", rate=20, burst=1)
+    await limiter.acquire("contify")
+"""
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+
+from contify.website_tracking.constants import (
+    DEFAULT_DOMAIN_RATE_LIMIT, DEFAULT_DOMAIN_RATE_BURST
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+def reserve_token(tokens, updated_on, now, rate, burst):
+    """
+    Refills the bucket for the elapsed time and takes one token from it.
+
+    @param
+        tokens: tokens in the bucket at `updated_on`
+        updated_on: timestamp of the last reservation
+        now: current timestamp
+        rate: refill rate in tokens per second
+        burst: capacity of the bucket
+    @return (tokens, wait): tokens left in the bucket (negative when future
+        tokens are reserved) and the seconds to wait before using the token.
+    """
+    tokens = min(burst, tokens + max(now - updated_on, 0) * rate) - 1
+    wait = 0 if tokens >= 0 else -tokens / rate
+    return tokens, wait
+
+
+class MemoryBucketBackend:
+    """Keeps the buckets in the current process."""
+
+    def __init__(self):
+        self._buckets = {}
+
+    def reserve(self, domain, rate, burst):
+        now = time.time()
+        tokens, updated_on = self._buckets.get(domain, (burst, now))
+        tokens, wait = reserve_token(tokens, updated_on, now, rate, burst)
+        self._buckets[domain] = (tokens, now)
+        return wait
+
+    def close(self):
+        self._buckets = {}
+
+
+class SQLiteBucketBackend:
+    """
+    Keeps the buckets in a SQLite file shared by the processes of a host.
+    Reservations run in an IMMEDIATE transaction so that two processes never
+    take the same token.
+    """
+
+    def __init__(self, db_path, timeout=30):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            db_path, timeout=timeout, isolation_level=None,
+            check_same_thread=False
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS domain_bucket ("
+            "domain TEXT PRIMARY KEY, tokens REAL NOT NULL, "
+            "updated_on REAL NOT NULL)"
+        )
+
+    def reserve(self, domain, rate, burst):
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = cursor.execute(
+                    "SELECT tokens, updated_on FROM domain_bucket "
+                    "WHERE domain = ?", (domain,)
+                ).fetchone()
+                tokens, updated_on = row if row else (burst, now)
+                tokens, wait = reserve_token(
+                    tokens, updated_on, now, rate, burst
+                )
+                cursor.execute(
+                    "INSERT OR REPLACE INTO domain_bucket "
+                    "(domain, tokens, updated_on) VALUES (?, ?, ?)",
+                    (domain, tokens, now)
+                )
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+        return wait
+
+    def close(self):
+        self._conn.close()
+
+
+class DomainRateLimiter:
+    """Politeness scheduler, one token bucket per domain."""
+
+    def __init__(self, backend=None, rate=DEFAULT_DOMAIN_RATE_LIMIT,
+                 burst=DEFAULT_DOMAIN_RATE_BURST):
+        self.backend = backend or MemoryBucketBackend()
+        self.default_rate = rate
+        self.default_burst = burst
+        self._limits = {}
+
+    def configure(self, domain, rate=None, burst=None):
+        """
+        Sets the limits of a domain, `rate` is in requests per minute. When
+        a domain is configured more than once the strictest limit is kept.
+        """
+        rate = rate or self.default_rate
+        burst = burst or self.default_burst
+        if domain in self._limits:
+            old_rate, old_burst = self._limits[domain]
+            rate, burst = min(rate, old_rate), min(burst, old_burst)
+        self._limits[domain] = (rate, burst)
+
+    def get_limits(self, domain):
+        return self._limits.get(
+            domain, (self.default_rate, self.default_burst)
+        )
+
+    async def acquire(self, domain):
+        """Waits for a token of the domain, returns the seconds waited."""
+        if not domain:
+            return 0
+
+        rate, burst = self.get_limits(domain)
+        loop = asyncio.get_event_loop()
+        wait = await loop.run_in_executor(
+            None, self.backend.reserve, domain, rate / 60, burst
+        )
+        if wait > 0:
+            logger.debug(
+                f"DomainRateLimiter! Waiting {wait:0.2f} secs for domain: "
+                f"{domain}"
+            )
+            await asyncio.sleep(wait)
+        return wait
+
+    def close(self):
+        self.backend.close()
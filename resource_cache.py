@@ -0,0 +1,377 @@
+"""
+LRU caches of the sub-resources (stylesheets, images, fonts, scripts)
+requested by the pages rendered in the fetch and screenshot jobs.
+
+-   ResourceCache: in-memory, shared by the pages of a single run (used by
+    capture_web_snapshot, many WebSnapshots of a site share their assets).
+-   DiskResourceCache: on-disk HTTP cache scoped by WebSource.domain, kept
+    across the runs of fetch_web_source so repeat fetches of the same
+    sources load their static assets locally. Entries are fresh for the
+    max-age of the response (HTTP_CACHE_DEFAULT_TTL when it has none),
+    `no-store` responses are never cached. The directory also keeps the
+    storage state (cookies and localStorage) of every domain.
+
+Both caches are bounded by the total size of the cached bodies and evict
+the least recently used entries first.
+
+Usage:
+    cache = ResourceCache(max_bytes=256 * 1024 * 1024)
+    await page.route("**/*", cache.handle_route)
+
+    disk_cache = DiskResourceCache("/tmp/wst_http_cache")
+    await page.route(
+        "**/*", lambda route: disk_cache.handle_route(route, domain="pwc")
+    )
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict, namedtuple
+from urllib.parse import urlparse
+
+from contify.website_tracking.constants import (
+    CACHEABLE_RESOURCE_TYPES, RESOURCE_CACHE_MAX_BYTES, HTTP_CACHE_MAX_BYTES,
+    HTTP_CACHE_DEFAULT_TTL
+)
+
+
+logger = logging.getLogger(__name__)
+
+CachedResource = namedtuple(
+    "CachedResource", ["status", "headers", "body", "expires"]
+)
+
+MAX_AGE_RE = re.compile(r"max-age=(\d+)", re.I)
+# The cached body is already decoded
+SKIP_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+# Headers of a single response, a cache hit would replay the stale cookies
+# of the original response over the restored storage state
+CACHE_SKIP_HEADERS = SKIP_HEADERS | {"set-cookie", "set-cookie2"}
+
+
+def get_cacheable_headers(headers, skip_headers=CACHE_SKIP_HEADERS):
+    return {k: v for k, v in headers.items() if k.lower() not in skip_headers}
+
+
+def get_expiry(headers, now, default_ttl):
+    """
+    Returns the timestamp until which the response can be reused, None if
+    it must not be cached.
+    """
+    cache_control = headers.get("cache-control", "").lower()
+    if "no-store" in cache_control or "private" in cache_control:
+        return None
+    match = MAX_AGE_RE.search(cache_control)
+    if match:
+        max_age = int(match.group(1))
+        return now + max_age if max_age else None
+    return now + default_ttl
+
+
+class ResourceCache:
+    """In-memory LRU cache of the GET responses of the cacheable types."""
+
+    def __init__(self, max_bytes=RESOURCE_CACHE_MAX_BYTES,
+                 resource_types=CACHEABLE_RESOURCE_TYPES):
+        self.max_bytes = max_bytes
+        self.resource_types = frozenset(resource_types)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, url, domain=None):
+        item = self._items.get(url)
+        if item is not None:
+            self._items.move_to_end(url)
+        return item
+
+    def set(self, url, item, domain=None):
+        body_size = len(item.body)
+        if body_size > self.max_bytes:
+            return
+
+        old_item = self._items.pop(url, None)
+        if old_item is not None:
+            self.size -= len(old_item.body)
+
+        self._items[url] = item
+        self.size += body_size
+        while self.size > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self.size -= len(evicted.body)
+
+    def is_cacheable(self, request):
+        return (
+            request.method == "GET" and
+            request.resource_type in self.resource_types
+        )
+
+    def make_item(self, response, body):
+        """Returns the CachedResource of the response, None if not cacheable."""
+        if response.status != 200:
+            return None
+        return CachedResource(
+            response.status, get_cacheable_headers(response.headers), body,
+            None
+        )
+
+    async def handle_route(self, route, domain=None):
+        """Playwright route handler serving the cacheable resources."""
+        request = route.request
+        if not self.is_cacheable(request):
+            await route.continue_()
+            return
+
+        url = request.url
+        item = self.get(url, domain)
+        if item is not None:
+            self.hits += 1
+            # Entries stored before set-cookie was skipped
+            await route.fulfill(
+                status=item.status,
+                headers=get_cacheable_headers(item.headers), body=item.body
+            )
+            return
+
+        self.misses += 1
+        try:
+            response = await route.fetch()
+        except Exception as err:
+            logger.debug(f"ResourceCache! Unable to fetch {url}: {err}")
+            await route.abort()
+            return
+
+        body = await response.body()
+        item = self.make_item(response, body)
+        if item is not None:
+            self.set(url, item, domain)
+        await route.fulfill(
+            status=response.status,
+            headers=get_cacheable_headers(response.headers, SKIP_HEADERS),
+            body=body
+        )
+
+    def stats(self):
+        return (
+            f"Items: {len(self)} | Size: {self.size // 1024} KB | "
+            f"Hits: {self.hits} | Misses: {self.misses}"
+        )
+
+
+class DiskResourceCache(ResourceCache):
+    """
+    On-disk LRU cache, an entry is a `<domain>/<sha1 of url>.body` file and
+    its `.meta` JSON (status, headers, expiry). The LRU order is the mtime
+    of the body, refreshed on every hit. Files are written atomically so
+    the shards of the fetch job can share the directory; the size bound is
+    enforced per process from the index built at start.
+    """
+    STORAGE_STATE_FILE = "storage_state.json"
+
+    def __init__(self, cache_dir, max_bytes=HTTP_CACHE_MAX_BYTES,
+                 resource_types=CACHEABLE_RESOURCE_TYPES,
+                 default_ttl=HTTP_CACHE_DEFAULT_TTL):
+        super().__init__(max_bytes=max_bytes, resource_types=resource_types)
+        self.cache_dir = cache_dir
+        self.default_ttl = default_ttl
+        os.makedirs(cache_dir, exist_ok=True)
+        self._build_index()
+
+    def _build_index(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for file_name in files:
+                if not file_name.endswith(".body"):
+                    continue
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+
+        self._items = OrderedDict(
+            (path, size) for _, path, size in sorted(entries)
+        )
+        self.size = sum(self._items.values())
+        self._evict()
+
+    def _get_path(self, url, domain):
+        domain = re.sub(r"[^\w.-]", "_", domain or "_")
+        return os.path.join(
+            self.cache_dir, domain,
+            f"{hashlib.sha1(url.encode()).hexdigest()}.body"
+        )
+
+    @staticmethod
+    def _write_file(path, data):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _remove(self, path):
+        for file_path in (path, f"{path[:-5]}.meta"):
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+        self.size -= self._items.pop(path, 0)
+
+    def _evict(self):
+        while self.size > self.max_bytes and self._items:
+            path = next(iter(self._items))
+            self._remove(path)
+
+    def get(self, url, domain=None):
+        path = self._get_path(url, domain)
+        if path not in self._items and not os.path.exists(path):
+            return None
+
+        try:
+            with open(f"{path[:-5]}.meta") as f:
+                meta = json.load(f)
+            if meta["expires"] < time.time():
+                self._remove(path)
+                return None
+            with open(path, "rb") as f:
+                body = f.read()
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            self._remove(path)
+            return None
+
+        self.size -= self._items.pop(path, 0)
+        self._items[path] = len(body)
+        self.size += len(body)
+        return CachedResource(
+            meta["status"], meta["headers"], body, meta["expires"]
+        )
+
+    def set(self, url, item, domain=None):
+        body_size = len(item.body)
+        if body_size > self.max_bytes:
+            return
+
+        path = self._get_path(url, domain)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._write_file(f"{path[:-5]}.meta", json.dumps({
+                "url": url, "status": item.status, "headers": item.headers,
+                "expires": item.expires
+            }).encode())
+            self._write_file(path, item.body)
+        except OSError as err:
+            logger.info(f"DiskResourceCache! Unable to cache {url}: {err}")
+            return
+
+        self.size -= self._items.pop(path, 0)
+        self._items[path] = body_size
+        self.size += body_size
+        self._evict()
+
+    def make_item(self, response, body):
+        if response.status != 200:
+            return None
+        expires = get_expiry(response.headers, time.time(), self.default_ttl)
+        if expires is None:
+            return None
+        return CachedResource(
+            response.status, get_cacheable_headers(response.headers), body,
+            expires
+        )
+
+    def _get_storage_state_path(self, domain):
+        return os.path.join(
+            os.path.dirname(self._get_path("", domain)),
+            self.STORAGE_STATE_FILE
+        )
+
+    async def save_storage_state(self, page, domain):
+        """
+        Stores the cookies and the localStorage of the page origin for the
+        domain.
+        """
+        if not domain:
+            return
+        try:
+            state = await page.context.storage_state()
+        except Exception as err:
+            logger.info(
+                f"DiskResourceCache! Unable to get storage state of domain: "
+                f"{domain} | Error: {err}"
+            )
+            return
+
+        parsed_url = urlparse(page.url)
+        origin = f"{parsed_url.scheme}://{parsed_url.netloc}"
+        host = parsed_url.hostname or ""
+        state = {
+            "cookies": [
+                cookie for cookie in state.get("cookies", [])
+                if host.endswith(cookie["domain"].lstrip("."))
+            ],
+            "origins": [
+                item for item in state.get("origins", [])
+                if item["origin"] == origin
+            ],
+        }
+        path = self._get_storage_state_path(domain)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._write_file(path, json.dumps(state).encode())
+        except OSError as err:
+            logger.info(
+                f"DiskResourceCache! Unable to save storage state of domain: "
+                f"{domain} | Error: {err}"
+            )
+
+    async def load_storage_state(self, page, domain):
+        """
+        Adds the stored cookies of the domain to the context of the page and
+        restores its localStorage before the scripts of the page run.
+        """
+        if not domain:
+            return
+        try:
+            with open(self._get_storage_state_path(domain)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        now = time.time()
+        cookies = [
+            cookie for cookie in state.get("cookies", [])
+            if cookie.get("expires", -1) in (-1, None) or cookie["expires"] > now
+        ]
+        if cookies:
+            await page.context.add_cookies(cookies)
+
+        for item in state.get("origins", []):
+            await page.add_init_script(
+                script=RESTORE_LOCAL_STORAGE_JS % (
+                    json.dumps(item["origin"]),
+                    json.dumps(item.get("localStorage", []))
+                )
+            )
+
+
+RESTORE_LOCAL_STORAGE_JS = """
+(() => {
+    if (window.location.origin !== %s) return;
+    try {
+        for (const {name, value} of %s) {
+            if (window.localStorage.getItem(name) === null) {
+                window.localStorage.setItem(name, value);
+            }
+        }
+    } catch (e) {}
+})();
+"""
@@ -5,6 +5,7 @@ import json
 import hashlib
 import logging
 import re
+import time
 import traceback
 
 from asgiref.sync import sync_to_async
@@ -45,7 +46,7 @@ from contify.website_tracking.change_log import (
 from contify.website_tracking.diff_html.sub_tree_match import (
     CFYDiffer, HTMLFormatter
 )
-from contify.website_tracking.diff_html.utils import split_html, patch_base_tag
+from contify.website_tracking.diff_html.utils import patch_base_tag
 from contify.website_tracking.execptions import (
     NoChangeInWebUpdateEdit, FetchWebSourceError
 )
@@ -54,8 +55,11 @@ from contify.website_tracking.mails import get_article, send_mail_analyst
 from contify.website_tracking.models import (
     WebSource, WebClientSource, WebUpdate
 )
+from contify.website_tracking.normalized_html import (
+    get_html_parser, get_normalized_html
+)
 from contify.website_tracking.web_snapshot.models import (
-    WebSnapshot, DiffContent
+    WebSnapshot, DiffContent, WebSourceHead
 )
 from contify.website_tracking.utils import (
     get_diff_info_html, get_std_bucket_name
@@ -239,6 +243,132 @@ def is_web_snapshot_exists(ws_id, new_md5_hash):
     )
 
 
+def get_latest_hash_map_qs(ws_ids):
+    return (
+        WebSnapshot.objects
+        .filter(web_source_id__in=ws_ids)
+        .order_by("web_source_id", "-created_on")
+        .distinct("web_source_id")
+        .values_list("web_source_id", "hash_html")
+    )
+
+
+def get_latest_hash_map(ws_ids):
+    """
+    Returns {web_source_id: hash_html} of the latest WebSnapshot of the
+    given WebSources, read from their WebSourceHead (the WebSources without
+    one yet are loaded with a single DISTINCT ON query).
+    """
+    hash_map = dict(
+        WebSourceHead.objects.filter(web_source_id__in=ws_ids)
+        .values_list("web_source_id", "hash_html")
+    )
+    missing_ws_ids = set(ws_ids) - set(hash_map)
+    if missing_ws_ids:
+        hash_map.update(get_latest_hash_map_qs(missing_ws_ids))
+    return hash_map
+
+
+def get_draft_snapshot_qs():
+    """
+    Oldest active draft WebSnapshot of every WebSource, served by the
+    wss_draft_source_created_idx partial index.
+    """
+    return (
+        WebSnapshot.objects
+        .filter(
+            status=wt_enum.SnapshotStatus.DRAFT.value,
+            state=wt_enum.State.ACTIVE.value
+        )
+        .order_by('web_source_id', 'created_on')
+        .distinct('web_source_id')
+    )
+
+
+def get_latest_processed_snapshot_qs(web_source_ids):
+    """
+    Latest processed WebSnapshot of the given WebSources, served by the
+    wss_source_status_created_idx index.
+    """
+    return (
+        WebSnapshot.objects
+        .filter(
+            status=wt_enum.SnapshotStatus.PROCESSED.value,
+            web_source_id__in=web_source_ids
+        )
+        .order_by('web_source_id', '-created_on')
+        .distinct('web_source_id')
+    )
+
+
+def get_latest_processed_snapshot_map(web_source_ids):
+    """
+    Returns {web_source_id: WebSnapshot} of the latest processed WebSnapshot
+    of the given WebSources, looked up by the primary keys kept in their
+    WebSourceHead (the WebSources without one yet use the DISTINCT ON
+    query).
+    """
+    heads = dict(
+        WebSourceHead.objects.filter(web_source_id__in=web_source_ids)
+        .values_list("web_source_id", "processed_snapshot_id")
+    )
+    wss_map = WebSnapshot.objects.in_bulk(
+        [wss_id for wss_id in heads.values() if wss_id]
+    )
+    processed_map = {
+        ws_id: wss_map[wss_id] for ws_id, wss_id in heads.items()
+        if wss_id in wss_map
+    }
+
+    missing_ws_ids = set(web_source_ids) - set(heads)
+    if missing_ws_ids:
+        processed_map.update(
+            (wss.web_source_id, wss)
+            for wss in get_latest_processed_snapshot_qs(missing_ws_ids)
+        )
+    return processed_map
+
+
+class WebSourceUpdateBuffer:
+    """
+    Buffers the last_run/last_error/state updates of the WebSources fetched
+    by the fetch job and writes them with a single bulk UPDATE every
+    `max_size` WebSources or `interval` seconds. Only the last update of a
+    WebSource is kept.
+    """
+    FIELDS = ["last_run", "last_error", "updated_on", "state", "settle_time"]
+
+    def __init__(self, max_size=wt_constant.UPDATE_BUFFER_SIZE,
+                 interval=wt_constant.UPDATE_BUFFER_INTERVAL):
+        self.max_size = max_size
+        self.interval = interval
+        self._updates = {}
+        self._flushed_on = time.monotonic()
+
+    def __len__(self):
+        return len(self._updates)
+
+    async def add(self, ws_obj, error):
+        now = datetime.now()
+        self._updates[ws_obj.pk] = WebSource(
+            pk=ws_obj.pk, last_run=now, last_error=error, updated_on=now,
+            state=ws_obj.state, settle_time=ws_obj.settle_time
+        )
+        if (
+                len(self._updates) >= self.max_size or
+                time.monotonic() - self._flushed_on >= self.interval
+        ):
+            await self.flush()
+
+    async def flush(self):
+        updates, self._updates = list(self._updates.values()), {}
+        self._flushed_on = time.monotonic()
+        if updates:
+            await sync_to_async(WebSource.objects.bulk_update)(
+                updates, self.FIELDS
+            )
+
+
 def get_diff_html(new_wss_obj, old_wss_obj, base_url, ratio_mode="accurate",
                   threshold=0.5, fast_match=True, junk_xpaths=None):
     """
@@ -257,26 +387,13 @@ def get_diff_html(new_wss_obj, old_wss_obj, base_url, ratio_mode="accurate",
         'uniqueattrs': ['{http://www.w3.org/XML/1998/namespace}id']
     }
 
-    html_parser = etree.HTMLParser(
-        encoding="utf-8", remove_comments=True, compact=False,
-        # default_doctype=False
-    )
-
-    old_html_str = old_wss_obj.raw_html or ""
-    new_html_str = new_wss_obj.raw_html or ""
-
-    raw_old_tree = etree.parse(StringIO(old_html_str), html_parser)
-
-    patch_base_tag(raw_old_tree, base_url)
+    html_parser = get_html_parser()
 
-    o_start, o_body, o_end = split_html(
-        etree.tounicode(raw_old_tree, method="html")
-    )
-    _, n_body, _ = split_html(
-        etree.tounicode(
-            etree.parse(StringIO(new_html_str), html_parser), method="html"
-        )
+    # Loaded from the blob store when already normalized by a previous diff
+    o_start, o_body, o_end = get_normalized_html(
+        old_wss_obj, base_url, html_parser
     )
+    _, n_body, _ = get_normalized_html(new_wss_obj, base_url, html_parser)
 
     old_tree = etree.parse(StringIO(o_body), html_parser)
     new_tree = etree.parse(StringIO(n_body), html_parser)
@@ -297,8 +414,9 @@ def get_diff_html(new_wss_obj, old_wss_obj, base_url, ratio_mode="accurate",
 
     logger.info(
         "ProcessWebSnapshot!, Done Generating DiffHtml for OldWebSnapshotID:"
-        " {}, NewWebSnapshotID: {} and BaseURL: {}".format(
-            new_wss_obj.id, old_wss_obj.id, base_url
+        " {}, NewWebSnapshotID: {} and BaseURL: {} | Match: {}".format(
+            new_wss_obj.id, old_wss_obj.id, base_url,
+            differ.budget.stats() if differ.budget else None
         )
     )
     cxt = {
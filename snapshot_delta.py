@@ -0,0 +1,267 @@
+"""
+Delta chains of the offloaded WebSnapshot.raw_html.
+
+Consecutive WebSnapshots of a WebSource are mostly identical, so when
+RAW_HTML_KEYFRAME_INTERVAL is greater than 1 a new WebSnapshot is stored as
+a delta against the previous one of its WebSource, and every N-th one (or
+one whose delta is too large) as a keyframe with the full html:
+
+    keyframe <- delta <- delta <- ... <- keyframe <- delta ...
+
+A WebSnapshot of a chain keeps the ID of its base (delta_base_id), of the
+keyframe of the chain (delta_keyframe_id) and its distance to it
+(delta_depth). The delta works on the html split after every ">" and new
+line, it is a list of copied ranges of the base tokens and inserted text,
+stored compressed in the blob store like the keyframes.
+
+Reconstructing a version loads its chain in one query and applies the
+deltas from the keyframe, or from the closest version already in the
+process wide LRU cache of reconstructed raw_html, so diffing consecutive
+versions (process_web_snapshot) or viewing both sides of a DiffContent
+reads the shared part of the chain once.
+
+Usage:
+    store_raw_html(wss, blob_store)           # offload, sets the key fields
+    raw_html = get_raw_html(wss, blob_store)  # materialize any version
+"""
+import json
+import re
+from collections import OrderedDict
+from difflib import SequenceMatcher
+
+from django.db import router, transaction
+from django.db.models import F, Q
+
+from contify.website_tracking.constants import (
+    RAW_HTML_KEYFRAME_INTERVAL, RAW_HTML_MAX_DELTA_RATIO,
+    RAW_HTML_CACHE_MAX_BYTES
+)
+
+
+TOKEN_SPLIT_RE = re.compile(r"(?<=[>\n])")
+CHAIN_FIELDS = (
+    "id", "web_source_id", "hash_html", "_raw_html", "raw_html_key",
+    "delta_base_id", "delta_keyframe_id", "delta_depth"
+)
+
+
+def tokenize(text):
+    return [token for token in TOKEN_SPLIT_RE.split(text) if token]
+
+
+def make_delta(base_text, text):
+    """
+    Returns the delta turning base_text into text, a JSON list whose items
+    are [start, end] ranges of the base tokens or inserted strings.
+    """
+    base_tokens = tokenize(base_text)
+    tokens = tokenize(text)
+    ops = []
+    matcher = SequenceMatcher(None, base_tokens, tokens)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j1 != j2:
+            inserted = "".join(tokens[j1:j2])
+            if ops and isinstance(ops[-1], str):
+                ops[-1] += inserted
+            else:
+                ops.append(inserted)
+    return json.dumps(ops, separators=(",", ":"))
+
+
+def apply_delta(base_text, delta):
+    base_tokens = tokenize(base_text)
+    return "".join(
+        op if isinstance(op, str) else "".join(base_tokens[op[0]:op[1]])
+        for op in json.loads(delta)
+    )
+
+
+class ReconstructionCache:
+    """LRU cache of raw_html by WebSnapshot ID, bounded by total length."""
+
+    def __init__(self, max_bytes=RAW_HTML_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, wss_id):
+        text = self._items.get(wss_id)
+        if text is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._items.move_to_end(wss_id)
+        return text
+
+    def set(self, wss_id, text):
+        if wss_id is None or len(text) > self.max_bytes:
+            return
+        self.size -= len(self._items.pop(wss_id, ""))
+        self._items[wss_id] = text
+        self.size += len(text)
+        while self.size > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self.size -= len(evicted)
+
+    def discard(self, wss_id):
+        self.size -= len(self._items.pop(wss_id, ""))
+
+    def clear(self):
+        self._items.clear()
+        self.size = 0
+
+    def stats(self):
+        return (
+            f"Items: {len(self)} | Size: {self.size // 1024} KB | "
+            f"Hits: {self.hits} | Misses: {self.misses}"
+        )
+
+
+reconstruction_cache = ReconstructionCache()
+
+
+def get_keyframe_text(wss, blob_store):
+    return wss._raw_html or blob_store.get(wss.raw_html_key)
+
+
+def get_raw_html(wss, blob_store, cache=reconstruction_cache):
+    """Materializes the offloaded raw_html of the WebSnapshot."""
+    text = cache.get(wss.pk)
+    if text is not None:
+        return text
+
+    if not wss.delta_base_id:
+        text = get_keyframe_text(wss, blob_store)
+        cache.set(wss.pk, text)
+        return text
+
+    chain = {
+        node.pk: node for node in type(wss).objects.filter(
+            Q(pk=wss.delta_keyframe_id) |
+            Q(delta_keyframe_id=wss.delta_keyframe_id, pk__lt=wss.pk)
+        ).only(*CHAIN_FIELDS)
+    }
+    # Walk back to the keyframe or to the closest cached version
+    path = [wss]
+    node = wss
+    while True:
+        base = chain.get(node.delta_base_id)
+        if base is None:
+            raise ValueError(
+                f"WebSnapshot ID: {node.pk} | Base WebSnapshot "
+                f"{node.delta_base_id} of the delta chain is missing"
+            )
+        text = cache.get(base.pk)
+        if text is not None:
+            break
+        if not base.delta_base_id:
+            text = get_keyframe_text(base, blob_store)
+            cache.set(base.pk, text)
+            break
+        path.append(base)
+        node = base
+
+    for node in reversed(path):
+        text = apply_delta(text, blob_store.get(node.raw_html_key))
+        cache.set(node.pk, text)
+    return text
+
+
+def find_delta_base(wss, keyframe_interval):
+    """
+    Returns the latest offloaded WebSnapshot of the WebSource before wss,
+    None when wss has to be a keyframe.
+    """
+    if keyframe_interval <= 1:
+        return None
+
+    base_qs = type(wss).objects.filter(
+        web_source_id=wss.web_source_id, raw_html_key__isnull=False
+    )
+    if wss.pk:
+        base_qs = base_qs.filter(pk__lt=wss.pk)
+    base = base_qs.only(*CHAIN_FIELDS).order_by("-id").first()
+    if base is None or base.delta_depth + 1 >= keyframe_interval:
+        return None
+    return base
+
+
+def set_keyframe(wss, key):
+    wss.raw_html_key = key
+    wss.delta_base_id = None
+    wss.delta_keyframe_id = None
+    wss.delta_depth = 0
+
+
+def store_raw_html(wss, blob_store, keyframe_interval=RAW_HTML_KEYFRAME_INTERVAL,
+                   cache=reconstruction_cache):
+    """
+    Stores wss._raw_html in the blob store as a keyframe or as a delta, and
+    sets the raw_html_key and delta fields of wss (not saved).
+    """
+    text = wss._raw_html
+    base = find_delta_base(wss, keyframe_interval)
+    if base is not None:
+        delta = make_delta(get_raw_html(base, blob_store, cache), text)
+        if len(delta) <= len(text) * RAW_HTML_MAX_DELTA_RATIO:
+            # The key depends on the base, a delta is not content-addressed
+            wss.raw_html_key = blob_store.put(
+                f"{wss.hash_html}-{base.pk}", delta, kind="delta"
+            )
+            wss.delta_base_id = base.pk
+            wss.delta_keyframe_id = base.delta_keyframe_id or base.pk
+            wss.delta_depth = base.delta_depth + 1
+            cache.set(wss.pk, text)
+            return
+
+    set_keyframe(wss, blob_store.put(wss.hash_html, text))
+    cache.set(wss.pk, text)
+
+
+def get_descendant_ids(model, wss_id):
+    """IDs of the WebSnapshots whose delta chain goes through wss_id."""
+    descendant_ids = []
+    level = [wss_id]
+    while level:
+        level = list(
+            model.objects.filter(delta_base_id__in=level)
+            .values_list("id", flat=True)
+        )
+        descendant_ids.extend(level)
+    return descendant_ids
+
+
+def detach_raw_html(wss, blob_store, cache=reconstruction_cache):
+    """
+    Turns the WebSnapshots based on wss into keyframes so wss can be
+    deleted, their descendants are moved to the new chains. The replaced
+    delta blobs are deleted once the transaction commits, the rows still
+    point to them if it rolls back.
+    """
+    model = type(wss)
+    using = router.db_for_write(model)
+    for child in model.objects.filter(delta_base_id=wss.pk).only(*CHAIN_FIELDS):
+        text = get_raw_html(child, blob_store, cache)
+        old_key = child.raw_html_key
+        old_depth = child.delta_depth
+        set_keyframe(child, blob_store.put(child.hash_html, text))
+        model.objects.filter(pk=child.pk).update(
+            raw_html_key=child.raw_html_key, delta_base_id=None,
+            delta_keyframe_id=None, delta_depth=0
+        )
+        model.objects.filter(
+            pk__in=get_descendant_ids(model, child.pk)
+        ).update(
+            delta_keyframe_id=child.pk, delta_depth=F("delta_depth") - old_depth
+        )
+        transaction.on_commit(
+            lambda key=old_key: blob_store.delete(key), using=using
+        )
+    cache.discard(wss.pk)
@@ -1,5 +1,4 @@
 import asyncio
-import copy
 import logging
 import re
 import time
@@ -23,8 +22,11 @@ from config.recipients import WST_ERROR_REPORT_RECIPIENTS
 from config.utils import encrypt_string
 from contify.cutils.utils import send_mail_via_sendgrid
 from contify.website_tracking.constants import (
-    S3_FILE_HEADERS, WST_PATH, WST_SECRET_KEY, AUTH_PAGE_URL
+    S3_FILE_HEADERS, WST_PATH, WST_SECRET_KEY, AUTH_PAGE_URL,
+    DEFAULT_VIEWPORT_WIDTH, DEFAULT_VIEWPORT_HEIGHT, SETTLE_QUIET_MS
 )
+from contify.website_tracking.cfy_enum import ConsentStrategy
+from contify.website_tracking.diff_html.constants import JUNK_URL_PATTERNS
 
 logger = logging.getLogger(__name__)
 
@@ -94,7 +96,7 @@ def get_std_bucket_name(bucket_id, language='en'):
 
 
 def clean_invisible_element(html):
-    raw_html = copy.deepcopy(html)
+    raw_html = html
 
     if not raw_html:
         return raw_html
@@ -431,19 +433,94 @@ def set_values(string):
     return list(map(int, string.split(","))) if string else []
 
 
-async def handle_cookie_dialog(page, xpath=None):
+# Resolves once the DOM had no mutation for `quietMs` or at `timeoutMs`
+SETTLE_JS = """
+([quietMs, timeoutMs]) => new Promise(resolve => {
+    let quietTimer = null;
+    let deadline = null;
+    let observer = null;
+    const done = () => {
+        if (observer) observer.disconnect();
+        clearTimeout(quietTimer);
+        clearTimeout(deadline);
+        resolve();
+    };
+    observer = new MutationObserver(() => {
+        clearTimeout(quietTimer);
+        quietTimer = setTimeout(done, quietMs);
+    });
+    observer.observe(document, {
+        subtree: true, childList: true, attributes: true, characterData: true
+    });
+    quietTimer = setTimeout(done, quietMs);
+    deadline = setTimeout(done, timeoutMs);
+})
+"""
+
+
+async def wait_for_settle(page, timeout_ms, quiet_ms=SETTLE_QUIET_MS):
+    """
+    Waits until the page is settled: the network is idle and the DOM had no
+    mutation for `quiet_ms`, but never longer than `timeout_ms`. Returns the
+    milliseconds waited.
+    """
+    start = time.monotonic()
+
+    def remaining():
+        return timeout_ms - (time.monotonic() - start) * 1000
+
+    try:
+        await page.wait_for_load_state("networkidle", timeout=timeout_ms)
+    except PlaywrightTimeoutError:
+        pass
+    except Exception:
+        return (time.monotonic() - start) * 1000
+
+    if remaining() > 0:
+        try:
+            await page.evaluate(
+                SETTLE_JS, [min(quiet_ms, remaining()), remaining()]
+            )
+        except Exception:
+            # The page navigated or closed meanwhile
+            pass
+    return (time.monotonic() - start) * 1000
+
+
+async def pause(page, timeout_ms, settle=False):
+    """
+    Waits `timeout_ms`, or only until the page is settled (with
+    `timeout_ms` as deadline) if `settle`.
+    """
+    if settle:
+        await wait_for_settle(page, timeout_ms)
+    else:
+        await page.wait_for_timeout(timeout_ms)
+
+
+async def handle_cookie_dialog(page, xpath=None, settle=False):
     """
     Handles cookie consent popups.
     - If an XPath is provided, it tries to click the element using XPath.
     - If no XPath is provided or clicking fails, it searches for common
      'Accept' buttons.
+    Returns the (ConsentStrategy, selector) that accepted the dialog,
+    (NO_DIALOG, xpath) if the XPath matches nothing once the page is loaded,
+    None if the dialog was not accepted.
     """
     try:
         if xpath:
-            await page.wait_for_selector(f'xpath={xpath}', timeout=3000)
+            try:
+                await page.wait_for_selector(f'xpath={xpath}', timeout=3000)
+            except PlaywrightTimeoutError:
+                # Absent from the loaded page, not only slow to render
+                await page.wait_for_load_state("load", timeout=3000)
+                if not await page.locator(f'xpath={xpath}').count():
+                    return ConsentStrategy.NO_DIALOG, xpath
+                return None
             await page.locator(f'xpath={xpath}').first.click()
-            await page.wait_for_timeout(1000)
-            return
+            await pause(page, 1000, settle=settle)
+            return ConsentStrategy.XPATH, xpath
 
         await page.wait_for_selector("button, a", timeout=2000)
         search_texts = (
@@ -453,15 +530,57 @@ async def handle_cookie_dialog(page, xpath=None):
         elements = await page.locator("button, a").all()
         for element in elements:
             text = await element.inner_text()
-            if (
-                    text and
-                    any(accept_text in text for accept_text in search_texts)
-            ):
+            accept_text = next(
+                (t for t in search_texts if text and t in text), None
+            )
+            if accept_text:
                 await element.click()
-                await page.wait_for_timeout(1000)
-                break
+                await pause(page, 1000, settle=settle)
+                return ConsentStrategy.TEXT, accept_text
     except Exception:
         pass
+    return None
+
+
+async def route_resources(page, resource_types=(), url_patterns=None,
+                          resource_cache=None, domain=None):
+    """
+    Aborts the requests of the page whose resource type is in
+    `resource_types` or whose URL contains one of the `url_patterns`
+    (tracker domains by default). The rest are served through the
+    `resource_cache` of the `domain` if given, or continued untouched.
+    Any route set before on the page is replaced.
+    """
+    resource_types = frozenset(resource_types)
+    if url_patterns is None:
+        url_patterns = JUNK_URL_PATTERNS
+
+    async def handle_route(route):
+        request = route.request
+        url = request.url.lower()
+        if (
+                request.resource_type in resource_types or
+                any(pattern in url for pattern in url_patterns)
+        ):
+            await route.abort()
+        elif resource_cache is not None:
+            await resource_cache.handle_route(route, domain=domain)
+        else:
+            await route.continue_()
+
+    await page.unroute("**/*")
+    await page.route("**/*", handle_route)
+
+
+async def fit_viewport_to_page(page, settle=False):
+    """Resizes the viewport to the full height of the page."""
+    await pause(page, 1000, settle=settle)
+    height = await page.evaluate("document.documentElement.offsetHeight")
+    if height > DEFAULT_VIEWPORT_HEIGHT:
+        await page.set_viewport_size({
+            "width": DEFAULT_VIEWPORT_WIDTH,
+            "height": height - 10
+        })
 
 
 async def authenticate_context(context, dh_id):
@@ -501,35 +620,140 @@ async def authenticate_context(context, dh_id):
     return context
 
 
-async def close_all_popups(page, max_layers=3):
+POPUP_CLOSE_SELECTORS = [
+    'button[aria-label="Close"]',
+    'button[aria-label="Dismiss"]',
+    'button[title="Close"]',
+    'button[title="Dismiss"]',
+    'button:has-text("×")',
+    'button:has-text("Close")',
+    'button:has-text("Dismiss")',
+    'button:has-text("Cancel")',
+    'button:has-text("Confirm")',
+    'a:has-text("Cancel")',
+    'a.cancel',
+    'button.confirm',
+    'button[data-testid="close-modal"]',
+    'button.btn-close',
+    '.close-button', '.popup-close', '.modal-close', '.overlay-close',
+    '[class*="close"]', '[id*="close"]',
+]
+HAS_TEXT_RE = re.compile(r'^(?P<css>.*):has-text\("(?P<text>.*)"\)$')
+
+# Returns the boxes of the visible elements matching the selectors, in the
+# order of the selectors. `:has-text()` is a Playwright extension, it is
+# emulated with a case-insensitive match on the text content.
+PROBE_POPUPS_JS = """
+(selectors) => {
+    const boxes = [];
+    const seen = new Set();
+    for (const [css, text] of selectors) {
+        let elements;
+        try {
+            elements = document.querySelectorAll(css);
+        } catch (e) {
+            continue;
+        }
+        for (const element of elements) {
+            if (seen.has(element)) continue;
+            if (text && !(element.textContent || "").toLowerCase().includes(text)) continue;
+            const rect = element.getBoundingClientRect();
+            if (!rect.width || !rect.height) continue;
+            const style = window.getComputedStyle(element);
+            if (style.visibility === "hidden" || style.display === "none") continue;
+            seen.add(element);
+            boxes.push({x: rect.x, y: rect.y, width: rect.width, height: rect.height});
+        }
+    }
+    return boxes;
+}
+"""
+
+
+def get_probe_selectors(selectors=None):
+    """Splits the selectors in the [css, text] pairs of PROBE_POPUPS_JS."""
+    probe_selectors = []
+    for selector in selectors or POPUP_CLOSE_SELECTORS:
+        match = HAS_TEXT_RE.match(selector)
+        if match:
+            probe_selectors.append(
+                [match.group("css"), match.group("text").lower()]
+            )
+        else:
+            probe_selectors.append([selector, None])
+    return probe_selectors
+
+
+PROBE_SELECTORS = get_probe_selectors()
+MAX_POPUP_CLICKS = 20  # Per layer, guards against pages adding close buttons
+
+
+async def click_box(page, box):
+    """Moves to the center of the box and clicks like a human."""
+    await page.mouse.move(
+        box["x"] + box["width"] / 2, box["y"] + box["height"] / 2
+    )
+    await page.mouse.click(
+        box["x"] + box["width"] / 2, box["y"] + box["height"] / 2
+    )
+
+
+async def close_all_popups(page, max_layers=3, settle=False):
     """
     Closes up to `max_layers` popups/modals by clicking 'X' or 'dismiss' buttons.
     Designed to handle stacked or dynamically loaded popups.
     Simulates human-like clicking behavior to avoid screen glitches.
+    With `settle` it waits for the page to settle after a click instead of a
+    fixed 800ms.
+
+    All the selectors are probed in the page by a single script, the
+    candidates are probed again after each click as the click may have
+    removed or moved them.
     """
-    close_selectors = [
-        'button[aria-label="Close"]',
-        'button[aria-label="Dismiss"]',
-        'button[title="Close"]',
-        'button[title="Dismiss"]',
-        'button:has-text("×")',
-        'button:has-text("Close")',
-        'button:has-text("Dismiss")',
-        'button:has-text("Cancel")',
-        'button:has-text("Confirm")',
-        'a:has-text("Cancel")',
-        'a.cancel',
-        'button.confirm',
-        'button[data-testid="close-modal"]',
-        'button.btn-close',
-        '.close-button', '.popup-close', '.modal-close', '.overlay-close',
-        '[class*="close"]', '[id*="close"]',
-    ]
+    async def probe():
+        try:
+            boxes = await page.evaluate(PROBE_POPUPS_JS, PROBE_SELECTORS)
+        except Exception:
+            return []
+        return [
+            box for box in boxes
+            if f"{box['x']}-{box['y']}-{box['width']}-{box['height']}"
+            not in seen_elements
+        ]
 
     seen_elements = set()
     for _ in range(max_layers):
         found = False
-        for selector in close_selectors:
+        boxes = await probe()
+        for _ in range(MAX_POPUP_CLICKS):
+            if not boxes:
+                break
+            box = boxes[0]
+            seen_elements.add(
+                f"{box['x']}-{box['y']}-{box['width']}-{box['height']}"
+            )
+            try:
+                await click_box(page, box)
+                await pause(page, 800, settle=settle)
+            except Exception:
+                break
+            found = True
+            boxes = await probe()
+
+        if not found:
+            break
+
+
+async def close_all_popups_by_locator(page, max_layers=3, settle=False):
+    """
+    Locator based implementation of close_all_popups, every selector, match
+    and box is a separate round trip to the browser. Kept for the
+    benchmark_close_popups command.
+    """
+    seen_elements = set()
+    for _ in range(max_layers):
+        found = False
+        for selector in POPUP_CLOSE_SELECTORS:
             try:
                 locator = page.locator(selector)
                 count = await locator.count()
@@ -544,16 +768,8 @@ async def close_all_popups(page, max_layers=3):
                             continue
                         seen_elements.add(identifier)
 
-                        # Move and click like a human
-                        await page.mouse.move(
-                            box["x"] + box["width"] / 2,
-                            box["y"] + box["height"] / 2
-                        )
-                        await page.mouse.click(
-                            box["x"] + box["width"] / 2,
-                            box["y"] + box["height"] / 2
-                        )
-                        await page.wait_for_timeout(800)
+                        await click_box(page, box)
+                        await pause(page, 800, settle=settle)
                         found = True
             except:
                 continue
@@ -0,0 +1,33 @@
+# Generated by Django 3.0.5 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web_snapshot', '0004_auto_20231009_1714'),
+    ]
+
+    operations = [
+        # The column keeps its name, only the model field is renamed
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RenameField(
+                    model_name='websnapshot',
+                    old_name='raw_html',
+                    new_name='_raw_html',
+                ),
+                migrations.AlterField(
+                    model_name='websnapshot',
+                    name='_raw_html',
+                    field=models.TextField(blank=True, db_column='raw_html', help_text='The web content of the URL', verbose_name='raw html'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='websnapshot',
+            name='raw_html_key',
+            field=models.CharField(blank=True, help_text='Key of the compressed raw_html in the blob store', max_length=255, null=True),
+        ),
+    ]
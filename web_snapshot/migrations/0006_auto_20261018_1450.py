@@ -0,0 +1,28 @@
+# Generated by Django 3.0.5 on 2026-10-18 14:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web_snapshot', '0005_auto_20261018_1420'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='websnapshot',
+            name='delta_base_id',
+            field=models.PositiveIntegerField(blank=True, db_index=True, help_text='WebSnapshot the raw_html delta is computed against', null=True),
+        ),
+        migrations.AddField(
+            model_name='websnapshot',
+            name='delta_depth',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Number of deltas from the keyframe'),
+        ),
+        migrations.AddField(
+            model_name='websnapshot',
+            name='delta_keyframe_id',
+            field=models.PositiveIntegerField(blank=True, db_index=True, help_text='Keyframe WebSnapshot of the delta chain', null=True),
+        ),
+    ]
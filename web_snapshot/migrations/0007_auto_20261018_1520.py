@@ -0,0 +1,36 @@
+# Generated by Django 3.0.5 on 2026-10-18 15:20
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # The ALTER of web_source_id (smallint to integer) rewrites the table
+    # under an ACCESS EXCLUSIVE lock, run this migration in a maintenance
+    # window. The indexes are built concurrently afterwards, which can not
+    # run inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('web_snapshot', '0006_auto_20261018_1450'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='websnapshot',
+            name='web_source_id',
+            field=models.PositiveIntegerField(),
+        ),
+        AddIndexConcurrently(
+            model_name='websnapshot',
+            index=models.Index(fields=['web_source_id', 'status', '-created_on'], name='wss_source_status_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='websnapshot',
+            index=models.Index(condition=models.Q(('state', 0), ('status', 0)), fields=['web_source_id', 'created_on'], name='wss_draft_source_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='websnapshot',
+            index=models.Index(condition=models.Q(status=1), fields=['web_source_id', '-created_on'], name='wss_processed_source_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.0.5 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web_snapshot', '0007_auto_20261018_1520'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebSourceHead',
+            fields=[
+                ('web_source_id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('latest_snapshot_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('hash_html', models.TextField(blank=True, null=True)),
+                ('processed_snapshot_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('draft_snapshot_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('updated_on', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.0.5 on 2026-10-18 16:00
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # The index is built concurrently, which can not run inside a
+    # transaction.
+    atomic = False
+
+    dependencies = [
+        ('web_snapshot', '0008_auto_20261018_1540'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='websnapshot',
+            index=models.Index(condition=models.Q(raw_html_key__isnull=False), fields=['raw_html_key'], name='wss_raw_html_key_idx'),
+        ),
+    ]
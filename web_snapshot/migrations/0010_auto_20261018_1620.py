@@ -0,0 +1,18 @@
+# Generated by Django 3.0.5 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web_snapshot', '0009_auto_20261018_1600'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='websnapshot',
+            name='capture_attempts',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Failed runs of the deferred screenshot (capture_web_snapshot)'),
+        ),
+    ]
@@ -4,13 +4,26 @@ import os
 
 from django.contrib.postgres.fields import JSONField
 from django.core.serializers.json import DjangoJSONEncoder
-from django.db import models
+from django.db import models, router, transaction
 
 from contify.cutils.utils import get_choices
 from contify.website_tracking import cfy_enum as wt_enum
+from contify.website_tracking.blob_store import get_blob_store
+from contify.website_tracking.snapshot_delta import (
+    get_raw_html, store_raw_html, reconstruction_cache
+)
 from contify.website_tracking.utils import get_storage
 
 
+def get_blob_store_or_raise():
+    blob_store = get_blob_store()
+    if blob_store is None:
+        raise RuntimeError(
+            "raw_html is offloaded but no blob store backend is configured."
+        )
+    return blob_store
+
+
 class WebSnapshot(models.Model):
     """
     It is just like the VCS for the web-content of an URL.
@@ -30,7 +43,8 @@ class WebSnapshot(models.Model):
     #     WebSource, related_name="wt_client_source_set",
     #     on_delete=models.CASCADE
     # )
-    web_source_id = models.PositiveSmallIntegerField(db_index=True)
+    # Indexed by the composite indexes of Meta.indexes (leading column)
+    web_source_id = models.PositiveIntegerField()
 
     state = models.PositiveSmallIntegerField(
         choices=get_choices(wt_enum.State), db_index=True,
@@ -45,11 +59,36 @@ class WebSnapshot(models.Model):
         db_index=True, unique=True,
         help_text="hash of the raw_html and used for uniqueness"
     )
-    raw_html = models.TextField(help_text="The web content of the URL")
+    # Use the `raw_html` property, the html is empty here when it is
+    # offloaded to the blob store (raw_html_key)
+    _raw_html = models.TextField(
+        db_column="raw_html", blank=True, verbose_name="raw html",
+        help_text="The web content of the URL"
+    )
+    raw_html_key = models.CharField(
+        max_length=255, null=True, blank=True,
+        help_text="Key of the compressed raw_html in the blob store"
+    )
+    # Delta chain of the offloaded raw_html, see snapshot_delta
+    delta_base_id = models.PositiveIntegerField(
+        null=True, blank=True, db_index=True,
+        help_text="WebSnapshot the raw_html delta is computed against"
+    )
+    delta_keyframe_id = models.PositiveIntegerField(
+        null=True, blank=True, db_index=True,
+        help_text="Keyframe WebSnapshot of the delta chain"
+    )
+    delta_depth = models.PositiveSmallIntegerField(
+        default=0, help_text="Number of deltas from the keyframe"
+    )
     raw_snapshot = models.ImageField(
         storage=get_storage(), upload_to=image_upload_path,
         blank=True, null=True
     )
+    capture_attempts = models.PositiveSmallIntegerField(
+        default=0,
+        help_text="Failed runs of the deferred screenshot (capture_web_snapshot)"
+    )
 
     last_error = models.TextField(null=True, blank=True)
 
@@ -58,7 +97,6 @@ class WebSnapshot(models.Model):
 
     class Meta:
         # app_label = "web_snapshot"
-        pass
         # constraints = [
         #     models.UniqueConstraint(
         #         fields=["web_source"],
@@ -66,10 +104,191 @@ class WebSnapshot(models.Model):
         #         name="%(app_label)s_%(class)s_unique_recent_web_source"
         #     )
         # ]
+        indexes = [
+            # Latest WebSnapshot of a status per WebSource
+            models.Index(
+                fields=["web_source_id", "status", "-created_on"],
+                name="wss_source_status_created_idx"
+            ),
+            # Oldest draft per WebSource (process_web_snapshot)
+            models.Index(
+                fields=["web_source_id", "created_on"],
+                condition=models.Q(
+                    status=wt_enum.SnapshotStatus.DRAFT.value,
+                    state=wt_enum.State.ACTIVE.value
+                ),
+                name="wss_draft_source_created_idx"
+            ),
+            # Processed WebSnapshots ranked per WebSource (archive job)
+            models.Index(
+                fields=["web_source_id", "-created_on"],
+                condition=models.Q(
+                    status=wt_enum.SnapshotStatus.PROCESSED.value
+                ),
+                name="wss_processed_source_idx"
+            ),
+            # Other WebSnapshots sharing a content-addressed blob (archive
+            # job)
+            models.Index(
+                fields=["raw_html_key"],
+                condition=models.Q(raw_html_key__isnull=False),
+                name="wss_raw_html_key_idx"
+            ),
+        ]
 
     def __str__(self):
         return f"{self.hash_html}"
 
+    @property
+    def raw_html(self):
+        """
+        The web content of the URL, read from the blob store (through the
+        LRU cache of snapshot_delta) when it is offloaded.
+        """
+        if self._raw_html or not self.raw_html_key:
+            return self._raw_html
+        return get_raw_html(self, get_blob_store_or_raise())
+
+    @raw_html.setter
+    def raw_html(self, value):
+        self._raw_html = value
+        self.raw_html_key = None
+        self.delta_base_id = self.delta_keyframe_id = None
+        self.delta_depth = 0
+        reconstruction_cache.discard(self.pk)
+
+    def offload_raw_html(self, blob_store):
+        """
+        Moves raw_html to the blob store, as a keyframe or a delta, the
+        instance is not saved.
+        """
+        if self._raw_html and self.hash_html:
+            store_raw_html(self, blob_store)
+            self._raw_html = ""
+
+    def save(self, *args, **kwargs):
+        blob_store = get_blob_store()
+        update_fields = kwargs.get("update_fields")
+        if (
+                blob_store is not None and not self.raw_html_key and
+                (update_fields is None or "_raw_html" in update_fields)
+        ):
+            self.offload_raw_html(blob_store)
+            if update_fields:
+                kwargs["update_fields"] = set(update_fields) | {
+                    "raw_html_key", "delta_base_id", "delta_keyframe_id",
+                    "delta_depth"
+                }
+        with transaction.atomic(using=router.db_for_write(WebSnapshot)):
+            super().save(*args, **kwargs)
+            WebSourceHead.update_for(self)
+
+    def delete(self, *args, **kwargs):
+        wss_id = self.id
+        with transaction.atomic(using=router.db_for_write(WebSnapshot)):
+            result = super().delete(*args, **kwargs)
+            if WebSourceHead.objects.filter(
+                    models.Q(latest_snapshot_id=wss_id) |
+                    models.Q(processed_snapshot_id=wss_id) |
+                    models.Q(draft_snapshot_id=wss_id),
+                    web_source_id=self.web_source_id
+            ).exists():
+                WebSourceHead.rebuild([self.web_source_id])
+        return result
+
+
+class WebSourceHead(models.Model):
+    """
+    The latest WebSnapshots of a WebSource, so the jobs find them with a
+    primary key lookup instead of a DISTINCT ON over the WebSnapshots:
+
+    -   latest_snapshot_id / hash_html: the latest WebSnapshot of any status
+        (fetch_web_source compares the fetched page with its hash_html).
+    -   processed_snapshot_id: the latest PROCESSED WebSnapshot, the old
+        side of the next diff (process_web_snapshot).
+    -   draft_snapshot_id: the latest DRAFT WebSnapshot.
+
+    It is updated in the transaction of WebSnapshot.save() and delete(),
+    updates of WebSnapshot querysets bypass it. Rebuild it from the
+    WebSnapshots with the `rebuild_web_source_head` command.
+    """
+    web_source_id = models.PositiveIntegerField(primary_key=True)
+    latest_snapshot_id = models.PositiveIntegerField(null=True, blank=True)
+    hash_html = models.TextField(null=True, blank=True)
+    processed_snapshot_id = models.PositiveIntegerField(null=True, blank=True)
+    draft_snapshot_id = models.PositiveIntegerField(null=True, blank=True)
+
+    updated_on = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.web_source_id}: {self.latest_snapshot_id}"
+
+    @classmethod
+    def update_for(cls, wss):
+        """Moves the pointers of the WebSource of the saved WebSnapshot."""
+        head, _ = cls.objects.select_for_update().get_or_create(
+            web_source_id=wss.web_source_id
+        )
+        if head.latest_snapshot_id is None or wss.id >= head.latest_snapshot_id:
+            head.latest_snapshot_id = wss.id
+            head.hash_html = wss.hash_html
+
+        if wss.status == wt_enum.SnapshotStatus.PROCESSED.value:
+            if (
+                    head.processed_snapshot_id is None or
+                    wss.id > head.processed_snapshot_id
+            ):
+                head.processed_snapshot_id = wss.id
+        elif head.processed_snapshot_id == wss.id:
+            # No longer processed, the previous one is the latest again
+            head.processed_snapshot_id = (
+                WebSnapshot.objects.filter(
+                    web_source_id=wss.web_source_id,
+                    status=wt_enum.SnapshotStatus.PROCESSED.value
+                ).order_by("-created_on").values_list("id", flat=True).first()
+            )
+
+        if wss.status == wt_enum.SnapshotStatus.DRAFT.value:
+            if head.draft_snapshot_id is None or wss.id > head.draft_snapshot_id:
+                head.draft_snapshot_id = wss.id
+        elif head.draft_snapshot_id == wss.id:
+            head.draft_snapshot_id = None
+        head.save()
+
+    @classmethod
+    def rebuild(cls, web_source_ids):
+        """Recomputes the heads of the WebSources from their WebSnapshots."""
+        web_source_ids = set(web_source_ids)
+
+        def get_latest(**filters):
+            return {
+                ws_id: (wss_id, hash_html)
+                for ws_id, wss_id, hash_html in (
+                    WebSnapshot.objects
+                    .filter(web_source_id__in=web_source_ids, **filters)
+                    .order_by("web_source_id", "-created_on")
+                    .distinct("web_source_id")
+                    .values_list("web_source_id", "id", "hash_html")
+                )
+            }
+
+        latest = get_latest()
+        processed = get_latest(status=wt_enum.SnapshotStatus.PROCESSED.value)
+        drafts = get_latest(status=wt_enum.SnapshotStatus.DRAFT.value)
+
+        heads = []
+        for ws_id, (wss_id, hash_html) in latest.items():
+            heads.append(cls(
+                web_source_id=ws_id, latest_snapshot_id=wss_id,
+                hash_html=hash_html,
+                processed_snapshot_id=processed.get(ws_id, (None, None))[0],
+                draft_snapshot_id=drafts.get(ws_id, (None, None))[0]
+            ))
+        with transaction.atomic(using=router.db_for_write(cls)):
+            cls.objects.filter(web_source_id__in=web_source_ids).delete()
+            cls.objects.bulk_create(heads)
+        return len(heads)
+
 
 class DiffHtml(models.Model):
     """
@@ -0,0 +1,351 @@
+"""
+DB-backed work queue of the pipeline commands (WorkItem).
+
+Instead of the cron runs with a flock per shard and `id % maxShard`
+sharding, a command can enqueue the IDs it would process (`--enqueue`) and
+any number of long-running workers consume them (`--worker`):
+
+-   A worker leases a batch of items with SELECT ... FOR UPDATE SKIP
+    LOCKED, so concurrent workers never get the same items and never wait
+    for each other; throughput scales with the number of workers.
+-   A lease is a visibility timeout (WORK_LEASE_SECONDS). A heartbeat
+    thread extends the leases of the batch while it is processed; the
+    items of a crashed worker become visible again once their leases
+    expire and are retried by the other workers.
+-   An item whose batch raised is retried after WORK_RETRY_DELAY (times
+    the attempts), it fails after WORK_MAX_ATTEMPTS attempts.
+-   An object is queued only once until it is processed, enqueueing it
+    again is a no-op.
+-   With WORK_HANDOFF, a stage hands its output to the next one as soon as
+    it is committed (handoff) and wakes the idle workers of the next stage
+    up with a NOTIFY, instead of waiting for the next --enqueue run. A
+    stage with WORK_MAX_PENDING pending items refuses the handoff, the
+    objects are left to the --enqueue runs.
+
+Usage:
+    enqueue(WorkQueue.FETCH_WEB_SOURCE, ws_ids)
+
+    def handler(ws_ids): ...
+    QueueWorker(WorkQueue.FETCH_WEB_SOURCE, batch_size=20).run(handler)
+
+    handoff(WorkQueue.PROCESS_WEB_SNAPSHOT, [ws_id], using="web_snapshot")
+"""
+import logging
+import os
+import select
+import signal
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from django.db import connections, router, transaction
+from django.db.models import F, Q
+
+from contify.website_tracking.cfy_enum import WorkItemStatus
+from contify.website_tracking.constants import (
+    WORK_LEASE_SECONDS, WORK_POLL_INTERVAL, WORK_RETRY_DELAY,
+    WORK_ITEM_RETENTION, WORK_HANDOFF, WORK_MAX_PENDING
+)
+from contify.website_tracking.models import WorkItem
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_db():
+    return router.db_for_write(WorkItem)
+
+
+def enqueue(queue, object_ids, available_on=None):
+    """
+    Queues the objects, the ones already queued and not processed yet are
+    skipped.
+    """
+    available_on = available_on or datetime.now()
+    WorkItem.objects.bulk_create(
+        [
+            WorkItem(
+                queue=queue.value, object_id=object_id,
+                available_on=available_on
+            )
+            for object_id in set(object_ids)
+        ],
+        batch_size=1000, ignore_conflicts=True
+    )
+
+
+def get_channel(queue):
+    return f"wst_work_{queue.name.lower()}"
+
+
+def notify(queue):
+    """Wakes the idle workers of the queue up (PostgreSQL only)."""
+    connection = connections[get_db()]
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_notify(%s, '')", [get_channel(queue)])
+
+
+def count_pending(queue):
+    return WorkItem.objects.filter(
+        queue=queue.value, status=WorkItemStatus.PENDING.value
+    ).count()
+
+
+def handoff(queue, object_ids, using=None):
+    """
+    Queues the objects for the next stage once the current transaction of
+    the `using` database commits (right away in autocommit mode). Never
+    raises, an object that is not handed off is queued by the next
+    --enqueue run of the stage.
+    """
+    if not WORK_HANDOFF:
+        return
+    object_ids = list(object_ids)
+
+    def _handoff():
+        try:
+            max_pending = WORK_MAX_PENDING.get(queue.name)
+            if max_pending and count_pending(queue) >= max_pending:
+                logger.info(
+                    f"WorkQueue! {queue.name} is full, {len(object_ids)} "
+                    f"item(s) left to the next --enqueue run"
+                )
+                return
+            enqueue(queue, object_ids)
+            notify(queue)
+        except Exception as err:
+            logger.info(
+                f"WorkQueue! Unable to hand {object_ids} off to {queue.name} "
+                f"| Error: {err}"
+            )
+
+    transaction.on_commit(_handoff, using=using)
+
+
+def lease(queue, worker_id, limit, lease_seconds=WORK_LEASE_SECONDS):
+    """
+    Leases up to `limit` available items of the queue: pending ones whose
+    available_on passed and leased ones whose lease expired.
+    """
+    now = datetime.now()
+    with transaction.atomic(using=get_db()):
+        # Expired leases without attempts left
+        WorkItem.objects.filter(
+            queue=queue.value, status=WorkItemStatus.LEASED.value,
+            leased_until__lt=now, attempts__gte=F("max_attempts")
+        ).update(
+            status=WorkItemStatus.FAILED.value, updated_on=now,
+            last_error="Lease expired after the last attempt"
+        )
+
+        item_ids = list(
+            WorkItem.objects.select_for_update(skip_locked=True)
+            .filter(queue=queue.value)
+            .filter(
+                Q(status=WorkItemStatus.PENDING.value, available_on__lte=now) |
+                Q(status=WorkItemStatus.LEASED.value, leased_until__lt=now)
+            )
+            .order_by("available_on")
+            .values_list("id", flat=True)[:limit]
+        )
+        WorkItem.objects.filter(id__in=item_ids).update(
+            status=WorkItemStatus.LEASED.value, leased_by=worker_id,
+            leased_until=now + timedelta(seconds=lease_seconds),
+            attempts=F("attempts") + 1, updated_on=now
+        )
+    return list(WorkItem.objects.filter(id__in=item_ids).order_by("id"))
+
+
+def extend_leases(item_ids, worker_id, lease_seconds=WORK_LEASE_SECONDS):
+    now = datetime.now()
+    return WorkItem.objects.filter(
+        id__in=item_ids, status=WorkItemStatus.LEASED.value,
+        leased_by=worker_id
+    ).update(
+        leased_until=now + timedelta(seconds=lease_seconds), updated_on=now
+    )
+
+
+def complete(item_ids, worker_id):
+    return WorkItem.objects.filter(
+        id__in=item_ids, status=WorkItemStatus.LEASED.value,
+        leased_by=worker_id
+    ).update(
+        status=WorkItemStatus.DONE.value, leased_until=None,
+        updated_on=datetime.now()
+    )
+
+
+def fail(items, worker_id, error, retry_delay=WORK_RETRY_DELAY):
+    """Makes the items available again after a delay, or fails them."""
+    now = datetime.now()
+    for item in items:
+        if item.attempts >= item.max_attempts:
+            status, available_on = WorkItemStatus.FAILED.value, item.available_on
+        else:
+            status = WorkItemStatus.PENDING.value
+            available_on = now + timedelta(seconds=retry_delay * item.attempts)
+        WorkItem.objects.filter(
+            id=item.id, status=WorkItemStatus.LEASED.value, leased_by=worker_id
+        ).update(
+            status=status, available_on=available_on, leased_until=None,
+            last_error=error, updated_on=now
+        )
+
+
+def purge(days=WORK_ITEM_RETENTION):
+    """Deletes the done and failed items older than `days`."""
+    deleted, _ = WorkItem.objects.filter(
+        status__in=[WorkItemStatus.DONE.value, WorkItemStatus.FAILED.value],
+        updated_on__lt=datetime.now() - timedelta(days=days)
+    ).delete()
+    return deleted
+
+
+class Heartbeat(threading.Thread):
+    """Extends the leases of the items every third of the lease."""
+
+    def __init__(self, item_ids, worker_id, lease_seconds=WORK_LEASE_SECONDS):
+        super().__init__(daemon=True)
+        self.item_ids = item_ids
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self._stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self._stopped.wait(self.lease_seconds / 3):
+                try:
+                    extend_leases(
+                        self.item_ids, self.worker_id, self.lease_seconds
+                    )
+                except Exception as err:
+                    logger.info(f"WorkQueue! Heartbeat failed | Error: {err}")
+        finally:
+            connections[get_db()].close()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class QueueWorker:
+    """
+    Long-running consumer of a queue. `handler` gets the object IDs of a
+    leased batch, the items are completed when it returns and retried when
+    it raises. SIGTERM/SIGINT stop the worker after the current batch.
+    """
+
+    def __init__(self, queue, batch_size, lease_seconds=WORK_LEASE_SECONDS,
+                 poll_interval=WORK_POLL_INTERVAL, max_batches=None):
+        self.queue = queue
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_batches = max_batches
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping = False
+        self.processed = 0
+        self.failed = 0
+        self.listen_conn = None
+
+    def stop(self, *args):
+        logger.info(
+            f"WorkQueue! Worker {self.worker_id} of {self.queue.name} stops "
+            f"after the current batch"
+        )
+        self.stopping = True
+
+    def listen(self):
+        """LISTENs on the channel of the queue, again after a reconnect."""
+        connection = connections[get_db()]
+        if connection.vendor != "postgresql":
+            return
+        connection.ensure_connection()
+        if connection.connection is self.listen_conn:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN "{get_channel(self.queue)}"')
+        self.listen_conn = connection.connection
+
+    def wait(self):
+        """
+        Waits for a NOTIFY of the queue, at most poll_interval seconds (the
+        retried and expired items are not notified).
+        """
+        try:
+            self.listen()
+        except Exception as err:
+            logger.info(f"WorkQueue! Unable to LISTEN | Error: {err}")
+            self.listen_conn = None
+
+        if self.listen_conn is None:
+            time.sleep(self.poll_interval)
+            return
+
+        # Already read from the socket by an earlier query (e.g. lease())
+        self.listen_conn.poll()
+        if self.listen_conn.notifies:
+            self.listen_conn.notifies.clear()
+            return
+
+        ready, _, _ = select.select(
+            [self.listen_conn], [], [], self.poll_interval
+        )
+        if ready:
+            self.listen_conn.poll()
+            self.listen_conn.notifies.clear()
+
+    def run(self, handler):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        logger.info(
+            f"WorkQueue! Worker {self.worker_id} started on {self.queue.name}"
+        )
+
+        batches = 0
+        while not self.stopping:
+            if self.max_batches is not None and batches >= self.max_batches:
+                break
+
+            items = lease(
+                self.queue, self.worker_id, self.batch_size, self.lease_seconds
+            )
+            if not items:
+                self.wait()
+                continue
+
+            batches += 1
+            item_ids = [item.id for item in items]
+            with Heartbeat(item_ids, self.worker_id, self.lease_seconds):
+                try:
+                    handler([item.object_id for item in items])
+                except Exception as err:
+                    self.failed += len(items)
+                    logger.info(
+                        f"WorkQueue! {self.queue.name} batch of "
+                        f"{len(items)} item(s) failed | Error: {err} | "
+                        f"Traceback: {traceback.format_exc()}"
+                    )
+                    fail(items, self.worker_id, traceback.format_exc()[:2000])
+                    continue
+
+            complete(item_ids, self.worker_id)
+            self.processed += len(items)
+
+        logger.info(
+            f"WorkQueue! Worker {self.worker_id} of {self.queue.name} stopped "
+            f"| Batches: {batches} | Processed: {self.processed} | "
+            f"Failed: {self.failed}"
+        )